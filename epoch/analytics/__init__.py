@@ -0,0 +1,3 @@
+#!/usr/bin/python
+
+# python modules
\ No newline at end of file
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+# python modules
+import calendar
+import datetime
+import json
+import os
+import shutil
+import time
+
+# pip modules
+import numpy
+
+# the columns of archived session logs, with their types
+SESSION_COLUMNS = [('user', 'int32'), ('start', 'int64'), ('work_time', 'int64'), ('approved', 'bool')]
+
+# the columns of archived state changes, with their types
+STATE_COLUMNS = [('user', 'int32'), ('creation', 'int64'), ('state', 'int8'), ('prev_state', 'int8')]
+
+# states are archived as their index in this list
+STATES = ['OFFLINE', 'ONLINE', 'PAUSED']
+
+# the file describing an archived month
+META_NAME = 'meta.json'
+
+def month_name(year, month):
+    '''
+    Args:
+        year: The year of the month
+        month: The month, from 1 to 12
+
+    Returns:
+        The name of the month in the archive, in the form of 'YYYY-MM'.
+    '''
+    return '%04d-%02d' % (int(year), int(month))
+
+def parse_month(name):
+    '''
+    Args:
+        name: The name of a month in the form of 'YYYY-MM'
+
+    Returns:
+        The month in the form of (year, month), where each element is an int.
+    '''
+    parts = str(name).split('-')
+    year = int(parts[0])
+    month = int(parts[1])
+
+    if month < 1 or month > 12:
+        raise ValueError('Unknown month ' + str(name))
+
+    return (year, month)
+
+def month_bounds(year, month):
+    '''
+    Args:
+        year: The year of the month
+        month: The month, from 1 to 12
+
+    Returns:
+        The local start of the month and of the next month, in the form of
+        (start, end), as datetime objects.
+    '''
+    start = datetime.datetime(year, month, 1)
+    days = calendar.monthrange(year, month)[1]
+    end = start + datetime.timedelta(days=days)
+    return (start, end)
+
+def list_months(directory):
+    '''
+    Args:
+        directory: The directory of the archive
+
+    Returns:
+        The sorted names of the months in the archive.
+    '''
+    months = []
+
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if os.path.isfile(os.path.join(directory, name, META_NAME)):
+                months.append(name)
+
+    months.sort()
+    return months
+
+class ArchiveWriter(object):
+    '''
+    Writes one month of the archive. Rows are appended in chunks to one raw
+    file per column, so the month never has to fit in memory, and the month
+    only appears in the archive once close() succeeds.
+    '''
+    def __init__(self, directory, month, users):
+        '''
+        Args:
+            directory: The directory of the archive
+            month: The name of the month, in the form of 'YYYY-MM'
+            users: The users of the month in the form of (uuid, username, team),
+                the archived rows refer to users by their index in this list
+        '''
+        self.directory = directory
+        self.month = str(month)
+        self.users = [[str(uuid), str(name), int(team)] for uuid, name, team in users]
+
+        self.path = os.path.join(directory, self.month)
+        self.tmp_path = self.path + '.tmp'
+
+        if os.path.isdir(self.tmp_path):
+            shutil.rmtree(self.tmp_path)
+        os.makedirs(self.tmp_path)
+
+        self.counts = {'session': 0, 'state': 0}
+        self.files = {}
+        for table, columns in (('session', SESSION_COLUMNS), ('state', STATE_COLUMNS)):
+            for name, dtype in columns:
+                self.files[(table, name)] = open(os.path.join(self.tmp_path, _column_file(table, name)), 'wb')
+
+    def append_sessions(self, user, start, work_time, approved):
+        '''
+        Appends a chunk of session logs. Every argument is a sequence of the same length.
+
+        Args:
+            user: The index of the user of each log
+            start: The start of each log, as seconds since the epoch
+            work_time: The worked time of each log, in milliseconds
+            approved: Whether each log was approved
+        '''
+        self._append('session', SESSION_COLUMNS, (user, start, work_time, approved))
+
+    def append_states(self, user, creation, state, prev_state):
+        '''
+        Appends a chunk of state changes. Every argument is a sequence of the same length.
+
+        Args:
+            user: The index of the user of each change
+            creation: The time of each change, as seconds since the epoch
+            state: The index in STATES of the new state
+            prev_state: The index in STATES of the previous state
+        '''
+        self._append('state', STATE_COLUMNS, (user, creation, state, prev_state))
+
+    def close(self):
+        '''
+        Writes the description of the month and moves it into the archive,
+        replacing an older snapshot of the same month.
+        '''
+        for f in self.files.values():
+            f.close()
+
+        year, month = parse_month(self.month)
+        start, end = month_bounds(year, month)
+
+        meta = {}
+        meta['month'] = self.month
+        meta['start'] = int(time.mktime(start.timetuple()))
+        meta['end'] = int(time.mktime(end.timetuple()))
+        meta['created'] = int(time.time())
+        meta['users'] = self.users
+        meta['counts'] = self.counts
+
+        f = open(os.path.join(self.tmp_path, META_NAME), 'w')
+        f.write(json.dumps(meta))
+        f.close()
+
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        os.rename(self.tmp_path, self.path)
+
+    def abort(self):
+        '''
+        Throws away what was written, leaving the archive untouched.
+        '''
+        for f in self.files.values():
+            f.close()
+        shutil.rmtree(self.tmp_path, True)
+
+    def _append(self, table, columns, values):
+        '''
+        Appends one chunk of values to the files of a table.
+        '''
+        count = None
+        for (name, dtype), value in zip(columns, values):
+            array = numpy.asarray(value, dtype=dtype)
+            if count is not None and len(array) != count:
+                raise ValueError('Columns of a chunk must have the same length.')
+            count = len(array)
+
+            array.tofile(self.files[(table, name)])
+
+        self.counts[table] = self.counts[table] + int(count or 0)
+
+class ArchiveMonth(object):
+    '''
+    One archived month, with its columns memory-mapped from disk.
+    '''
+    def __init__(self, directory, month):
+        '''
+        Args:
+            directory: The directory of the archive
+            month: The name of the month, in the form of 'YYYY-MM'
+        '''
+        self.month = str(month)
+        self.path = os.path.join(directory, self.month)
+
+        f = open(os.path.join(self.path, META_NAME), 'r')
+        meta = json.loads(f.read())
+        f.close()
+
+        self.start = int(meta['start'])
+        self.end = int(meta['end'])
+        self.users = [(str(uuid), str(name), int(team)) for uuid, name, team in meta['users']]
+
+        self.sessions = self._map('session', SESSION_COLUMNS, int(meta['counts']['session']))
+        self.states = self._map('state', STATE_COLUMNS, int(meta['counts']['state']))
+
+    def __str__(self):
+        return 'month=' + str(self.month) + ', sessions=' + str(len(self.sessions['user'])) + ', states=' + str(len(self.states['user']))
+
+    def _map(self, table, columns, count):
+        '''
+        Returns:
+            A dictionary of column name to a read-only array over its file.
+        '''
+        result = {}
+        for name, dtype in columns:
+            if count == 0:
+                # an empty file can not be memory-mapped
+                result[name] = numpy.zeros(0, dtype=dtype)
+            else:
+                result[name] = numpy.memmap(os.path.join(self.path, _column_file(table, name)), dtype=dtype, mode='r', shape=(count,))
+
+        return result
+
+def _column_file(table, name):
+    '''
+    Returns:
+        The name of the file holding a column of a table.
+    '''
+    return str(table) + '_' + str(name) + '.bin'
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+# local modules
+from analytics import archive
+from analytics import report
+
+# python modules
+import shutil
+import tempfile
+import time
+
+# pip modules
+import numpy
+
+# how many synthetic rows are generated at a time
+CHUNK_SIZE = 1000000
+
+# the synthetic month that is generated
+BENCHMARK_MONTH = '2000-01'
+
+def generate_month(directory, rows, users, teams=4, seed=0):
+    '''
+    Writes a synthetic month of session logs to the archive.
+
+    Args:
+        directory: The directory of the archive
+        rows: How many session logs to generate
+        users: How many users the logs belong to
+        teams: How many teams the users belong to
+        seed: The seed of the random generator
+    '''
+    random = numpy.random.RandomState(seed)
+
+    year, month = archive.parse_month(BENCHMARK_MONTH)
+    start, end = archive.month_bounds(year, month)
+    month_start = int(time.mktime(start.timetuple()))
+    month_seconds = int(time.mktime(end.timetuple())) - month_start
+
+    user_list = [('U%08d' % i, 'user' + str(i), i % teams) for i in range(users)]
+    writer = archive.ArchiveWriter(directory, BENCHMARK_MONTH, user_list)
+
+    left = rows
+    while left > 0:
+        n = min(left, CHUNK_SIZE)
+        writer.append_sessions(random.randint(0, users, n), month_start + random.randint(0, month_seconds, n), random.randint(0, 8 * 3600000, n), random.randint(0, 2, n))
+        left = left - n
+
+    writer.close()
+
+def run(rows=5000000, users=200, directory=None):
+    '''
+    Times the vectorized archive report against the same totals computed one
+    row at a time, the way they are computed from MySQL results.
+
+    Args:
+        rows: How many synthetic session logs to report on
+        users: How many users the logs belong to
+        directory: Where to write the synthetic archive, a temporary directory by default
+
+    Returns:
+        A list in the form of (name, seconds).
+    '''
+    cleanup = directory is None
+    if cleanup:
+        directory = tempfile.mkdtemp()
+
+    try:
+        timings = []
+
+        t = time.time()
+        generate_month(directory, rows, users)
+        timings.append(('generate ' + str(rows) + ' rows', time.time() - t))
+
+        t = time.time()
+        r = report.ArchiveReport(directory, [BENCHMARK_MONTH])
+        vectorized = r.user_totals()
+        timings.append(('vectorized user totals', time.time() - t))
+
+        t = time.time()
+        r.period_totals('day')
+        timings.append(('vectorized day totals', time.time() - t))
+
+        # the row by row equivalent, over the tuples a MySQL cursor returns
+        month = archive.ArchiveMonth(directory, BENCHMARK_MONTH)
+        tuples = list(zip(month.sessions['user'].tolist(), month.sessions['work_time'].tolist(), month.sessions['approved'].tolist()))
+
+        t = time.time()
+        totals = {}
+        for user_index, work_time, approved in tuples:
+            work, approved_time, count = totals.get(user_index, (0, 0, 0))
+            if approved:
+                approved_time = approved_time + work_time
+            totals[user_index] = (work + work_time, approved_time, count + 1)
+        timings.append(('row by row user totals', time.time() - t))
+
+        # both ways must agree
+        for uuid, name, team, work, approved_time, count in vectorized:
+            if totals[int(uuid[1:])] != (work, approved_time, count):
+                raise ValueError('Vectorized totals of ' + str(uuid) + ' do not match.')
+
+        return timings
+    finally:
+        if cleanup:
+            shutil.rmtree(directory, True)
+
+def run_sql(start_date, end_date):
+    '''
+    Times the totals of a date range computed by MySQL, and streamed row by
+    row from MySQL, for comparison with an archive report of the same range.
+
+    Args:
+        start_date: The starting date in the form of 'YYYY-MM-DD HH:MM:SS'
+        end_date: The ending date in the form of 'YYYY-MM-DD HH:MM:SS'
+
+    Returns:
+        A list in the form of (name, seconds).
+    '''
+    # only needs a database when asked to
+    from component import user_session
+
+    timings = []
+
+    t = time.time()
+    user_session.get_session_totals(start_date, end_date)
+    timings.append(('sql grouped totals', time.time() - t))
+
+    t = time.time()
+    totals = {}
+    for log_id, user_id, username, team, work_time, start, end, approved in user_session.iter_session_logs(start_date, end_date):
+        totals[user_id] = totals.get(user_id, 0) + work_time
+    timings.append(('sql streamed totals', time.time() - t))
+
+    return timings
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+# python modules
+import bisect
+import datetime
+import heapq
+
+# the kinds of findings, and what they mean
+FINDINGS = {
+    'duplicate': 'two session logs cover exactly the same time',
+    'manual_overlap': 'a session log added by hand is on the same day as another session log',
+    'overlap': 'two session logs overlap in time',
+}
+
+# the columns of a finding
+FINDING_COLUMNS = ['kind', 'user_id', 'username', 'log_id', 'other_log_id', 'start', 'end', 'other_start', 'other_end', 'overlap_ms']
+
+class IntervalIndex(object):
+    '''
+    The session logs of one user, sorted by start, to find the ones that
+    overlap in O(n log n).
+    '''
+    def __init__(self, intervals):
+        '''
+        Args:
+            intervals: A list in the form of (start, end, value), where start
+                and end are comparable and end is excluded
+        '''
+        self.intervals = sorted(intervals, key=lambda i: (i[0], i[1]))
+        self.starts = [i[0] for i in self.intervals]
+
+        # the latest end of the intervals up to each position, to stop searching early
+        self.max_ends = []
+        for start, end, value in self.intervals:
+            if len(self.max_ends) > 0 and self.max_ends[-1] > end:
+                end = self.max_ends[-1]
+            self.max_ends.append(end)
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def overlapping(self, start, end):
+        '''
+        Args:
+            start: The start of the interval to look for
+            end: The end of the interval to look for, excluded
+
+        Returns:
+            The intervals that overlap the given one, in the form of (start, end, value).
+        '''
+        result = []
+
+        # intervals starting at or after end can not overlap
+        i = bisect.bisect_left(self.starts, end) - 1
+        while i >= 0 and self.max_ends[i] > start:
+            if self.intervals[i][1] > start:
+                result.append(self.intervals[i])
+            i = i - 1
+
+        result.reverse()
+        return result
+
+    def overlaps(self):
+        '''
+        Sweeps the intervals by start, keeping the ones still open in a heap
+        ordered by end.
+
+        Returns:
+            A generator of every overlapping pair of intervals, in the form of
+            (first, second), where first starts before second.
+        '''
+        active = []
+        for n in range(len(self.intervals)):
+            interval = self.intervals[n]
+
+            while len(active) > 0 and active[0][0] <= interval[0]:
+                heapq.heappop(active)
+
+            for end, m in sorted(active, key=lambda a: a[1]):
+                yield (self.intervals[m], interval)
+
+            heapq.heappush(active, (interval[1], n))
+
+def log_interval(start, end):
+    '''
+    Session logs added by hand only have a date, so they cover that whole day.
+
+    Args:
+        start: The start of the session log, as a datetime
+        end: The end of the session log, as a datetime
+
+    Returns:
+        The time the session log covers in the form of (start, end), where end is excluded.
+    '''
+    if start == end:
+        day = datetime.datetime(start.year, start.month, start.day)
+        return (day, day + datetime.timedelta(days=1))
+
+    return (start, end)
+
+def find_overlaps(session_logs):
+    '''
+    Finds the session logs of each user that overlap or duplicate each other.
+
+    Args:
+        session_logs: Session logs, from user_session.iter_session_logs
+
+    Returns:
+        A list of findings in the order of FINDING_COLUMNS.
+    '''
+    users = {}
+    names = {}
+    for log_id, user_id, username, team_id, work_time, start, end, approved in session_logs:
+        interval_start, interval_end = log_interval(start, end)
+        users.setdefault(user_id, []).append((interval_start, interval_end, (log_id, work_time, start, end)))
+        names[user_id] = username
+
+    findings = []
+    for user_id in sorted(users):
+        index = IntervalIndex(users[user_id])
+        for first, second in index.overlaps():
+            findings.append(_finding(user_id, names[user_id], first, second))
+
+    return findings
+
+def _finding(user_id, username, first, second):
+    '''
+    Returns:
+        The finding for two overlapping intervals, in the order of FINDING_COLUMNS.
+    '''
+    log_id, work_time, start, end = first[2]
+    other_log_id, other_work_time, other_start, other_end = second[2]
+
+    manual = start == end or other_start == other_end
+    if first[0] == second[0] and first[1] == second[1]:
+        kind = 'duplicate'
+    elif manual:
+        kind = 'manual_overlap'
+    else:
+        kind = 'overlap'
+
+    # hand added hours have no times, so the smaller of the two may be counted twice
+    if manual:
+        overlap_ms = min(work_time, other_work_time)
+    else:
+        overlap = min(first[1], second[1]) - max(first[0], second[0])
+        overlap_ms = (overlap.days * 86400 + overlap.seconds) * 1000 + overlap.microseconds // 1000
+
+    return (kind, user_id, username, log_id, other_log_id, start, end, other_start, other_end, overlap_ms)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+# local modules
+from settings import settings
+
+# python modules
+import MySQLdb
+import MySQLdb.cursors
+import csv
+import datetime
+
+# pip modules
+import numpy
+
+# how many rows are read from MySQL at a time
+FETCH_SIZE = 10000
+
+# milliseconds in an hour
+HOUR_MS = 3600000.0
+
+# the columns of the payroll summary
+SUMMARY_COLUMNS = ['user_id', 'username', 'team', 'goal_hours', 'verified_hours', 'verified_count', 'not_verified_hours', 'not_verified_count', 'goal_difference', 'overtime_hours']
+
+# the columns of the daily and weekly buckets
+BUCKET_COLUMNS = ['user_id', 'username', 'team', 'period', 'verified_hours', 'not_verified_hours', 'overtime_hours']
+
+class Payroll(object):
+    '''
+    The payroll of a period for every user at once. Each total is an array
+    indexed like users, and each bucket is a matrix of users by days or weeks.
+    '''
+    def __init__(self, start_date, end_date, users, user, day, work_time, approved, daily_overtime, weekly_overtime):
+        '''
+        Args:
+            start_date: The first day of the period, as a date
+            end_date: The day after the period, as a date
+            users: The users in the form of (uuid, username, team, goal_hours)
+            user: The index in users of the user of each session log
+            day: The day of each session log, counted from start_date
+            work_time: The worked time of each session log, in milliseconds
+            approved: Whether each session log was approved
+            daily_overtime: The verified hours in a day past which hours are overtime
+            weekly_overtime: The verified hours in a week past which hours are overtime
+        '''
+        self.start_date = start_date
+        self.end_date = end_date
+        self.users = users
+
+        n = len(users)
+        self.days = max((end_date - start_date).days, 1)
+
+        # weeks start on monday, the first one may be partial
+        offset = start_date.weekday()
+        self.weeks = (self.days + offset + 6) // 7
+        day_week = (numpy.arange(self.days) + offset) // 7
+
+        day = numpy.clip(day, 0, self.days - 1)
+        verified_ms = numpy.where(approved, work_time, 0)
+        not_verified_ms = numpy.where(approved, 0, work_time)
+
+        # user by day buckets, as one bincount over a flattened index
+        cell = user.astype('int64') * self.days + day
+        size = n * self.days
+        self.day_verified = numpy.bincount(cell, weights=verified_ms, minlength=size).reshape(n, self.days) / HOUR_MS
+        self.day_not_verified = numpy.bincount(cell, weights=not_verified_ms, minlength=size).reshape(n, self.days) / HOUR_MS
+
+        # user by week buckets, summing the day columns of each week
+        week_matrix = numpy.zeros((self.days, self.weeks))
+        week_matrix[numpy.arange(self.days), day_week] = 1
+        self.week_verified = self.day_verified.dot(week_matrix)
+        self.week_not_verified = self.day_not_verified.dot(week_matrix)
+
+        # overtime is whichever is larger in a week: the daily or the weekly excess
+        self.day_overtime = numpy.maximum(self.day_verified - daily_overtime, 0)
+        self.week_overtime = numpy.maximum(self.day_overtime.dot(week_matrix), numpy.maximum(self.week_verified - weekly_overtime, 0))
+
+        self.verified_hours = self.day_verified.sum(axis=1)
+        self.not_verified_hours = self.day_not_verified.sum(axis=1)
+        self.verified_count = numpy.bincount(user, weights=approved, minlength=n).astype('int64')
+        self.not_verified_count = numpy.bincount(user, minlength=n) - self.verified_count
+        self.overtime_hours = self.week_overtime.sum(axis=1)
+
+        # positive is a surplus, negative a deficit
+        self.goal_hours = numpy.array([u[3] for u in users], dtype='float64')
+        self.goal_difference = self.verified_hours - self.goal_hours
+
+    def summary_rows(self):
+        '''
+        Returns:
+            A list with one row per user, in the order of SUMMARY_COLUMNS.
+        '''
+        rows = []
+        for i in range(len(self.users)):
+            uuid, name, team, goal_hours = self.users[i]
+            rows.append([uuid, name, team, goal_hours, _hours(self.verified_hours[i]), int(self.verified_count[i]), _hours(self.not_verified_hours[i]), int(self.not_verified_count[i]), _hours(self.goal_difference[i]), _hours(self.overtime_hours[i])])
+
+        return rows
+
+    def bucket_rows(self, period):
+        '''
+        Args:
+            period: Either 'day' or 'week'
+
+        Returns:
+            A list with one row per user and day, or week, that has worked
+            time, in the order of BUCKET_COLUMNS.
+        '''
+        if period == 'day':
+            verified, not_verified, overtime = self.day_verified, self.day_not_verified, self.day_overtime
+            labels = [(self.start_date + datetime.timedelta(days=d)).strftime('%Y-%m-%d') for d in range(self.days)]
+        elif period == 'week':
+            verified, not_verified, overtime = self.week_verified, self.week_not_verified, self.week_overtime
+            monday = self.start_date - datetime.timedelta(days=self.start_date.weekday())
+            labels = [(monday + datetime.timedelta(weeks=w)).strftime('%Y-%m-%d') for w in range(self.weeks)]
+        else:
+            raise ValueError('Unknown period ' + str(period) + ', expected day or week')
+
+        rows = []
+        users, periods = numpy.nonzero(verified + not_verified)
+        for i, p in zip(users.tolist(), periods.tolist()):
+            uuid, name, team, goal_hours = self.users[i]
+            rows.append([uuid, name, team, labels[p], _hours(verified[i, p]), _hours(not_verified[i, p]), _hours(overtime[i, p])])
+
+        return rows
+
+def compute_payroll(start_date, end_date, team=None, daily_overtime=None, weekly_overtime=None):
+    '''
+    Loads the session logs of every user in a period with one query, and
+    computes their payroll.
+
+    Args:
+        start_date: The starting date in the form of 'YYYY-MM-DD HH:MM:SS'
+        end_date: The ending date in the form of 'YYYY-MM-DD HH:MM:SS'
+        team: Only compute the payroll of this team, or None for everyone
+        daily_overtime: The verified hours in a day past which hours are overtime,
+            payroll_daily_overtime from the settings by default
+        weekly_overtime: The verified hours in a week past which hours are overtime,
+            payroll_weekly_overtime from the settings by default
+
+    Returns:
+        The Payroll of the period.
+    '''
+    if daily_overtime is None:
+        daily_overtime = settings.getSettings().payroll_daily_overtime
+    if weekly_overtime is None:
+        weekly_overtime = settings.getSettings().payroll_weekly_overtime
+
+    start = datetime.datetime.strptime(str(start_date), '%Y-%m-%d %H:%M:%S').date()
+    end = datetime.datetime.strptime(str(end_date), '%Y-%m-%d %H:%M:%S').date()
+
+    users = _get_users(team)
+    index = {}
+    for i in range(len(users)):
+        index[users[i][0]] = i
+
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor(MySQLdb.cursors.SSCursor)
+
+    # the day is counted by MySQL, so it follows the local calendar
+    query = '''SELECT l.user_id, DATEDIFF(l.start, %s), l.work_time, l.approved IS NOT NULL FROM log_user_session l JOIN user u ON u.uuid = l.user_id WHERE l.start >= %s AND l.start < %s'''
+    data = [str(start_date), str(start_date), str(end_date)]
+    if team is not None:
+        query = query + ''' AND u.team = %s'''
+        data.append(int(team))
+    cur.execute(query + ';', data)
+
+    user_column = []
+    day_column = []
+    work_column = []
+    approved_column = []
+    try:
+        while True:
+            rows = cur.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+
+            for user_id, day, work_time, approved in rows:
+                if str(user_id) in index:
+                    user_column.append(index[str(user_id)])
+                    day_column.append(day)
+                    work_column.append(work_time)
+                    approved_column.append(approved)
+    finally:
+        cur.close()
+
+        # commit query
+        db.commit()
+
+    return Payroll(start, end, users, numpy.array(user_column, dtype='int64'), numpy.array(day_column, dtype='int64'), numpy.array(work_column, dtype='int64'), numpy.array(approved_column, dtype='bool'), float(daily_overtime), float(weekly_overtime))
+
+def write_csv(rows, columns, out):
+    '''
+    Writes the rows of a payroll to a CSV file.
+
+    Args:
+        rows: The rows, in the order of columns
+        columns: The names of the columns
+        out: The file to write to
+
+    Returns:
+        The number of rows written.
+    '''
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    writer.writerows(rows)
+    return len(rows)
+
+def _get_users(team=None):
+    '''
+    Returns:
+        The users, of the team if given, in the form of (uuid, username, team, goal_hours).
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''SELECT uuid, username, team, monthly_hours FROM user'''
+    data = []
+    if team is not None:
+        query = query + ''' WHERE team = %s'''
+        data.append(int(team))
+    cur.execute(query + ''' ORDER BY username;''', data)
+
+    users = []
+    for tup in cur:
+        users.append((str(tup[0]), str(tup[1]), int(tup[2]), int(tup[3] or 0)))
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return users
+
+def _hours(value):
+    '''
+    Returns:
+        The hours rounded the way reports show them.
+    '''
+    return '%.2f' % value
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+
+# local modules
+from settings import settings
+
+# python modules
+import MySQLdb
+import MySQLdb.cursors
+import itertools
+import multiprocessing
+
+# how many rows are read from MySQL at a time
+FETCH_SIZE = 10000
+
+# seconds between a state change and the session log it matches
+MATCH_TOLERANCE = 60
+
+# milliseconds of credit a session log may differ from its transitions by
+CREDIT_TOLERANCE_MS = 5 * 60 * 1000
+
+# the kinds of discrepancies, and what they mean
+DISCREPANCIES = {
+    'missing_log': 'the transitions show a finished session without a session log',
+    'missing_session': 'a session log without transitions to match it',
+    'lost_credit': 'the session log credits less time than the transitions show',
+    'extra_credit': 'the session log credits more time than the transitions show',
+    'unterminated': 'a session was started again without being stopped',
+    'open': 'a session was not stopped by the end of the range',
+}
+
+# the columns of a discrepancy
+DISCREPANCY_COLUMNS = ['kind', 'user_id', 'log_id', 'start', 'end', 'logged_ms', 'reconstructed_ms', 'paused_ms']
+
+class Session(object):
+    '''
+    A session reconstructed from the state changes of a user.
+    '''
+    def __init__(self, user_id, start):
+        self.user_id = user_id
+        self.start = start
+        self.end = None
+        self.paused_ms = 0
+        self.pauses = 0
+        self.unterminated = False
+
+    def work_ms(self):
+        '''
+        Returns:
+            The time spent ONLINE in the session, in milliseconds.
+        '''
+        if self.end is None:
+            return 0
+        return max((self.end - self.start) * 1000 - self.paused_ms, 0)
+
+    def __str__(self):
+        return 'user_id=' + str(self.user_id) + ', start=' + str(self.start) + ', end=' + str(self.end) + ', paused_ms=' + str(self.paused_ms)
+
+def reconstruct_sessions(transitions):
+    '''
+    Rebuilds sessions and pauses from state changes in one pass, holding
+    only the open session of the current user.
+
+    Args:
+        transitions: State changes ordered by user and time, in the form of
+            (user_id, state, prev_state, creation), where creation is in
+            seconds since the epoch
+
+    Returns:
+        A generator of Session, in the order of the transitions.
+    '''
+    for user_id, changes in itertools.groupby(transitions, lambda t: t[0]):
+        session = None
+        paused_at = None
+
+        for uid, state, prev_state, creation in changes:
+            if state == 'ONLINE' and prev_state == 'OFFLINE':
+                # started again without a stop, Ex: Pulse crashed mid session
+                if session is not None:
+                    session.end = creation
+                    session.unterminated = True
+                    yield session
+
+                session = Session(user_id, creation)
+                paused_at = None
+            elif session is None:
+                # the session started before the range
+                continue
+            elif state == 'PAUSED':
+                paused_at = creation
+            elif state == 'ONLINE':
+                if paused_at is not None:
+                    session.paused_ms = session.paused_ms + (creation - paused_at) * 1000
+                    session.pauses = session.pauses + 1
+                    paused_at = None
+            elif state == 'OFFLINE':
+                if paused_at is not None:
+                    session.paused_ms = session.paused_ms + (creation - paused_at) * 1000
+                    session.pauses = session.pauses + 1
+
+                session.end = creation
+                yield session
+
+                session = None
+                paused_at = None
+
+        if session is not None:
+            yield session
+
+def compare_sessions(sessions, logs, credit_tolerance=CREDIT_TOLERANCE_MS):
+    '''
+    Cross-checks reconstructed sessions against session logs with a merge
+    join, as both are ordered by user and start.
+
+    Args:
+        sessions: A generator of Session
+        logs: Session logs ordered by user and start, in the form of
+            (log_id, user_id, start, end, work_time, session_id)
+        credit_tolerance: How many milliseconds the credit of a matched session may differ by
+
+    Returns:
+        A generator of discrepancies in the order of DISCREPANCY_COLUMNS.
+    '''
+    logs = _manual_logs_removed(logs)
+    log = next(logs, None)
+
+    for session in sessions:
+        # logs of earlier users, or earlier in time, have no session
+        while log is not None and (log[1], log[2]) < (session.user_id, session.start - MATCH_TOLERANCE):
+            yield ('missing_session', log[1], log[0], log[2], log[3], log[4], None, None)
+            log = next(logs, None)
+
+        if session.end is None:
+            yield ('open', session.user_id, None, session.start, None, None, None, session.paused_ms)
+            continue
+
+        kind = None
+        if session.unterminated:
+            kind = 'unterminated'
+
+        if log is not None and log[1] == session.user_id and abs(log[2] - session.start) <= MATCH_TOLERANCE:
+            logged = log[4]
+            reconstructed = session.work_ms()
+
+            if kind is None and logged + credit_tolerance < reconstructed:
+                kind = 'lost_credit'
+            elif kind is None and logged > reconstructed + credit_tolerance:
+                kind = 'extra_credit'
+
+            if kind is not None:
+                yield (kind, session.user_id, log[0], session.start, session.end, logged, reconstructed, session.paused_ms)
+
+            log = next(logs, None)
+        else:
+            yield (kind or 'missing_log', session.user_id, None, session.start, session.end, None, session.work_ms(), session.paused_ms)
+
+    while log is not None:
+        yield ('missing_session', log[1], log[0], log[2], log[3], log[4], None, None)
+        log = next(logs, None)
+
+def check_partition(start_date, end_date, partition=0, partitions=1, credit_tolerance=CREDIT_TOLERANCE_MS):
+    '''
+    Reconstructs the sessions of one partition of the users and cross-checks
+    them against their session logs. Each call opens its own connections, so
+    partitions can run in separate processes.
+
+    Args:
+        start_date: The starting date in the form of 'YYYY-MM-DD HH:MM:SS'
+        end_date: The ending date in the form of 'YYYY-MM-DD HH:MM:SS'
+        partition: Which partition of the users to check, from 0 to partitions - 1
+        partitions: How many partitions the users are split into
+        credit_tolerance: How many milliseconds the credit of a matched session may differ by
+
+    Returns:
+        The result in the form of (sessions, logs, discrepancies), where
+        discrepancies is a list in the order of DISCREPANCY_COLUMNS.
+    '''
+    counts = {'sessions': 0, 'logs': 0}
+
+    def count(rows, key):
+        for row in rows:
+            counts[key] = counts[key] + 1
+            yield row
+
+    # the two result sets are read side by side, so each needs its own connection
+    state_db = settings.newDatabase()
+    log_db = settings.newDatabase()
+    try:
+        end = _timestamp(log_db, end_date)
+
+        # stops after the range still close sessions started in it
+        query = '''SELECT user_id, state, prev_state, UNIX_TIMESTAMP(creation) FROM log_user_state WHERE creation >= %s AND creation < %s + INTERVAL 1 DAY'''
+        transitions = _stream(state_db, query, [str(start_date), str(end_date)], partition, partitions, 'creation')
+
+        sessions = (s for s in reconstruct_sessions(transitions) if s.start < end)
+
+        query = '''SELECT id, user_id, UNIX_TIMESTAMP(start), UNIX_TIMESTAMP(end), work_time, session_id FROM log_user_session WHERE start >= %s AND start < %s'''
+        logs = _stream(log_db, query, [str(start_date), str(end_date)], partition, partitions, 'start')
+
+        discrepancies = list(compare_sessions(count(sessions, 'sessions'), count(logs, 'logs'), credit_tolerance))
+    finally:
+        state_db.close()
+        log_db.close()
+
+    return (counts['sessions'], counts['logs'], discrepancies)
+
+def check_sessions(start_date, end_date, workers=1, credit_tolerance=CREDIT_TOLERANCE_MS):
+    '''
+    Reconstructs every session in a range from log_user_state and cross-checks
+    them against log_user_session, splitting the users across processes.
+
+    Args:
+        start_date: The starting date in the form of 'YYYY-MM-DD HH:MM:SS'
+        end_date: The ending date in the form of 'YYYY-MM-DD HH:MM:SS'
+        workers: How many processes check the users
+        credit_tolerance: How many milliseconds the credit of a matched session may differ by
+
+    Returns:
+        The result in the form of (sessions, logs, discrepancies), where
+        discrepancies is a list in the order of DISCREPANCY_COLUMNS.
+    '''
+    workers = max(int(workers), 1)
+    if workers == 1:
+        return check_partition(start_date, end_date, 0, 1, credit_tolerance)
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        results = pool.map(_check_partition, [(start_date, end_date, k, workers, credit_tolerance) for k in range(workers)])
+    finally:
+        pool.close()
+        pool.join()
+
+    sessions = 0
+    logs = 0
+    discrepancies = []
+    for s, l, d in results:
+        sessions = sessions + s
+        logs = logs + l
+        discrepancies.extend(d)
+
+    return (sessions, logs, discrepancies)
+
+def _check_partition(args):
+    '''
+    Unpacks the arguments of check_partition for Pool.map.
+    '''
+    return check_partition(*args)
+
+def _manual_logs_removed(logs):
+    '''
+    Skips session logs added with `track.py add`, which have no transitions.
+    '''
+    for log in logs:
+        log_id, user_id, start, end, work_time, session_id = log
+        if session_id is None and start == end:
+            continue
+        yield log
+
+def _stream(db, query, data, partition, partitions, column):
+    '''
+    Runs the query on a server-side cursor, for one partition of the users,
+    ordered by user and the given time column.
+
+    Returns:
+        A generator of rows.
+    '''
+    data = list(data)
+    if partitions > 1:
+        query = query + ''' AND CRC32(user_id) %% %s = %s'''
+        data.extend([int(partitions), int(partition)])
+
+    # Slack ids are upper case letters and digits, so MySQL orders them like Python
+    query = query + ''' ORDER BY user_id, ''' + column + ''', id;'''
+
+    cur = db.cursor(MySQLdb.cursors.SSCursor)
+    try:
+        cur.execute(query, data)
+
+        while True:
+            rows = cur.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+    finally:
+        cur.close()
+
+def _timestamp(db, date):
+    '''
+    Returns:
+        The date in seconds since the epoch, the way MySQL converts it.
+    '''
+    cur = db.cursor()
+    cur.execute('''SELECT UNIX_TIMESTAMP(%s);''', [str(date)])
+    value = int(cur.fetchone()[0])
+    cur.close()
+    return value
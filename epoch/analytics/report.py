@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+# local modules
+from analytics import archive
+
+# python modules
+import datetime
+
+# pip modules
+import numpy
+
+# the periods totals can be grouped by
+PERIODS = ['month', 'week', 'day']
+
+class ArchiveReport(object):
+    '''
+    Computes totals over archived months with vectorized operations on the
+    memory-mapped columns, without going back to MySQL.
+    '''
+    def __init__(self, directory, months):
+        '''
+        Args:
+            directory: The directory of the archive
+            months: The names of the months to report on, in the form of 'YYYY-MM'
+        '''
+        self.months = [archive.ArchiveMonth(directory, m) for m in months]
+
+        # one index over the users of every month
+        self.users = []
+        index = {}
+
+        # for each month, the global index of each of its users
+        self.mappings = []
+        for month in self.months:
+            mapping = numpy.zeros(len(month.users), dtype='int32')
+            for i in range(len(month.users)):
+                uuid, name, team = month.users[i]
+                if uuid not in index:
+                    index[uuid] = len(self.users)
+                    self.users.append((uuid, name, team))
+                mapping[i] = index[uuid]
+            self.mappings.append(mapping)
+
+    def user_totals(self):
+        '''
+        Returns:
+            A list in the form of (uuid, username, team, work_time, approved_time, count),
+            where the times are in milliseconds, for every user with a session log.
+        '''
+        work, approved, counts = self._user_arrays()
+
+        result = []
+        for i in numpy.nonzero(counts)[0]:
+            uuid, name, team = self.users[i]
+            result.append((uuid, name, team, int(work[i]), int(approved[i]), int(counts[i])))
+
+        return result
+
+    def team_totals(self):
+        '''
+        Returns:
+            A list in the form of (team, work_time, approved_time, count), where
+            the times are in milliseconds, ordered by team.
+        '''
+        work, approved, counts = self._user_arrays()
+        if len(self.users) == 0:
+            return []
+
+        user_teams = numpy.array([team for uuid, name, team in self.users], dtype='int64')
+        teams, team_index = numpy.unique(user_teams, return_inverse=True)
+
+        team_work = numpy.bincount(team_index, weights=work, minlength=len(teams))
+        team_approved = numpy.bincount(team_index, weights=approved, minlength=len(teams))
+        team_counts = numpy.bincount(team_index, weights=counts, minlength=len(teams))
+
+        result = []
+        for i in range(len(teams)):
+            if team_counts[i] > 0:
+                result.append((int(teams[i]), int(team_work[i]), int(team_approved[i]), int(team_counts[i])))
+
+        return result
+
+    def period_totals(self, period):
+        '''
+        Args:
+            period: One of 'month', 'week' (ISO weeks) or 'day'
+
+        Returns:
+            A list in the form of (label, work_time, approved_time, count), where
+            the times are in milliseconds, ordered by period.
+        '''
+        if period not in PERIODS:
+            raise ValueError('Unknown period ' + str(period) + ', expected one of ' + ', '.join(PERIODS))
+
+        totals = {}
+        for month in self.months:
+            sessions = month.sessions
+            year, month_number = archive.parse_month(month.month)
+            days = int((month.end - month.start) / 86400) + 1
+
+            # the day of the month of every log, in one pass
+            day_index = numpy.clip((sessions['start'] - month.start) // 86400, 0, days - 1)
+            day_work = numpy.bincount(day_index, weights=sessions['work_time'], minlength=days)
+            day_approved = numpy.bincount(day_index, weights=_approved_time(sessions), minlength=days)
+            day_counts = numpy.bincount(day_index, minlength=days)
+
+            # the month has at most 31 days, so labelling them is cheap
+            for d in numpy.nonzero(day_counts)[0]:
+                date = datetime.date(year, month_number, 1) + datetime.timedelta(days=int(d))
+                label = _period_label(date, period)
+
+                work, approved, count = totals.get(label, (0, 0, 0))
+                totals[label] = (work + int(day_work[d]), approved + int(day_approved[d]), count + int(day_counts[d]))
+
+        result = []
+        for label in sorted(totals):
+            work, approved, count = totals[label]
+            result.append((label, work, approved, count))
+
+        return result
+
+    def _user_arrays(self):
+        '''
+        Returns:
+            Arrays indexed like self.users in the form of (work_time, approved_time, count).
+        '''
+        n = len(self.users)
+        work = numpy.zeros(n, dtype='float64')
+        approved = numpy.zeros(n, dtype='float64')
+        counts = numpy.zeros(n, dtype='int64')
+
+        for month, mapping in zip(self.months, self.mappings):
+            sessions = month.sessions
+            local = len(month.users)
+
+            # each user appears once per month, so plain fancy indexing is safe
+            work[mapping] += numpy.bincount(sessions['user'], weights=sessions['work_time'], minlength=local)
+            approved[mapping] += numpy.bincount(sessions['user'], weights=_approved_time(sessions), minlength=local)
+            counts[mapping] += numpy.bincount(sessions['user'], minlength=local)
+
+        return (work, approved, counts)
+
+def _approved_time(sessions):
+    '''
+    Returns:
+        The worked time of every session log, or 0 where it was not approved.
+    '''
+    return numpy.where(sessions['approved'], sessions['work_time'], 0)
+
+def _period_label(date, period):
+    '''
+    Returns:
+        The label of the period the date belongs to.
+    '''
+    if period == 'month':
+        return date.strftime('%Y-%m')
+    elif period == 'week':
+        iso_year, iso_week, iso_day = date.isocalendar()
+        return '%04d-W%02d' % (iso_year, iso_week)
+
+    return date.strftime('%Y-%m-%d')
@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+
+# local modules
+from util import clock
+
+# python modules
+import calendar
+import datetime
+import logging
+import random
+import time
+
+# the share of users that work on a given weekday
+WORK_CHANCE = 0.9
+
+# the share of sessions with a break
+BREAK_CHANCE = 0.7
+
+class MemoryStore(object):
+    '''
+    The users, sessions and logs of a simulation, kept in memory in place of
+    MySQL. Its methods stand in for the functions of the user and
+    user_session modules that read or write the database, so Pulse and
+    slack_handle.handle_command run on it unchanged, see install().
+
+    Crediting ONLINE users is O(1): the total credited to each partition is
+    kept once, and each ONLINE user remembers the total when they went
+    ONLINE, as Pulse does.
+    '''
+    def __init__(self, users, partitions=1):
+        '''
+        Args:
+            users: A list of users in the form of (uuid, username, monthly_hours)
+            partitions: How many partitions Pulse splits the users into
+        '''
+        from component import user_session
+
+        self.users = [(uuid, username) for uuid, username, monthly_hours in users]
+        self.goal_hours = dict((uuid, monthly_hours) for uuid, username, monthly_hours in users)
+        self.partitions = partitions
+        self.partition = dict((uuid, user_session.partition_of(uuid, partitions)) for uuid, username in self.users)
+
+        # uuid to [state, work_time, updated, session_id, credit_mark]
+        self.sessions = dict((uuid, ['OFFLINE', 0, None, 0, 0]) for uuid, username in self.users)
+        self.online_credit = [0] * partitions
+        self.online = [0] * partitions
+
+        # in the form of (id, user_id, state, prev_state), the id is the position plus one
+        self.state_log = []
+
+        # in the form of (user_id, work_time, start, end, session_id)
+        self.session_logs = []
+        self.user_logs = dict((uuid, []) for uuid, username in self.users)
+
+        # uuid to (session_id, state, pause_time, notify_hour, saved)
+        self.checkpoints = {}
+
+    def get_all_users(self):
+        return list(self.users)
+
+    def get_changed_users(self, since=None, partition=None):
+        # the users of a simulation never change
+        if since is not None:
+            return [], since
+        return [(uuid, username) for uuid, username in self.users if partition is None or self.partition[uuid] == partition[0]], clock.get_clock().now()
+
+    def count_users(self, partition=None):
+        return len(self.get_uuids(partition))
+
+    def get_uuids(self, partition=None):
+        return set(uuid for uuid, username in self.users if partition is None or self.partition[uuid] == partition[0])
+
+    def get_last_state_change_id(self):
+        return len(self.state_log)
+
+    def get_state_changes(self, after_id, limit=1000):
+        return self.state_log[after_id:after_id + limit]
+
+    def log_state_change(self, uuid, state, prev_state):
+        self.state_log.append((len(self.state_log) + 1, str(uuid), str(state), str(prev_state)))
+
+    def get_state(self, uuid):
+        return self.sessions[uuid][0]
+
+    def set_state(self, uuid, state):
+        session = self.sessions[uuid]
+        session[1] = self.get_work_time(uuid)
+        partition = self.partition[uuid]
+
+        if session[0] == 'ONLINE':
+            self.online[partition] = self.online[partition] - 1
+        if state == 'ONLINE':
+            self.online[partition] = self.online[partition] + 1
+
+        session[0] = state
+        session[4] = self.online_credit[partition]
+
+    def get_states(self, partition=None):
+        return dict((uuid, (self.sessions[uuid][0], self.get_work_time(uuid))) for uuid in self.sessions if partition is None or self.partition[uuid] == partition[0])
+
+    def credit_online_users(self, incr, lease=None, partition=None):
+        if partition is None:
+            credited = range(self.partitions)
+        else:
+            credited = [partition[0]]
+
+        count = 0
+        for k in credited:
+            self.online_credit[k] = self.online_credit[k] + int(incr)
+            count = count + self.online[k]
+        return count
+
+    def transition(self, uuid, expected, state):
+        session = self.sessions[uuid]
+        if session[0] != expected:
+            return None
+
+        now = clock.get_clock().now()
+        if expected == 'OFFLINE':
+            self.set_work_time(uuid, 0)
+            session[2] = now
+            self.open_session(uuid)
+
+        self.set_state(uuid, state)
+        self.log_state_change(uuid, state, expected)
+        result = (self.get_work_time(uuid), session[2], session[3])
+
+        if state == 'OFFLINE':
+            self.create_user_session_log(uuid, result[0], result[1], now, session_id=result[2])
+            self.set_work_time(uuid, 0)
+            session[2] = now
+
+        return result
+
+    def get_work_time(self, uuid):
+        state, work_time, updated, session_id, credit_mark = self.sessions[uuid]
+        if state == 'ONLINE':
+            work_time = work_time + self.online_credit[self.partition[uuid]] - credit_mark
+        return work_time
+
+    def set_work_time(self, uuid, work_time):
+        self.sessions[uuid][1] = int(work_time)
+        self.sessions[uuid][4] = self.online_credit[self.partition[uuid]]
+
+    def get_session_timestamp(self, uuid):
+        return self.sessions[uuid][2]
+
+    def set_session_timestamp(self, uuid):
+        self.sessions[uuid][2] = clock.get_clock().now()
+
+    def open_session(self, uuid):
+        self.sessions[uuid][3] = self.sessions[uuid][3] + 1
+
+    def get_session_id(self, uuid):
+        return self.sessions[uuid][3]
+
+    def create_user_session_log(self, uuid, work_time, start_time, end_time, verified=None, session_id=None):
+        self.session_logs.append((uuid, int(work_time), start_time, end_time, session_id))
+        self.user_logs[uuid].append((start_time, int(work_time)))
+
+    def save_checkpoint(self, entries, partition=None):
+        for uuid in [uuid for uuid in self.checkpoints if partition is None or self.partition[uuid] == partition[0]]:
+            del self.checkpoints[uuid]
+
+        saved = clock.get_clock().time()
+        for uuid, state, pause_time, notify_hour in entries:
+            self.checkpoints[uuid] = (self.sessions[uuid][3], str(state), int(pause_time), int(notify_hour), saved)
+
+    def get_checkpoint(self, partition=None):
+        now = clock.get_clock().time()
+        return dict((uuid, (state, pause_time, notify_hour, int(now - saved))) for uuid, (session_id, state, pause_time, notify_hour, saved) in self.checkpoints.items() if session_id == self.sessions[uuid][3] and (partition is None or self.partition[uuid] == partition[0]))
+
+    def acquire_lease(self, name, holder, seconds):
+        return True
+
+    def release_lease(self, name, holder):
+        pass
+
+    def get_leases(self, prefix):
+        return []
+
+    def get_goal_snapshot(self, uuid):
+        today = clock.get_clock().today()
+        month_start = datetime.datetime(today.year, today.month, 1)
+
+        work_time = 0
+        for start, log_work_time in reversed(self.user_logs[uuid]):
+            if start < month_start:
+                break
+            work_time = work_time + log_work_time
+
+        return (work_time / 3600000.0, self.goal_hours[uuid])
+
+def install(store, modules):
+    '''
+    Points the database functions of the checkpoint, lease, user and user_session
+    modules that Pulse and the /epoch commands call at the store, and the Slack
+    servers of slack_handle and the given modules at a recorder, silencing the
+    logs of those modules. The responses
+    slack_handle builds for Slack are replaced, as they read what the store does
+    not keep, Ex: the commit logs.
+
+    Args:
+        store: The MemoryStore
+        modules: The modules whose slack_server sends notifications, Ex: pulse, their LOG is silenced
+
+    Returns:
+        The recorder of the messages sent, and what to give restore().
+    '''
+    from component import checkpoint
+    from component import lease
+    from component import user
+    from component import user_session
+    from server import slack_handle
+
+    recorder = MessageRecorder()
+
+    replaced = []
+    for module, names in [(checkpoint, ['save_checkpoint', 'get_checkpoint']), (lease, ['acquire_lease', 'release_lease', 'get_leases']), (user, ['get_all_users', 'get_changed_users', 'count_users', 'get_uuids', 'get_last_state_change_id', 'get_state_changes', 'log_state_change']), (user_session, ['transition', 'get_state', 'set_state', 'get_states', 'credit_online_users', 'get_work_time', 'set_work_time', 'get_session_timestamp', 'set_session_timestamp', 'open_session', 'get_session_id', 'create_user_session_log', 'get_goal_snapshot'])]:
+        for name in names:
+            replaced.append((module, name, getattr(module, name)))
+            setattr(module, name, getattr(store, name))
+
+    stubs = {
+        'Response': SimulatedResponse,
+        'build_login_response': lambda user_obj: {},
+        'build_logout_response': lambda user_obj: {},
+        'build_pause_response': lambda user_obj: {},
+        'build_resume_response': lambda user_obj: {},
+        'handle_logout_payload': lambda user_obj, session_id, worked_hours, goal_hours: None,
+    }
+    for name in sorted(stubs):
+        replaced.append((slack_handle, name, getattr(slack_handle, name)))
+        setattr(slack_handle, name, stubs[name])
+
+    for module in [slack_handle] + list(modules):
+        replaced.append((module, 'slack_server', module.slack_server))
+        module.slack_server = recorder
+
+    # so a simulation never writes into the log of the running Pulse
+    for module in modules:
+        if hasattr(module, 'LOG'):
+            replaced.append((module.LOG, 'handlers', module.LOG.handlers))
+            module.LOG.handlers = [logging.NullHandler()]
+
+    return recorder, replaced
+
+def restore(replaced):
+    '''
+    Puts back what install() replaced.
+    '''
+    for module, name, value in reversed(replaced):
+        setattr(module, name, value)
+
+class SimulatedResponse(object):
+    '''
+    Stands in for Flask's Response, keeping what slack_handle answered.
+    '''
+    def __init__(self, response=None, status=200, mimetype=None):
+        self.response = response
+        self.status = status
+        self.mimetype = mimetype
+
+class MessageRecorder(object):
+    '''
+    Stands in for the Slack server, counting the messages sent to each channel.
+    '''
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, contents, channel, username, icon_emoji):
+        self.messages.append((clock.get_clock().time(), channel, contents))
+
+    def count(self, text):
+        '''
+        Returns:
+            How many messages contained the text.
+        '''
+        return len([m for m in self.messages if text in m[2]])
+
+def run_command(uuid, username, command):
+    '''
+    Runs an /epoch command for a user through slack_handle.handle_command,
+    once install() pointed it at the store.
+
+    Returns:
+        True if the command applied to the user's state.
+    '''
+    from component import user
+    from server import slack_handle
+
+    response = slack_handle.handle_command(user.User(uuid, username), command, {})
+
+    # a command that does not apply is answered with a (response, status) pair
+    return not isinstance(response, tuple)
+
+def generate_activity(users, start, days, interval, seed=0):
+    '''
+    Generates the /epoch commands of a working day for each user on each
+    weekday: a start in the morning, an optional break, and a stop.
+
+    Args:
+        users: A list of uuids
+        start: The first day, as a datetime at midnight
+        days: How many days to generate
+        interval: Commands are aligned to this many seconds, Pulse's tick
+        seed: The seed of the random generator
+
+    Returns:
+        The commands in the form of (time, uuid, command), ordered by time,
+        and a dictionary of (uuid, session_id) to the expected work time of
+        the session in milliseconds.
+    '''
+    r = random.Random(seed)
+    origin = time.mktime(start.timetuple())
+
+    def align(seconds):
+        return origin + int(seconds) // interval * interval
+
+    commands = []
+    sessions = {}
+    counts = dict((uuid, 0) for uuid in users)
+    for day in range(days):
+        date = start + datetime.timedelta(days=day)
+        if date.weekday() >= 5:
+            continue
+
+        midnight = time.mktime(date.timetuple()) - origin
+        for uuid in users:
+            if r.random() > WORK_CHANCE:
+                continue
+
+            # start between 8 and 10 in the morning
+            login = align(midnight + 8 * 3600 + r.randint(0, 7200))
+            work = r.randint(2 * 3600, 5 * 3600)
+            day_commands = [(login, uuid, 'START')]
+            worked = 0
+
+            if r.random() < BREAK_CHANCE:
+                pause = align(login - origin + work)
+                resume = align(pause - origin + r.randint(5 * 60, 60 * 60))
+                day_commands.append((pause, uuid, 'PAUSE'))
+                day_commands.append((resume, uuid, 'RESUME'))
+                worked = pause - login
+                login = resume
+                work = r.randint(2 * 3600, 4 * 3600)
+
+            logout = align(login - origin + work)
+            day_commands.append((logout, uuid, 'STOP'))
+            worked = worked + logout - login
+
+            commands.extend(day_commands)
+            counts[uuid] = counts[uuid] + 1
+            sessions[(uuid, counts[uuid])] = int(worked * 1000)
+
+    commands.sort(key=lambda c: c[0])
+    return commands, sessions
+
+def run(users=1000, days=None, month=None, seed=0, partitions=1, restarts=0):
+    '''
+    Replays a month of /epoch commands through Pulse on a SimulatedClock,
+    ticking Pulse every WORK_INTERVAL simulated seconds, and checks that
+    every session was credited exactly the time it was ONLINE.
+
+    Args:
+        users: How many users to simulate
+        days: How many days to simulate, the whole month by default
+        month: The month to simulate in the form of (year, month), THIS month by default
+        seed: The seed of the random generator
+        partitions: How many shards the simulated Pulse splits the users into
+        restarts: How many times Pulse is restarted, evenly spread, carrying on from its checkpoint
+
+    Returns:
+        A list in the form of (name, value), with the timings in seconds and the counts.
+    '''
+    import pulse
+
+    if month is None:
+        today = datetime.date.today()
+        month = (today.year, today.month)
+    if days is None:
+        days = calendar.monthrange(month[0], month[1])[1]
+
+    start = datetime.datetime(month[0], month[1], 1)
+    user_list = [('U%08d' % i, 'user' + str(i), 160) for i in range(users)]
+
+    t = time.time()
+    commands, expected = generate_activity([u[0] for u in user_list], start, days, pulse.WORK_INTERVAL, seed)
+    results = [('generate ' + str(len(commands)) + ' commands', time.time() - t)]
+
+    names = dict((u[0], u[1]) for u in user_list)
+    store = MemoryStore(user_list, partitions)
+    recorder, replaced = install(store, [pulse])
+    simulated = clock.SimulatedClock(time.mktime(start.timetuple()))
+    previous = clock.set_clock(simulated)
+
+    try:
+        p = pulse.Pulse(partitions)
+        p.scheduler.stop()
+
+        end = time.mktime((start + datetime.timedelta(days=days)).timetuple())
+        n = 0
+        ticks = 0
+        restart_every = int((end - simulated.time()) / pulse.WORK_INTERVAL) // (restarts + 1)
+
+        t = time.time()
+        while simulated.time() < end:
+            simulated.advance(pulse.WORK_INTERVAL)
+
+            while n < len(commands) and commands[n][0] <= simulated.time():
+                run_command(commands[n][1], names[commands[n][1]], commands[n][2])
+                n = n + 1
+
+            p.work()
+            ticks = ticks + 1
+
+            # hand over to a new Pulse, as a restart does
+            if restarts > 0 and ticks % restart_every == 0 and ticks // restart_every <= restarts:
+                for partition in sorted(p.shards):
+                    p.release_shard(partition)
+                p = pulse.Pulse(partitions)
+                p.scheduler.stop()
+        results.append(('simulate ' + str(ticks) + ' ticks', time.time() - t))
+    finally:
+        clock.set_clock(previous)
+        restore(replaced)
+
+    # every session must be credited exactly what it was ONLINE
+    if len(store.session_logs) != len(expected):
+        raise ValueError(str(len(store.session_logs)) + ' sessions were logged, expected ' + str(len(expected)))
+
+    hours = 0
+    for uuid, work_time, start_time, end_time, session_id in store.session_logs:
+        if work_time != expected.get((uuid, session_id)):
+            raise ValueError('Session ' + str(session_id) + ' of ' + str(uuid) + ' was credited ' + str(work_time) + ' ms, expected ' + str(expected.get((uuid, session_id))) + ' ms')
+        hours = hours + work_time // pulse.HOUR_MS
+
+    hourly = recorder.count('You have been working for')
+    if hourly != hours:
+        raise ValueError(str(hourly) + ' hourly notifications were sent, expected ' + str(hours))
+
+    results.append(('sessions', len(store.session_logs)))
+    results.append(('hourly notifications', hourly))
+    results.append(('idle reminders', recorder.count('You have been idle/paused')))
+    results.append(('capped ticks', p.tick_stats.capped_ticks))
+
+    return results
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+# local modules
+from settings import settings
+from analytics import archive
+
+# python modules
+import MySQLdb
+import MySQLdb.cursors
+import datetime
+
+# how many rows are read from MySQL, and written to the archive, at a time
+FETCH_SIZE = 10000
+
+def snapshot_month(directory, year, month, db=None):
+    '''
+    Snapshots one closed month of log_user_session and log_user_state into
+    the archive, replacing an older snapshot of that month.
+
+    Args:
+        directory: The directory of the archive
+        year: The year of the month
+        month: The month, from 1 to 12
+        db: The connection to use, Ex: from a worker thread, the shared one by default
+
+    Returns:
+        The number of rows archived in the form of (sessions, states).
+    '''
+    if db is None:
+        # Get new database instance
+        db = settings.getDatabase()
+
+    start, end = archive.month_bounds(year, month)
+
+    # only closed months, as open months still change
+    now = datetime.datetime.now()
+    if end > datetime.datetime(now.year, now.month, 1):
+        raise ValueError('Unable to archive ' + archive.month_name(year, month) + ' as it is not closed yet.')
+
+    # the users of the month, rows refer to them by index
+    users = _get_users(db)
+    index = {}
+    for i in range(len(users)):
+        index[users[i][0]] = i
+
+    writer = archive.ArchiveWriter(directory, archive.month_name(year, month), users)
+    try:
+        query = '''SELECT user_id, UNIX_TIMESTAMP(start), work_time, approved IS NOT NULL FROM log_user_session WHERE start >= %s AND start < %s ORDER BY start, id;'''
+        for rows in _stream(db, query, (str(start), str(end))):
+            rows = [r for r in rows if str(r[0]) in index]
+            writer.append_sessions([index[str(r[0])] for r in rows], [r[1] for r in rows], [r[2] for r in rows], [r[3] for r in rows])
+
+        query = '''SELECT user_id, UNIX_TIMESTAMP(creation), state, prev_state FROM log_user_state WHERE creation >= %s AND creation < %s ORDER BY creation, id;'''
+        for rows in _stream(db, query, (str(start), str(end))):
+            rows = [r for r in rows if str(r[0]) in index]
+            writer.append_states([index[str(r[0])] for r in rows], [r[1] for r in rows], [_state_index(r[2]) for r in rows], [_state_index(r[3]) for r in rows])
+    except Exception:
+        writer.abort()
+        raise
+
+    writer.close()
+    return (writer.counts['session'], writer.counts['state'])
+
+def snapshot_closed_months(directory, db=None):
+    '''
+    Snapshots every closed month with session logs that is not archived yet.
+
+    Args:
+        directory: The directory of the archive
+        db: The connection to use, Ex: from a worker thread, the shared one by default
+
+    Returns:
+        The names of the months that were archived.
+    '''
+    now = datetime.datetime.now()
+    current = datetime.datetime(now.year, now.month, 1)
+
+    if db is None:
+        # Get new database instance
+        db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''SELECT DISTINCT YEAR(start), MONTH(start) FROM log_user_session WHERE start < %s;'''
+    cur.execute(query, [str(current)])
+
+    months = []
+    for tup in cur:
+        months.append((int(tup[0]), int(tup[1])))
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    archived = archive.list_months(directory)
+
+    result = []
+    for year, month in sorted(months):
+        name = archive.month_name(year, month)
+        if name not in archived:
+            snapshot_month(directory, year, month, db)
+            result.append(name)
+
+    return result
+
+def _get_users(db):
+    '''
+    Returns:
+        Every user in the form of (uuid, username, team).
+    '''
+    cur = db.cursor()
+    query = '''SELECT uuid, username, team FROM user ORDER BY uuid;'''
+    cur.execute(query)
+
+    users = []
+    for tup in cur:
+        users.append((str(tup[0]), str(tup[1]), int(tup[2])))
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return users
+
+def _stream(db, query, data):
+    '''
+    Runs the query on a server-side cursor.
+
+    Returns:
+        A generator of lists of at most FETCH_SIZE rows.
+    '''
+    cur = db.cursor(MySQLdb.cursors.SSCursor)
+    try:
+        cur.execute(query, data)
+
+        while True:
+            rows = cur.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cur.close()
+
+        # commit query
+        db.commit()
+
+def _state_index(state):
+    '''
+    Returns:
+        The index of the state in archive.STATES, or -1 if it is unknown.
+    '''
+    state = str(state)
+    if state in archive.STATES:
+        return archive.STATES.index(state)
+    return -1
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+
+# local modules
+from settings import settings
+
+# python modules
+import MySQLdb
+
+def save_checkpoint(entries, partition=None):
+    '''
+    Replaces the checkpoint of a partition of the users in one transaction,
+    so a Pulse taking the partition over never reads half of it. Each entry
+    is tied to the session the user is in, so it is ignored once they start
+    another.
+
+    Args:
+        entries: A list of the users that are not OFFLINE, in the form of (uuid, state, pause_time, notify_hour),
+            where pause_time is in milliseconds
+        partition: The partition of the users, in the form of (partition, partitions)
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    where = ''
+    data = []
+
+    if partition is not None and partition[1] > 1:
+        where = ''' WHERE CRC32(user_id) %% %s = %s'''
+        data = [int(partition[1]), int(partition[0])]
+
+    try:
+        cur.execute('''DELETE FROM pulse_checkpoint''' + where + ''';''', data)
+
+        if len(entries) > 0:
+            query = '''INSERT INTO pulse_checkpoint (user_id, state, pause_time, notify_hour, saved) VALUES (%s, %s, %s, %s, NOW());'''
+            cur.executemany(query, [(str(uuid), str(state), int(pause_time), int(notify_hour)) for uuid, state, pause_time, notify_hour in entries])
+
+            query = '''UPDATE pulse_checkpoint C JOIN user_session S ON S.user_id=C.user_id SET C.session_id=S.session_id'''
+            if where:
+                query = query + ''' WHERE CRC32(C.user_id) %% %s = %s'''
+            cur.execute(query, data)
+
+        # commit query
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cur.close()
+
+def get_checkpoint(partition=None):
+    '''
+    Args:
+        partition: Only get this partition of the users, in the form of (partition, partitions)
+
+    Returns:
+        A dictionary of uuid to (state, pause_time, notify_hour, age) for the users still in
+        the session they were saved in, where pause_time is in milliseconds and age is how
+        many seconds ago it was saved.
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''SELECT C.user_id, C.state, C.pause_time, C.notify_hour, TIMESTAMPDIFF(SECOND, C.saved, NOW()) FROM pulse_checkpoint C JOIN user_session S ON S.user_id=C.user_id AND S.session_id=C.session_id'''
+    data = []
+
+    if partition is not None and partition[1] > 1:
+        query = query + ''' WHERE CRC32(C.user_id) %% %s = %s'''
+        data.extend([int(partition[1]), int(partition[0])])
+
+    cur.execute(query, data)
+
+    saved = {}
+    for tup in cur:
+        saved[str(tup[0])] = (str(tup[1]), int(tup[2]), int(tup[3]), max(int(tup[4]), 0))
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return saved
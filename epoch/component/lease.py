@@ -0,0 +1,91 @@
+#!/usr/bin/python
+
+# local modules
+from settings import settings
+
+# python modules
+import MySQLdb
+
+def acquire_lease(name, holder, seconds):
+    '''
+    Takes the lease if it is free or expired, or renews it if the holder
+    already has it, in one statement so two holders can never both take it.
+    Expiry is on MySQL's clock, so the clocks of the hosts do not matter.
+
+    Args:
+        name: The name of the lease
+        holder: The unique id of who wants the lease
+        seconds: How long the lease lasts unless renewed
+
+    Returns:
+        True if the holder has the lease.
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+
+    # holder is assigned first, so expires is only extended once holder is ours
+    query = '''INSERT INTO pulse_lease (name, holder, expires, renewed) VALUES (%s, %s, NOW() + INTERVAL %s SECOND, NOW()) ON DUPLICATE KEY UPDATE holder=IF(holder=VALUES(holder) OR expires < NOW(), VALUES(holder), holder), expires=IF(holder=VALUES(holder), VALUES(expires), expires), renewed=IF(holder=VALUES(holder), VALUES(renewed), renewed);'''
+    data = (str(name), str(holder), int(seconds))
+    cur.execute(query, data)
+
+    query = '''SELECT holder FROM pulse_lease WHERE name=%s;'''
+    cur.execute(query, [str(name)])
+
+    result = False
+
+    for tup in cur:
+        result = str(tup[0]) == str(holder)
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return result
+
+def release_lease(name, holder):
+    '''
+    Gives up the lease, if the holder has it, so another can take it at once.
+
+    Args:
+        name: The name of the lease
+        holder: The unique id of who has the lease
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''UPDATE pulse_lease SET expires=NOW() - INTERVAL 1 SECOND WHERE name=%s AND holder=%s;'''
+    data = (str(name), str(holder))
+    cur.execute(query, data)
+
+    # commit query
+    db.commit()
+    cur.close()
+
+def get_leases(prefix):
+    '''
+    Args:
+        prefix: The start of the names of the leases, Ex: 'worker:'
+
+    Returns:
+        A list of the leases that are held in the form of (name, holder), ordered by name.
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''SELECT name, holder FROM pulse_lease WHERE name LIKE %s AND expires >= NOW() ORDER BY name;'''
+    cur.execute(query, [str(prefix).replace('%', '\\%').replace('_', '\\_') + '%'])
+
+    result = []
+
+    for tup in cur:
+        result.append((str(tup[0]), str(tup[1])))
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return result
@@ -5,6 +5,13 @@ from settings import settings
 
 # python modules
 import MySQLdb
+import MySQLdb.cursors
+
+# how many rows a server-side cursor fetches from MySQL at a time
+STREAM_FETCH_SIZE = 1000
+
+# the length of the summary column of log_dev_commit
+SUMMARY_LENGTH = 255
 
 def repo_exists(repo_id, repo_name):
     '''
@@ -154,7 +161,7 @@ def get_git_uuid(slack_id):
 
     return git_uuid
 
-def create_commit_log(repo_id, user_id, commit_text, commit_url):
+def create_commit_log(repo_id, user_id, commit_text, commit_url, session_id=None):
     '''
     Inserts into the database the commit as a log.
 
@@ -163,17 +170,35 @@ def create_commit_log(repo_id, user_id, commit_text, commit_url):
         user_id: The uuid of the user that did the commit
         commit_text: The text that was in the commit
         commit_url: The URL for more information on the commit
+        session_id: The user's open session id, None if they were OFFLINE
 
     Returns:
         True if the commit log was successfully created, False if something happened.
     '''
+    return create_commit_logs([(repo_id, user_id, commit_text, commit_url, session_id)])
+
+def create_commit_logs(commits):
+    '''
+    Inserts a batch of commits as logs, in one statement and one commit.
+
+    Args:
+        commits: A list of commits in the form of (repo_id, user_id, commit_text, commit_url, session_id)
+
+    Returns:
+        True if the commit logs were successfully created, False if something happened.
+    '''
+    if commits is None or len(commits) == 0:
+        return True
+
     # Get new database instance
     db = settings.getDatabase()
 
     cur = db.cursor()
-    query = '''INSERT INTO log_dev_commit (repo_id, user_id, message, url) VALUES (%s, %s, %s, %s);'''
-    data = (int(repo_id), str(user_id), str(commit_text), str(commit_url))
-    cur.execute(query, data)
+    query = '''INSERT INTO log_dev_commit (repo_id, user_id, message, summary, url, session_id) VALUES (%s, %s, %s, %s, %s, %s);'''
+    data = []
+    for repo_id, user_id, commit_text, commit_url, session_id in commits:
+        data.append((int(repo_id), str(user_id), str(commit_text), summarize_commit(commit_text), str(commit_url), session_id))
+    cur.executemany(query, data)
 
     # commit query
     db.commit()
@@ -181,6 +206,20 @@ def create_commit_log(repo_id, user_id, commit_text, commit_url):
 
     return True
 
+def summarize_commit(commit_text):
+    '''
+    Args:
+        commit_text: The text that was in the commit
+
+    Returns:
+        The first line of the commit text, cut to fit the summary column.
+    '''
+    lines = str(commit_text).splitlines()
+    if len(lines) == 0:
+        return ''
+
+    return lines[0][:SUMMARY_LENGTH]
+
 def get_all_commit_logs(slack_id):
     '''
     Get all the commit logs that this slack user has.
@@ -250,4 +289,149 @@ def get_commit_logs(slack_id, start_date, end_date):
 
     return result
 
+def get_session_commit_digest(slack_id, session_id, per_repo, max_repos):
+    '''
+    Get the commits attributed to the user's session, grouped by repository,
+    fetching only the newest per_repo commits of each repository.
+
+    Args:
+        slack_id: The user's slack ID
+        session_id: The id of the user's session
+        per_repo: The maximum number of commits to fetch per repository
+        max_repos: The maximum number of repositories to fetch commits for
+    Returns:
+        A tuple in the form of (repos, other_commits, other_repos). repos is a
+        list in the form of (repo_name, commit_count, commits), busiest first,
+        where commits is a list in the form of (commit_summary, commit_url).
+        other_commits and other_repos count what was beyond max_repos.
+    '''
+
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+
+    # the number of commits in each repository, largest first
+    query = '''SELECT LDC.repo_id, DR.name, COUNT(*) FROM log_dev_commit LDC, dev_repo DR WHERE LDC.user_id=%s AND LDC.session_id=%s AND LDC.repo_id=DR.id GROUP BY LDC.repo_id, DR.name ORDER BY COUNT(*) DESC, DR.name;'''
+    data = (str(slack_id), int(session_id))
+    cur.execute(query, data)
+
+    repos = []
+    for tup in cur:
+        repos.append((int(tup[0]), str(tup[1]), int(tup[2])))
+
+    shown = repos[:max_repos]
+    other_commits = 0
+    for repo_id, repo_name, count in repos[max_repos:]:
+        other_commits = other_commits + count
+
+    result = []
+    if len(shown) > 0:
+        # one round trip, with a LIMIT for each repository
+        parts = []
+        data = []
+        for repo_id, repo_name, count in shown:
+            parts.append('''(SELECT repo_id, summary, url FROM log_dev_commit WHERE user_id=%s AND session_id=%s AND repo_id=%s ORDER BY id DESC LIMIT %s)''')
+            data.extend([str(slack_id), int(session_id), repo_id, int(per_repo)])
+
+        query = ' UNION ALL '.join(parts) + ';'
+        cur.execute(query, data)
+
+        commits = {}
+        for tup in cur:
+            commits.setdefault(int(tup[0]), []).append((str(tup[1]), str(tup[2])))
+
+        for repo_id, repo_name, count in shown:
+            result.append((repo_name, count, commits.get(repo_id, [])))
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return (result, other_commits, len(repos) - len(shown))
+
+def get_session_commit_counts(slack_id, log_ids):
+    '''
+    Get the number of commits attributed to each of the user's session logs.
+
+    Args:
+        slack_id: The user's slack ID
+        log_ids: The IDs of the session logs
+    Returns:
+        A dictionary of session log id to the number of commits in that session.
+    '''
+
+    result = {}
+
+    if log_ids is None or len(log_ids) == 0:
+        return result
+
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''SELECT LUS.id, COUNT(LDC.id) FROM log_user_session LUS, log_dev_commit LDC WHERE LUS.user_id=%s AND LUS.id IN (''' + ', '.join(['%s'] * len(log_ids)) + ''') AND LDC.user_id=LUS.user_id AND LDC.session_id=LUS.session_id GROUP BY LUS.id;'''
+    data = [str(slack_id)] + [int(log_id) for log_id in log_ids]
+    cur.execute(query, data)
+
+    for tup in cur:
+        result[int(tup[0])] = int(tup[1])
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return result
+
+def iter_commit_logs(start_date, end_date, slack_id=None, team=None):
+    '''
+    Streams the commit logs within the timeframe through an unbuffered,
+    server-side cursor, so any number of commits can be read in constant memory.
+
+    The database connection is busy until the generator is exhausted or closed,
+    so no other query may run while iterating.
+
+    Args:
+        start_date: The starting date to search for
+        end_date: The end date to stop search for
+        slack_id: The slack ID of a user to limit the commits to
+        team: The ID of a team to limit the commits to
+    Returns:
+        A generator of data in the form of (commit_id, user_id, username, team, repo_name, session_id, commit_text, commit_url, creation).
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    query = '''SELECT LDC.id, LDC.user_id, U.username, U.team, DR.name, LDC.session_id, LDC.message, LDC.url, LDC.creation FROM log_dev_commit LDC, dev_repo DR, user U WHERE LDC.repo_id=DR.id AND LDC.user_id=U.uuid AND (LDC.creation BETWEEN %s and %s)'''
+    data = [str(start_date), str(end_date)]
+
+    if slack_id is not None:
+        query = query + ''' AND LDC.user_id=%s'''
+        data.append(str(slack_id))
+
+    if team is not None:
+        query = query + ''' AND U.team=%s'''
+        data.append(int(team))
+
+    query = query + ''' ORDER BY LDC.creation, LDC.id;'''
+
+    cur = db.cursor(MySQLdb.cursors.SSCursor)
+    try:
+        cur.execute(query, data)
+
+        while True:
+            rows = cur.fetchmany(STREAM_FETCH_SIZE)
+            if not rows:
+                break
+
+            for tup in rows:
+                session_id = tup[5]
+                if session_id is not None:
+                    session_id = int(session_id)
+
+                yield (int(tup[0]), str(tup[1]), str(tup[2]), int(tup[3]), str(tup[4]), session_id, str(tup[6]), str(tup[7]), tup[8])
+    finally:
+        cur.close()
 
+        # commit query
+        db.commit()
@@ -0,0 +1,122 @@
+#!/usr/bin/python
+
+# local modules
+from settings import settings
+
+# python modules
+import MySQLdb
+
+def claim_request(request_id):
+    '''
+    Claims a Slack request, so only one of the servers handles it.
+
+    Args:
+        request_id: The id Slack gave the request, Ex: its trigger_id
+
+    Returns:
+        True if the request was claimed, False if it already was.
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''INSERT IGNORE INTO slack_request (request_id) VALUES (%s);'''
+    cur.execute(query, [str(request_id)])
+    claimed = cur.rowcount == 1
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return claimed
+
+def save_response(request_id, status, mimetype, body):
+    '''
+    Saves the response to a claimed Slack request, for its retries.
+
+    Args:
+        request_id: The id Slack gave the request
+        status: The HTTP status of the response
+        mimetype: The mimetype of the response
+        body: The body of the response
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''UPDATE slack_request SET status=%s, mimetype=%s, body=%s WHERE request_id=%s;'''
+    data = (int(status), str(mimetype), body, str(request_id))
+    cur.execute(query, data)
+
+    # commit query
+    db.commit()
+    cur.close()
+
+def release_request(request_id):
+    '''
+    Forgets a claimed Slack request that failed, so its retry is handled again.
+
+    Args:
+        request_id: The id Slack gave the request
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''DELETE FROM slack_request WHERE request_id=%s AND status IS NULL;'''
+    cur.execute(query, [str(request_id)])
+
+    # commit query
+    db.commit()
+    cur.close()
+
+def get_response(request_id):
+    '''
+    Args:
+        request_id: The id Slack gave the request
+
+    Returns:
+        The response in the form of (status, mimetype, body), or None if it is still being handled.
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''SELECT status, mimetype, body FROM slack_request WHERE request_id=%s AND status IS NOT NULL;'''
+    cur.execute(query, [str(request_id)])
+
+    response = None
+    for tup in cur:
+        response = (int(tup[0]), str(tup[1]), tup[2])
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return response
+
+def purge_requests(seconds, db=None):
+    '''
+    Deletes the Slack requests older than Slack retries.
+
+    Args:
+        seconds: How many seconds the requests are kept
+        db: The connection to use, Ex: from a worker thread, the shared one by default
+
+    Returns:
+        The number of requests deleted.
+    '''
+    if db is None:
+        # Get new database instance
+        db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''DELETE FROM slack_request WHERE created < NOW() - INTERVAL %s SECOND;'''
+    cur.execute(query, [int(seconds)])
+    deleted = int(cur.rowcount)
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return deleted
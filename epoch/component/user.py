@@ -3,11 +3,11 @@
 # local modules
 from settings import settings
 from component import user_session
+from util import clock
 
 # python modules
 import MySQLdb
 import calendar
-import datetime
 
 class User(object):
     def __init__(self, uuid, username):
@@ -21,6 +21,11 @@ class User(object):
         # when we last sent out a notification, one per hour
         self.notify_hour = 0
 
+        # the state Pulse last saw this user in
+        self.state = 'OFFLINE'
+        # how much Pulse had credited when the times above were last brought up to date
+        self.credit_mark = 0
+
     def __str__(self):
         return 'uuid=' + str(self.uuid) + ", username=" + str(self.username)
 
@@ -114,6 +119,37 @@ def get_user(username):
 
     return user_data
 
+def get_user_uuids(usernames):
+    '''
+    Resolves many usernames to their uuids with a single query.
+
+    Args:
+        usernames: A list of user names
+
+    Returns:
+        A dictionary of username to uuid, for the usernames that exist.
+    '''
+    users = {}
+
+    if usernames is None or len(usernames) == 0:
+        return users
+
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''SELECT username, uuid FROM user WHERE username IN (''' + ', '.join(['%s'] * len(usernames)) + ''');'''
+    cur.execute(query, [str(name) for name in usernames])
+
+    for tup in cur:
+        users[str(tup[0])] = str(tup[1])
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return users
+
 def log_state_change(uuid, state, prev_state):
     '''
     Args:
@@ -125,14 +161,100 @@ def log_state_change(uuid, state, prev_state):
     db = settings.getDatabase()
 
     cur = db.cursor()
-    query = '''INSERT INTO log_user_state (user_id, state, prev_state) VALUES (%s, %s, %s);'''
-    data = (str(uuid), str(state), str(prev_state))
+    query = '''INSERT INTO log_user_state (user_id, state, prev_state, creation) VALUES (%s, %s, %s, %s);'''
+    data = (str(uuid), str(state), str(prev_state), clock.get_clock().timestamp())
     cur.execute(query, data)
 
     # commit query
     db.commit()
     cur.close()
 
+def get_state_changes(after_id, limit=1000):
+    '''
+    Gets the state changes logged after the given one, oldest first.
+
+    Args:
+        after_id: The id of the last state change already seen
+        limit: The most state changes to return
+
+    Returns:
+        A list of state changes in the form of (id, user_id, state, prev_state).
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''SELECT id, user_id, state, prev_state FROM log_user_state WHERE id > %s ORDER BY id LIMIT %s;'''
+    cur.execute(query, (int(after_id), int(limit)))
+
+    changes = []
+    for tup in cur:
+        changes.append((int(tup[0]), str(tup[1]), str(tup[2]), str(tup[3])))
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return changes
+
+def get_last_state_change_id():
+    '''
+    Returns:
+        The id of the latest state change, or 0 if none were logged.
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''SELECT MAX(id) FROM log_user_state;'''
+    cur.execute(query)
+
+    last_id = 0
+    for tup in cur:
+        if tup[0] is not None:
+            last_id = int(tup[0])
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return last_id
+
+def purge_state_logs(before, db=None, chunk_size=10000):
+    '''
+    Deletes the state changes logged before a date, a chunk at a time, so the
+    table is never locked for long.
+
+    Args:
+        before: The date in the form of 'YYYY-MM-DD HH:MM:SS', older changes are deleted
+        db: The connection to use, Ex: from a worker thread, the shared one by default
+        chunk_size: How many rows are deleted per transaction
+
+    Returns:
+        The number of state changes that were deleted.
+    '''
+    if db is None:
+        # Get new database instance
+        db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''DELETE FROM log_user_state WHERE creation < %s ORDER BY id LIMIT %s;'''
+
+    deleted = 0
+    while True:
+        cur.execute(query, (str(before), int(chunk_size)))
+        count = int(cur.rowcount)
+
+        # commit query
+        db.commit()
+
+        deleted = deleted + count
+        if count < chunk_size:
+            break
+
+    cur.close()
+    return deleted
+
 def get_all_users():
     '''
     Returns:
@@ -160,6 +282,117 @@ def get_all_users():
 
     return users
 
+def get_changed_users(since=None, partition=None):
+    '''
+    Gets the users created or changed since the given time, such as renamed.
+
+    Args:
+        since: The marker returned by the last call, None to get every user
+        partition: Only get this partition of the users, in the form of (partition, partitions)
+
+    Returns:
+        A tuple in the form of (users, marker), where users is a list in the form of
+        (uuid, name) and marker is the database's time to pass as since next time.
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+
+    # read first, so a user changed while reading is read again next time
+    cur.execute('''SELECT NOW();''')
+    marker = None
+    for tup in cur:
+        marker = tup[0]
+
+    query = '''SELECT uuid, username FROM user'''
+    conditions = []
+    data = []
+
+    if since is not None:
+        conditions.append('''updated >= %s''')
+        data.append(since)
+
+    if partition is not None and partition[1] > 1:
+        conditions.append('''CRC32(uuid) %% %s = %s''')
+        data.extend([int(partition[1]), int(partition[0])])
+
+    if len(conditions) > 0:
+        query = query + ''' WHERE ''' + ''' AND '''.join(conditions)
+    cur.execute(query, data)
+
+    users = []
+    for tup in cur:
+        users.append((str(tup[0]), str(tup[1])))
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return users, marker
+
+def count_users(partition=None):
+    '''
+    Args:
+        partition: Only count this partition of the users, in the form of (partition, partitions)
+
+    Returns:
+        The number of users.
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''SELECT COUNT(*) FROM user'''
+    data = []
+
+    if partition is not None and partition[1] > 1:
+        query = query + ''' WHERE CRC32(uuid) %% %s = %s'''
+        data.extend([int(partition[1]), int(partition[0])])
+
+    cur.execute(query, data)
+
+    count = 0
+    for tup in cur:
+        count = int(tup[0])
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return count
+
+def get_uuids(partition=None):
+    '''
+    Args:
+        partition: Only get this partition of the users, in the form of (partition, partitions)
+
+    Returns:
+        A set of the uuids of the users.
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''SELECT uuid FROM user'''
+    data = []
+
+    if partition is not None and partition[1] > 1:
+        query = query + ''' WHERE CRC32(uuid) %% %s = %s'''
+        data.extend([int(partition[1]), int(partition[0])])
+
+    cur.execute(query, data)
+
+    uuids = set()
+    for tup in cur:
+        uuids.add(str(tup[0]))
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return uuids
+
 def get_goal_total(uuid):
     '''
     Get the total amount of hours this user should work in one month.
@@ -188,28 +421,30 @@ def get_goal_total(uuid):
 
     return hours
 
-def determine_goal_hours_today(uuid):
+def determine_goal_hours_today(uuid, snapshot=None):
     '''
     Determines the goal hours for today.
 
     Args:
         uuid: The uuid of the user
+        snapshot: The user's goal snapshot if already read, in the form of (hours, goal_hours)
 
     Returns:
         The number of hours, as a string, that the user should try and work today.
     '''
     
-    current = user_session.get_total_worked(uuid)
-    goal = get_goal_total(uuid)
+    if snapshot is None:
+        snapshot = user_session.get_goal_snapshot(uuid)
+    current, goal = snapshot
 
     number_left = goal - current
     if number_left > 0:
 
         # get the int representation of today
-        current_day = datetime.datetime.today().day
+        now = clock.get_clock().now()
+        current_day = now.day
 
         # determine the days in THIS month
-        now = datetime.datetime.now()
         days_in_month = calendar.monthrange(now.year, now.month)[1]
 
         days_left = days_in_month - current_day + 1
@@ -2,9 +2,16 @@
 
 # local modules
 from settings import settings
+from util import clock
 
 # python modules
 import MySQLdb
+import MySQLdb.cursors
+import datetime
+import zlib
+
+# how many rows a server-side cursor fetches from MySQL at a time
+STREAM_FETCH_SIZE = 1000
 
 def create_user_session(uuid):
     '''
@@ -139,6 +146,88 @@ def update_work_time(uuid, incr):
     db.commit()
     cur.close()
 
+def credit_online_users(incr, lease=None, partition=None):
+    '''
+    Updates the work_time attribute of every ONLINE user at once.
+
+    Args:
+        incr: The time increment in milliseconds for each user
+        lease: Only credit while this lease is held, in the form of (name, holder)
+        partition: Only credit this partition of the users, in the form of (partition, partitions)
+
+    Returns:
+        The number of users that were credited.
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+
+    if lease is None:
+        query = '''UPDATE user_session SET work_time=work_time + %s WHERE state=%s'''
+        data = [int(incr), 'ONLINE']
+    else:
+        # checked in the same statement, so a Pulse that lost its lease can never credit
+        query = '''UPDATE user_session S, pulse_lease L SET S.work_time=S.work_time + %s WHERE S.state='ONLINE' AND L.name=%s AND L.holder=%s AND L.expires >= NOW()'''
+        data = [int(incr), str(lease[0]), str(lease[1])]
+
+    if partition is not None and partition[1] > 1:
+        query = query + ''' AND CRC32(user_id) %% %s = %s'''
+        data.extend([int(partition[1]), int(partition[0])])
+
+    cur.execute(query, data)
+    count = int(cur.rowcount)
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return count
+
+def get_states(partition=None):
+    '''
+    Gets the state of every user at once.
+
+    Args:
+        partition: Only get this partition of the users, in the form of (partition, partitions)
+
+    Returns:
+        A dictionary of uuid to (state, work_time), where work_time is in milliseconds.
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''SELECT user_id, state, work_time FROM user_session'''
+    data = []
+
+    if partition is not None and partition[1] > 1:
+        query = query + ''' WHERE CRC32(user_id) %% %s = %s'''
+        data.extend([int(partition[1]), int(partition[0])])
+
+    cur.execute(query, data)
+
+    states = {}
+    for tup in cur:
+        states[str(tup[0])] = (str(tup[1]), int(tup[2]))
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return states
+
+def partition_of(uuid, partitions):
+    '''
+    Args:
+        uuid: The uuid for that user
+        partitions: How many partitions the users are split into
+
+    Returns:
+        The partition of the user, the same as CRC32(user_id) % partitions in MySQL.
+    '''
+    return (zlib.crc32(str(uuid).encode('utf-8')) & 0xffffffff) % int(partitions)
+
 def get_session_timestamp(uuid):
     '''
     Gets the user's timestamp for this session.
@@ -175,14 +264,183 @@ def set_session_timestamp(uuid):
     db = settings.getDatabase()
 
     cur = db.cursor()
-    query = '''UPDATE user_session SET updated=CURRENT_TIMESTAMP WHERE user_id=%s'''
+    query = '''UPDATE user_session SET updated=%s WHERE user_id=%s'''
+    cur.execute(query, [clock.get_clock().timestamp(), str(uuid)])
+
+    # commit query
+    db.commit()
+    cur.close()
+
+def open_session(uuid):
+    '''
+    Marks a new open session for the user, by incrementing their session_id.
+    Commits that arrive while the session is open are attributed to it.
+
+    Args:
+        uuid: The uuid for that user
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''UPDATE user_session SET session_id=session_id + 1 WHERE user_id=%s'''
     cur.execute(query, [str(uuid)])
 
     # commit query
     db.commit()
     cur.close()
 
-def create_user_session_log(uuid, work_time, start_time, end_time, verified=None):
+def get_session_id(uuid):
+    '''
+    Gets the id of the user's current, or last, session.
+
+    Args:
+        uuid: The uuid for that user
+
+    Returns:
+        The session id of the user, or None if the user has no session.
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''SELECT session_id FROM user_session WHERE user_id=%s'''
+    cur.execute(query, [str(uuid)])
+
+    result = None
+
+    for tup in cur:
+        if tup[0] is not None:
+            result = int(tup[0])
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return result
+
+def transition(uuid, expected, state):
+    '''
+    Moves the user from the expected state to the new one, only if they are
+    still in the expected state, and logs the change in the same transaction.
+    Of two commands racing, such as a double click or a retry, only one moves
+    the user. Starting opens a new session, and going OFFLINE closes it with
+    a session log.
+
+    Args:
+        uuid: The uuid for that user
+        expected: The state the user must be in, Ex: 'ONLINE'
+        state: The new state of the user, Ex: 'PAUSED'
+
+    Returns:
+        None if the user was not in the expected state, otherwise the session as it was
+        before the change in the form of (work_time, start, session_id), where work_time is
+        in milliseconds and session_id is the new one when starting.
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    now = clock.get_clock().timestamp()
+
+    try:
+        if expected == 'OFFLINE' and state != 'OFFLINE':
+            query = '''UPDATE user_session SET state=%s, work_time=0, updated=%s, session_id=session_id + 1 WHERE user_id=%s AND state=%s;'''
+            data = (str(state), now, str(uuid), str(expected))
+        else:
+            query = '''UPDATE user_session SET state=%s WHERE user_id=%s AND state=%s;'''
+            data = (str(state), str(uuid), str(expected))
+        cur.execute(query, data)
+
+        if cur.rowcount != 1:
+            db.rollback()
+            return None
+
+        # the row is locked until the commit, so this is the session that was changed
+        query = '''SELECT work_time, updated, session_id FROM user_session WHERE user_id=%s;'''
+        cur.execute(query, [str(uuid)])
+
+        session = None
+        for tup in cur:
+            session = (int(tup[0]), tup[1], int(tup[2]))
+
+        query = '''INSERT INTO log_user_state (user_id, state, prev_state, creation) VALUES (%s, %s, %s, %s);'''
+        cur.execute(query, (str(uuid), str(state), str(expected), now))
+
+        if state == 'OFFLINE' and expected != 'OFFLINE':
+            work_time, start_time, session_id = session
+
+            query = '''INSERT INTO log_user_session (user_id, work_time, start, end, session_id) VALUES (%s, %s, %s, %s, %s);'''
+            cur.execute(query, (str(uuid), work_time, start_time, now, session_id))
+
+            # add the time to today's goal snapshot, when it counts this month
+            _add_to_goal_snapshot(cur, uuid, work_time, start_time)
+
+            query = '''UPDATE user_session SET work_time=0, updated=%s WHERE user_id=%s;'''
+            cur.execute(query, (now, str(uuid)))
+
+        # commit query
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cur.close()
+
+    return session
+
+def force_logout_all():
+    '''
+    Logs out every user that is not OFFLINE in a single transaction, whatever
+    the number of users: their state changes and session logs are written,
+    their goal snapshots updated and their sessions reset with a handful of
+    statements. If any of them fails, nobody is logged out.
+
+    Returns:
+        A list of the users that were logged out in the form of (uuid, username, state),
+        where state is the one they were in.
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    now = clock.get_clock().timestamp()
+    month_start, month_end = _current_month()
+
+    try:
+        # locks the sessions, so no command changes them halfway
+        query = '''SELECT S.user_id, U.username, S.state FROM user_session S JOIN user U ON U.uuid=S.user_id WHERE S.state<>%s FOR UPDATE;'''
+        cur.execute(query, ['OFFLINE'])
+
+        users = []
+        for tup in cur:
+            users.append((str(tup[0]), str(tup[1]), str(tup[2])))
+
+        if len(users) > 0:
+            query = '''INSERT INTO log_user_state (user_id, state, prev_state, creation) SELECT user_id, %s, state, %s FROM user_session WHERE state<>%s;'''
+            cur.execute(query, ['OFFLINE', now, 'OFFLINE'])
+
+            query = '''INSERT INTO log_user_session (user_id, work_time, start, end, session_id) SELECT user_id, work_time, updated, %s, session_id FROM user_session WHERE state<>%s;'''
+            cur.execute(query, [now, 'OFFLINE'])
+
+            # add the time to today's goal snapshots, for the sessions that count this month
+            query = '''UPDATE user_goal_snapshot G JOIN user_session S ON S.user_id=G.user_id SET G.work_time=G.work_time+S.work_time WHERE S.state<>%s AND G.day=%s AND S.updated >= %s AND S.updated < %s;'''
+            cur.execute(query, ['OFFLINE', str(clock.get_clock().today()), str(month_start), str(month_end)])
+
+            query = '''UPDATE user_session SET state=%s, work_time=0, updated=%s WHERE state<>%s;'''
+            cur.execute(query, ['OFFLINE', now, 'OFFLINE'])
+
+        # commit query
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cur.close()
+
+    return users
+
+def create_user_session_log(uuid, work_time, start_time, end_time, verified=None, session_id=None):
     '''
     Creates a user session log in the database for this user.
 
@@ -192,6 +450,7 @@ def create_user_session_log(uuid, work_time, start_time, end_time, verified=None
         start_time: The timestamp for when this user started
         end_time: The timstamp for when this user ended
         verified: The UUID of the user that verified this user's session
+        session_id: The id of the session this log closes, None for manual logs
     '''
     # Get new database instance
     db = settings.getDatabase()
@@ -199,13 +458,16 @@ def create_user_session_log(uuid, work_time, start_time, end_time, verified=None
     cur = db.cursor()
 
     if verified is None:
-        query = '''INSERT INTO log_user_session (user_id, work_time, start, end) VALUES (%s, %s, %s, %s);'''
-        data = (uuid, work_time, start_time, end_time)
+        query = '''INSERT INTO log_user_session (user_id, work_time, start, end, session_id) VALUES (%s, %s, %s, %s, %s);'''
+        data = (uuid, work_time, start_time, end_time, session_id)
     else:
-        query = '''INSERT INTO log_user_session (user_id, work_time, start, end, approved) VALUES (%s, %s, %s, %s, %s);'''
-        data = (uuid, work_time, start_time, end_time, verified)
+        query = '''INSERT INTO log_user_session (user_id, work_time, start, end, approved, session_id) VALUES (%s, %s, %s, %s, %s, %s);'''
+        data = (uuid, work_time, start_time, end_time, verified, session_id)
     cur.execute(query, data)
 
+    # add the time to today's goal snapshot, when it counts this month
+    _add_to_goal_snapshot(cur, uuid, work_time, start_time)
+
     # commit query
     db.commit()
     cur.close()
@@ -226,6 +488,8 @@ def delete_user_session_log(uuid, timestamp):
     data = (str(uuid), str(timestamp))
     cur.execute(query, data)
 
+    _refresh_goal_snapshots(cur, uuid)
+
     # commit query
     db.commit()
     cur.close()
@@ -248,10 +512,66 @@ def update_user_session_log(uuid, new_work_time, timestamp, verified):
     data = (int(new_work_time), str(verified), str(uuid), str(timestamp))
     cur.execute(query, data)
 
+    _refresh_goal_snapshots(cur, uuid)
+
     # commit query
     db.commit()
     cur.close()
 
+def apply_session_log_operations(operations, verify_uuid):
+    '''
+    Applies a batch of manual session log changes in a single transaction. If
+    any change fails, none of them are applied.
+
+    Args:
+        operations: A list of changes in the form of (action, uuid, date, work_time),
+            where action is one of 'add', 'modify', 'remove' or 'verify', date
+            is the day of the session log and work_time is in milliseconds
+        verify_uuid: The UUID of the user signing the changes
+
+    Returns:
+        A list of the number of session logs each change affected.
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    affected = []
+
+    try:
+        for action, uuid, date, work_time in operations:
+            if action == 'add':
+                query = '''INSERT INTO log_user_session (user_id, work_time, start, end, approved) VALUES (%s, %s, %s, %s, %s);'''
+                data = (str(uuid), int(work_time), str(date), str(date), str(verify_uuid))
+            elif action == 'modify':
+                query = '''UPDATE log_user_session SET work_time=%s, approved=%s WHERE user_id=%s AND DATE(start)=%s LIMIT 1;'''
+                data = (int(work_time), str(verify_uuid), str(uuid), str(date))
+            elif action == 'remove':
+                query = '''DELETE FROM log_user_session WHERE user_id=%s AND DATE(start)=%s LIMIT 1;'''
+                data = (str(uuid), str(date))
+            elif action == 'verify':
+                query = '''UPDATE log_user_session SET approved=%s WHERE user_id=%s AND DATE(start)=%s AND approved IS NULL;'''
+                data = (str(verify_uuid), str(uuid), str(date))
+            else:
+                raise ValueError('Unknown session log action ' + str(action))
+
+            cur.execute(query, data)
+            affected.append(int(cur.rowcount))
+
+        # verifying does not change the worked time
+        for uuid in set([op[1] for op in operations if op[0] != 'verify']):
+            _refresh_goal_snapshots(cur, uuid)
+
+        # commit query
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cur.close()
+
+    return affected
+
 def get_total_worked(uuid):
     '''
     Get the total amount of hours this user has worked THIS month.
@@ -265,9 +585,12 @@ def get_total_worked(uuid):
     # Get new database instance
     db = settings.getDatabase()
 
+    # THIS month by the clock, as the goal snapshots count it
+    month_start, month_end = _current_month()
+
     cur = db.cursor()
-    query = '''SELECT SUM(work_time)/3600000 as hours FROM log_user_session WHERE user_id=%s AND MONTH(start) = MONTH(CURRENT_DATE()) AND YEAR(start) = YEAR(CURRENT_DATE());'''
-    cur.execute(query, [str(uuid)])
+    query = '''SELECT SUM(work_time)/3600000 as hours FROM log_user_session WHERE user_id=%s AND start >= %s AND start < %s;'''
+    cur.execute(query, [str(uuid), str(month_start), str(month_end)])
 
     hours = 0
 
@@ -282,6 +605,134 @@ def get_total_worked(uuid):
 
     return hours
 
+def get_goal_snapshot(uuid):
+    '''
+    Get what this user worked THIS month and their goal, from today's goal
+    snapshot. A missing or stale snapshot is computed first.
+
+    Args:
+        uuid: The uuid of the user
+
+    Returns:
+        A tuple in the form of (hours, goal_hours), where hours is a float of
+        the hours worked THIS month and goal_hours is the monthly goal.
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''SELECT day, work_time, goal_hours FROM user_goal_snapshot WHERE user_id=%s;'''
+    cur.execute(query, [str(uuid)])
+    snapshot = cur.fetchone()
+
+    if snapshot is None or snapshot[0] != clock.get_clock().today():
+        _refresh_goal_snapshots(cur, uuid)
+        cur.execute(query, [str(uuid)])
+        snapshot = cur.fetchone()
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    if snapshot is None:
+        return (0, 0)
+
+    return (int(snapshot[1]) / 3600000.0, int(snapshot[2]))
+
+def refresh_goal_snapshots(db=None):
+    '''
+    Computes today's goal snapshot of every user at once. Runs at midnight,
+    as every snapshot becomes stale when the day changes.
+
+    Args:
+        db: The connection to use, Ex: from a worker thread, the shared one by default
+    '''
+    if db is None:
+        # Get new database instance
+        db = settings.getDatabase()
+
+    cur = db.cursor()
+    _refresh_goal_snapshots(cur)
+
+    # commit query
+    db.commit()
+    cur.close()
+
+def _refresh_goal_snapshots(cur, uuid=None):
+    '''
+    Computes today's goal snapshot of one user, or of every user, with one
+    grouped query, on the given cursor so it joins its transaction.
+    '''
+    month_start, month_end = _current_month()
+
+    query = '''INSERT INTO user_goal_snapshot (user_id, day, work_time, goal_hours) SELECT U.uuid, %s, COALESCE(SUM(L.work_time), 0), COALESCE(U.monthly_hours, 0) FROM user U LEFT JOIN log_user_session L ON L.user_id=U.uuid AND L.start >= %s AND L.start < %s'''
+    data = [str(clock.get_clock().today()), str(month_start), str(month_end)]
+
+    if uuid is not None:
+        query = query + ''' WHERE U.uuid=%s'''
+        data.append(str(uuid))
+
+    query = query + ''' GROUP BY U.uuid, U.monthly_hours ON DUPLICATE KEY UPDATE day=VALUES(day), work_time=VALUES(work_time), goal_hours=VALUES(goal_hours);'''
+    cur.execute(query, data)
+
+def _add_to_goal_snapshot(cur, uuid, work_time, start_time):
+    '''
+    Adds a new session log to the user's goal snapshot of today, if it
+    started THIS month, on the given cursor so it joins its transaction.
+
+    Args:
+        cur: The cursor of the transaction
+        uuid: The uuid of the user
+        work_time: The time of the session log, in milliseconds
+        start_time: When the session log started, a datetime, a date or a string such as 'YYYY-MM-DD'
+    '''
+    start = _parse_time(start_time)
+    if start is None:
+        # a start we can not place, the snapshot is computed again instead
+        _refresh_goal_snapshots(cur, uuid)
+        return
+
+    month_start, month_end = _current_month()
+    if start < month_start or start >= month_end:
+        return
+
+    query = '''UPDATE user_goal_snapshot SET work_time=work_time+%s WHERE user_id=%s AND day=%s;'''
+    cur.execute(query, (int(work_time), str(uuid), str(clock.get_clock().today())))
+
+def _parse_time(value):
+    '''
+    Returns:
+        The value as a datetime, from a datetime, a date or a string such as
+        'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS', or None if it is none of them.
+    '''
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+
+    for form in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(str(value).strip(), form)
+        except ValueError:
+            pass
+
+    return None
+
+def _current_month():
+    '''
+    Returns:
+        The start of THIS month and of the next month, in the form of (start, end).
+    '''
+    today = clock.get_clock().today()
+    start = datetime.datetime(today.year, today.month, 1)
+
+    if today.month == 12:
+        end = datetime.datetime(today.year + 1, 1, 1)
+    else:
+        end = datetime.datetime(today.year, today.month + 1, 1)
+
+    return (start, end)
+
 def get_session_logs(slack_id, start_date, end_date):
     '''
     Get all the session logs that this slack user has within the timeframe.
@@ -322,6 +773,126 @@ def get_session_logs(slack_id, start_date, end_date):
 
     return result
 
+def get_session_logs_page(slack_id, start_date, end_date, cursor=None, page_size=50, verified=None):
+    '''
+    Get one page of the session logs that this slack user has within the
+    timeframe, newest first. Pages are found by keyset, so every page costs the
+    same no matter how deep into the history it is.
+
+    Args:
+        slack_id: The user's slack ID
+        start_date: The starting date to search for
+        end_date: The end date to stop search for
+        cursor: The cursor returned with the previous page, None for the first page
+        page_size: The maximum number of logs on the page
+        verified: True for only verified logs, False for only unverified logs, None for both
+    Returns:
+        A tuple in the form of (logs, cursor), where logs is a list of data in the form
+        of (log_id, user_id, work_time, start_date, end_date, approved) and cursor
+        is the cursor of the next page, or None if this was the last page.
+    '''
+
+    result = []
+
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''SELECT id, user_id, work_time, start, end, approved FROM log_user_session WHERE user_id=%s AND (start BETWEEN %s and %s)'''
+    data = [str(slack_id), str(start_date), str(end_date)]
+
+    if verified is True:
+        query = query + ''' AND approved IS NOT NULL'''
+    elif verified is False:
+        query = query + ''' AND approved IS NULL'''
+
+    # continue after the last log of the previous page
+    if cursor is not None:
+        cursor_start, cursor_id = cursor
+        query = query + ''' AND (start < %s OR (start = %s AND id < %s))'''
+        data.extend([cursor_start, cursor_start, int(cursor_id)])
+
+    # one extra log tells us whether there is another page
+    query = query + ''' ORDER BY start DESC, id DESC LIMIT %s;'''
+    data.append(int(page_size) + 1)
+    cur.execute(query, data)
+
+    rows = cur.fetchall()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = (rows[-1][3], int(rows[-1][0]))
+
+    for tup in rows:
+        log_id = int(tup[0])
+        user_id = str(tup[1])
+        work_time = int(tup[2])
+        start = str(tup[3])
+        end = str(tup[4])
+        approved = str(tup[5])
+
+        sl = (log_id, user_id, work_time, start, end, approved)
+        result.append(sl)
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return (result, next_cursor)
+
+def get_session_totals(start_date, end_date, team=None):
+    '''
+    Get the verified and not verified session totals of every user within the
+    timeframe, with one grouped query.
+
+    Args:
+        start_date: The starting date to search for
+        end_date: The end date to stop search for
+        team: The ID of a team to limit the totals to, or None for everyone
+    Returns:
+        A list of data in the form of (uuid, username, team, goal_hours, verified_time,
+        verified_count, not_verified_time, not_verified_count), where the times
+        are in milliseconds.
+    '''
+
+    result = []
+
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''SELECT U.uuid, U.username, U.team, U.monthly_hours, 
+        COALESCE(SUM(CASE WHEN L.approved IS NOT NULL THEN L.work_time ELSE 0 END), 0), COUNT(L.approved), 
+        COALESCE(SUM(CASE WHEN L.approved IS NULL THEN L.work_time ELSE 0 END), 0), COUNT(L.id) - COUNT(L.approved) 
+        FROM user U LEFT JOIN log_user_session L ON L.user_id=U.uuid AND (L.start BETWEEN %s and %s)'''
+    data = [str(start_date), str(end_date)]
+
+    if team is not None:
+        query = query + ''' WHERE U.team=%s'''
+        data.append(int(team))
+
+    query = query + ''' GROUP BY U.uuid, U.username, U.team, U.monthly_hours ORDER BY U.username;'''
+    cur.execute(query, data)
+
+    for tup in cur:
+        uuid = str(tup[0])
+        username = str(tup[1])
+        team_id = int(tup[2])
+        goal_hours = int(tup[3] or 0)
+        verified_time = int(tup[4])
+        verified_count = int(tup[5])
+        not_verified_time = int(tup[6])
+        not_verified_count = int(tup[7])
+
+        result.append((uuid, username, team_id, goal_hours, verified_time, verified_count, not_verified_time, not_verified_count))
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return result
+
 def get_verified_session_logs(slack_id, start_date, end_date):
     '''
     Get all the verified session logs that this slack user has within the timeframe.
@@ -340,7 +911,7 @@ def get_verified_session_logs(slack_id, start_date, end_date):
     db = settings.getDatabase()
 
     cur = db.cursor()
-    query = '''SELECT id, user_id, work_time, start, end, approved FROM log_user_session WHERE user_id=%s AND verified IS NOT NULL AND (start BETWEEN %s and %s) ORDER BY start DESC;'''
+    query = '''SELECT id, user_id, work_time, start, end, approved FROM log_user_session WHERE user_id=%s AND approved IS NOT NULL AND (start BETWEEN %s and %s) ORDER BY start DESC;'''
     data = (str(slack_id), str(start_date), str(end_date))
     cur.execute(query, data)
 
@@ -382,3 +953,126 @@ def verify_session_log(trans_id, verify_uuid):
     db.commit()
     cur.close()
 
+def verify_session_logs(trans_ids, verify_uuid):
+    '''
+    Verifies many session logs at once, signing the uuid to every transaction
+    ID that is not yet approved.
+
+    Args:
+        trans_ids: The IDs of the session logs
+        verify_uuid: The UUID of the user verifying
+
+    Returns:
+        The number of session logs that were verified.
+    '''
+    if trans_ids is None or len(trans_ids) == 0:
+        return 0
+
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''UPDATE log_user_session SET approved=%s WHERE approved IS NULL AND id IN (''' + ', '.join(['%s'] * len(trans_ids)) + ''');'''
+    data = [str(verify_uuid)] + [int(trans_id) for trans_id in trans_ids]
+    cur.execute(query, data)
+    count = int(cur.rowcount)
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return count
+
+def verify_unapproved_session_logs(verify_uuid, start_date, end_date, uuid=None, team=None):
+    '''
+    Verifies every session log that is not yet approved within the timeframe,
+    for one user, one team or everyone, in one statement.
+
+    Args:
+        verify_uuid: The UUID of the user verifying
+        start_date: The starting date to verify for
+        end_date: The end date to stop verifying for
+        uuid: The uuid of a user to limit the verifying to
+        team: The ID of a team to limit the verifying to
+
+    Returns:
+        The number of session logs that were verified.
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    cur = db.cursor()
+    query = '''UPDATE log_user_session L, user U SET L.approved=%s WHERE L.user_id=U.uuid AND L.approved IS NULL AND (L.start BETWEEN %s and %s)'''
+    data = [str(verify_uuid), str(start_date), str(end_date)]
+
+    if uuid is not None:
+        query = query + ''' AND L.user_id=%s'''
+        data.append(str(uuid))
+
+    if team is not None:
+        query = query + ''' AND U.team=%s'''
+        data.append(int(team))
+
+    cur.execute(query + ';', data)
+    count = int(cur.rowcount)
+
+    # commit query
+    db.commit()
+    cur.close()
+
+    return count
+
+def iter_session_logs(start_date, end_date, uuid=None, team=None, approved=None):
+    '''
+    Streams the session logs within the timeframe through an unbuffered,
+    server-side cursor, so any number of logs can be read in constant memory.
+
+    The database connection is busy until the generator is exhausted or closed,
+    so no other query may run while iterating.
+
+    Args:
+        start_date: The starting date to search for
+        end_date: The end date to stop search for
+        uuid: The uuid of a user to limit the logs to
+        team: The ID of a team to limit the logs to
+        approved: True for only approved logs, False for only unapproved logs, None for both
+    Returns:
+        A generator of data in the form of (log_id, user_id, username, team, work_time, start_date, end_date, approved).
+    '''
+    # Get new database instance
+    db = settings.getDatabase()
+
+    query = '''SELECT L.id, L.user_id, U.username, U.team, L.work_time, L.start, L.end, L.approved FROM log_user_session L, user U WHERE L.user_id=U.uuid AND (L.start BETWEEN %s and %s)'''
+    data = [str(start_date), str(end_date)]
+
+    if uuid is not None:
+        query = query + ''' AND L.user_id=%s'''
+        data.append(str(uuid))
+
+    if team is not None:
+        query = query + ''' AND U.team=%s'''
+        data.append(int(team))
+
+    if approved is True:
+        query = query + ''' AND L.approved IS NOT NULL'''
+    elif approved is False:
+        query = query + ''' AND L.approved IS NULL'''
+
+    query = query + ''' ORDER BY L.start, L.id;'''
+
+    cur = db.cursor(MySQLdb.cursors.SSCursor)
+    try:
+        cur.execute(query, data)
+
+        while True:
+            rows = cur.fetchmany(STREAM_FETCH_SIZE)
+            if not rows:
+                break
+
+            for tup in rows:
+                yield (int(tup[0]), str(tup[1]), str(tup[2]), int(tup[3]), int(tup[4]), tup[5], tup[6], tup[7])
+    finally:
+        cur.close()
+
+        # commit query
+        db.commit()
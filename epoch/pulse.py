@@ -1,26 +1,97 @@
 #!/usr/bin/python
 
 # local imports
+from component import checkpoint
+from component import lease
+from component import slack_request
 from component import user
 from component import user_session
 from settings import settings
-from util import nexus_utils
+from util import clock
+from util import control
+from util import scheduler
 from util import slack_api
+from util import timers
 
 # python modules
 import MySQLdb
+import datetime
+import glob
+import json
+import os
+import signal
 from threading import Thread
 import threading
 import time
 import sys
 import logging, logging.handlers
 
-# name of pid session file
-PID_NAME = 'pulse.pid'
+# the socket Pulse answers commands on, see CONTROL_COMMANDS
+CONTROL_SOCKET = 'pulse.sock'
+
+# Pulses sharing a machine after the first answer on pulse.<pid>.sock
+CONTROL_SOCKETS = 'pulse*.sock'
+
+# the commands of the control socket, and what they do
+CONTROL_COMMANDS = {
+    'status': 'show the users tracked, tick lag and queue depths',
+    'flush': 'credit and notify now, and write the metrics',
+    'pause': 'stop crediting until resumed, time paused is never credited',
+    'resume': 'credit again',
+    'reload': 're-read the settings and reschedule the maintenance jobs, as SIGHUP does',
+    'stop': 'credit up to now, hand the partitions over and stop, as SIGTERM does',
+}
 
 # How often Pulse operates in seconds. For example every 5 seconds add time.
 WORK_INTERVAL = 5
 
+# The longest gap between ticks that is credited in full, in seconds. Longer
+# gaps mean Pulse was stalled, Ex: the VM was paused, and are capped to this.
+MAX_CREDIT_GAP = 5 * 60
+
+# Ticks that run this many seconds late are written to the log
+LAG_WARNING = 2
+
+# The wall clock moving this many seconds more or less than the monotonic clock is a jump
+CLOCK_JUMP_WARNING = 2
+
+# File the tick metrics are written to
+METRICS_FILENAME = 'pulse_metrics.json'
+
+# Users are told how long they worked every hour
+HOUR_MS = 60 * 60 * 1000
+
+# Paused users are reminded every 15 minutes
+IDLE_REMINDER_MS = 15 * 60 * 1000
+
+# The users are split into partitions by uuid, and only the Pulse holding the
+# lease of a partition credits its users, Ex: pulse:0/4
+LEASE_NAME = 'pulse'
+
+# Each running Pulse holds a lease of this name followed by its id, so the
+# others know it is running
+WORKER_LEASE_NAME = 'worker:'
+
+# How long the lease lasts unless renewed, and how often it is renewed, in seconds
+LEASE_SECONDS = 10
+LEASE_RENEW = 3
+
+# How many state changes Pulse reads at a time
+STATE_CHANGE_BATCH = 1000
+
+# When each maintenance job runs, unless scheduler_settings overrides it
+JOB_SCHEDULES = {
+    'goal_snapshots': '0 0 * * *',
+    'state_purge': '30 3 * * *',
+    'archive_snapshot': '0 4 1 * *',
+    'scheduler_stats': '@hourly',
+    'state_resync': '@every 5m',
+    'tick_metrics': '@every 1m',
+    'checkpoint': '@every 1m',
+    'user_refresh': '@every 1m',
+    'request_purge': '@hourly',
+}
+
 # File that the results of this script writes to
 LOG_FILENAME = 'pulse.log'
 # construct logger
@@ -32,39 +103,482 @@ LOG.addHandler(handler)
 # configure a Slack server in order to send messages TO Slack
 slack_server = settings.getSlack()
 
+class Shard(object):
+    '''
+    The users of one partition of the uuids, with their notification state.
+    A Pulse credits and notifies the shards whose lease it holds.
+    '''
+    def __init__(self, partition, partitions, pulse_clock):
+        '''
+        Args:
+            partition: Which partition of the users, from 0 to partitions - 1
+            partitions: How many partitions the users are split into
+            pulse_clock: The clock the shard reads the time from
+        '''
+        self.partition = partition
+        self.partitions = partitions
+        self.lease_name = shard_lease_name(partition, partitions)
+        self.clock = pulse_clock
+        self.users = {}
+
+        # the database's time of the last load of the users, only those changed since are read
+        self.users_marker = None
+
+        # the monotonic time of the last credit of this shard
+        self.credit_event = self.clock.monotonic()
+
+        # the total credited to ONLINE users, notification deadlines are on this timeline
+        self.credited_ms = 0
+        self.timers = timers.TimerHeap()
+
+        # state changes up to this id are already in the states read on taking the shard
+        self.since_id = 0
+
+        self.online = 0
+        self.tick_stats = clock.TickStats()
+
+    def credit(self, curr_time, credit_amount, holder):
+        '''
+        Credits the ONLINE users of this shard, then sends the notifications
+        that are due.
+
+        Args:
+            curr_time: The monotonic time of the tick
+            credit_amount: How much the tick credits, in milliseconds
+            holder: Who holds the lease of this shard
+        '''
+        start = self.clock.monotonic()
+
+        # a shard taken since the last tick only credits since it was taken
+        credit_amount = min(credit_amount, int((curr_time - self.credit_event) * 1000))
+        self.credit_event = curr_time
+
+        # update in the db the work time of everyone ONLINE
+        self.online = user_session.credit_online_users(credit_amount, (self.lease_name, holder), (self.partition, self.partitions))
+        self.credited_ms = self.credited_ms + credit_amount
+
+        for uuid in self.timers.pop_due(self.credited_ms):
+            self.notify(self.users[uuid])
+
+        self.tick_stats.record(self.clock.monotonic() - start, 0.0, credit_amount)
+
+    def apply_state_change(self, uuid, state):
+        '''
+        Applies a state change of one of this shard's users.
+        '''
+        # a user created since the users were loaded
+        if uuid not in self.users:
+            self.load_users()
+
+        if uuid in self.users:
+            self.set_user_state(self.users[uuid], state)
+
+    def resync_states(self):
+        '''
+        Reads the state of every user of this shard, and applies the ones
+        that differ from what Pulse last saw. Users found ONLINE or PAUSED
+        keep the time they already worked.
+        '''
+        states = user_session.get_states((self.partition, self.partitions))
+
+        # users created since the users were loaded
+        if any(uuid not in self.users for uuid in states):
+            self.load_users()
+
+        for uuid in states:
+            if uuid not in self.users:
+                continue
+
+            user_obj = self.users[uuid]
+            state, work_time = states[uuid]
+
+            if user_obj.state != state:
+                self.set_user_state(user_obj, state)
+
+                if state != 'OFFLINE':
+                    # do not tell them again about the hours already worked
+                    user_obj.work_time_ms = work_time
+                    user_obj.notify_hour = max(user_obj.notify_hour, int(work_time / HOUR_MS))
+                    self.schedule_notification(user_obj)
+
+    def set_user_state(self, user_obj, state):
+        '''
+        Moves a user to a new state, and reschedules their next notification.
+
+        Args:
+            user_obj: The object that represents the user
+            state: The new state of the user
+        '''
+        self.sync_user(user_obj)
+
+        prev_state = user_obj.state
+        user_obj.state = state
+
+        if state == 'OFFLINE':
+            # reset their work time
+            user_obj.work_time_ms = 0
+            user_obj.pause_time_ms = 0
+            user_obj.notify_hour = 0
+        elif state == 'ONLINE':
+            # reset the pause time
+            user_obj.pause_time_ms = 0
+
+            if prev_state == 'OFFLINE':
+                user_obj.work_time_ms = 0
+                user_obj.notify_hour = 0
+
+        self.schedule_notification(user_obj)
+
+    def sync_user(self, user_obj):
+        '''
+        Brings the work and pause time of a user up to date with what was
+        credited since they were last looked at.
+        '''
+        elapsed = self.credited_ms - user_obj.credit_mark
+        user_obj.credit_mark = self.credited_ms
+
+        if user_obj.state == 'ONLINE':
+            user_obj.work_time_ms = user_obj.work_time_ms + elapsed
+        elif user_obj.state == 'PAUSED':
+            user_obj.pause_time_ms = user_obj.pause_time_ms + elapsed
+
+    def schedule_notification(self, user_obj):
+        '''
+        Sets when the user's next notification is due: at their next full
+        hour of work while ONLINE, or after 15 minutes while PAUSED.
+        '''
+        if user_obj.state == 'ONLINE':
+            left = (user_obj.notify_hour + 1) * HOUR_MS - user_obj.work_time_ms
+            self.timers.schedule(user_obj.uuid, self.credited_ms + max(left, 0))
+        elif user_obj.state == 'PAUSED':
+            left = IDLE_REMINDER_MS - user_obj.pause_time_ms + 1
+            self.timers.schedule(user_obj.uuid, self.credited_ms + max(left, 0))
+        else:
+            self.timers.cancel(user_obj.uuid)
+
+    def notify(self, user_obj):
+        '''
+        Sends the notification that is due for a user, and schedules the next one.
+        '''
+        self.sync_user(user_obj)
+
+        if user_obj.state == 'ONLINE':
+            # every hour notify them of how long they've worked
+            hours_worked = int(user_obj.work_time_ms / HOUR_MS)
+
+            # when did we last notify them about their time
+            if hours_worked >= 1 and user_obj.notify_hour < hours_worked:
+                user_obj.notify_hour = user_obj.notify_hour + 1
+
+                # send slack message to channel
+                slack_server.send_message(contents='You have been working for ' + str(hours_worked) + ' hours this session.', channel='@' + str(user_obj.username), username='Epoch Bot', icon_emoji=':loudspeaker:')
+        elif user_obj.state == 'PAUSED':
+            # if 15 minutes have passed, send slack notification
+            if user_obj.pause_time_ms > IDLE_REMINDER_MS:
+                user_obj.pause_time_ms = 0
+                # send slack message to channel
+                slack_server.send_message(contents='You have been idle/paused for 15 minutes. When you get back please use `/epoch resume`.', channel='@' + str(user_obj.username), username='Epoch Bot', icon_emoji=':loudspeaker:')
+
+        self.schedule_notification(user_obj)
+
+    def save_checkpoint(self):
+        '''
+        Saves the notification state of the users of this shard that are not
+        OFFLINE, so whoever credits them next carries on from it.
+        '''
+        entries = []
+
+        for uuid in self.users:
+            user_obj = self.users[uuid]
+            if user_obj.state != 'OFFLINE':
+                self.sync_user(user_obj)
+                entries.append((uuid, user_obj.state, user_obj.pause_time_ms, user_obj.notify_hour))
+
+        checkpoint.save_checkpoint(entries, (self.partition, self.partitions))
+
+    def restore_checkpoint(self):
+        '''
+        Carries on with the notifications of the users of this shard from the
+        last checkpoint, once their states are read. Their work time is the
+        one credited in the database.
+        '''
+        saved = checkpoint.get_checkpoint((self.partition, self.partitions))
+
+        for uuid in saved:
+            if uuid not in self.users or self.users[uuid].state == 'OFFLINE':
+                continue
+
+            user_obj = self.users[uuid]
+            state, pause_time, notify_hour, age = saved[uuid]
+            self.sync_user(user_obj)
+
+            # never past the hours worked, so an hour that came due before the restart is still told
+            user_obj.notify_hour = min(notify_hour, int(user_obj.work_time_ms / HOUR_MS))
+
+            # still paused, for as long as no Pulse was running too
+            if state == 'PAUSED' and user_obj.state == 'PAUSED':
+                user_obj.pause_time_ms = pause_time + age * 1000
+
+            self.schedule_notification(user_obj)
+
+    def load_users(self):
+        '''
+        Loads the users of this shard created or renamed since they were last
+        loaded, and forgets those that were removed.
+        '''
+        partition = (self.partition, self.partitions)
+
+        users, self.users_marker = user.get_changed_users(self.users_marker, partition)
+        for uuid, name in users:
+            if uuid in self.users:
+                self.users[uuid].username = name
+            else:
+                self.users[uuid] = user.User(uuid, name)
+
+        # removed users leave nothing to read, so the count tells when to look for them
+        if len(users) < len(self.users) and user.count_users(partition) != len(self.users):
+            uuids = user.get_uuids(partition)
+            for uuid in [uuid for uuid in self.users if uuid not in uuids]:
+                self.timers.cancel(uuid)
+                del self.users[uuid]
+
+    def metrics(self):
+        '''
+        Returns:
+            A dictionary of the metrics of this shard.
+        '''
+        metrics = self.tick_stats.metrics()
+        metrics['users'] = len(self.users)
+        metrics['online'] = self.online
+        metrics['pending_notifications'] = len(self.timers)
+        return metrics
+
 class Pulse(Thread):
-    def __init__(self):
+    def __init__(self, partitions=None):
+        '''
+        Args:
+            partitions: How many partitions the users are split into, pulse_settings by default
+        '''
         super(Pulse, self).__init__()
         self.stop_flag = threading.Event()
 
+        # wakes the loop up early, to act on a command at once
+        self.wake_flag = threading.Event()
+        self.reload_flag = threading.Event()
+        self.flush_flag = threading.Event()
+        self.flush_done = threading.Event()
+
         # settings for this module
         self.box_settings = settings.getSettings()
 
-        # counter for checking the .pid file
-        self.pid_counter = 0
+        # paused from the control socket, no time is credited while False
+        self.crediting = True
+        self.control = None
 
-        # the timestamp of the last time the credit for user sessions happened
-        self.credit_event = time.time()
-        self.users = {}
+        # the clock Pulse reads the time from, simulated when replaying activity
+        self.clock = clock.get_clock()
+        self.started = self.clock.monotonic()
+
+        # the monotonic and wall time of the last time the credit for user sessions happened
+        self.credit_event = self.clock.monotonic()
+        self.credit_wall = self.clock.time()
+
+        # ticks are due every WORK_INTERVAL on the monotonic clock
+        self.next_tick = self.credit_event + WORK_INTERVAL
+        self.tick_stats = clock.TickStats()
+
+        # the shards this Pulse holds the lease of, by partition
+        self.partitions = max(int(partitions or self.box_settings.pulse_partitions), 1)
+        self.shards = {}
+        self.last_state_id = 0
 
-        # create pid file
-        nexus_utils.create_pid(PID_NAME)
+        # the Pulses running share the partitions, each one takes those assigned to it
+        self.holder = str(self.box_settings.host_ip) + ':' + str(os.getpid())
+        self.workers = [self.holder]
+        self.lease_checked = None
+
+        # maintenance jobs, heavy ones run off this thread
+        self.scheduler = scheduler.Scheduler(workers=self.box_settings.scheduler_workers, clock=self.clock.time, timer=self.clock.monotonic, log=lambda message: LOG.debug(str(time.ctime(time.time())) + ': ' + message))
+        self.add_jobs(self.scheduler)
+
+        self.check_leases()
+        if len(self.shards) == 0:
+            print('Standing by, the partitions are held by ' + ', '.join(sorted(set(holder for name, holder in lease.get_leases(LEASE_NAME + ':')))))
+            LOG.debug(str(time.ctime(time.time())) + ': Standing by as ' + self.holder)
 
     def run(self):
         '''
         Runs the task.
         '''
 
-        # loop infinitely until stopped
+        self.open_control()
+
+        # loop infinitely until stopped, waking up in time for the next tick or a command
         while self.is_active():
             self.onInterval()
-            time.sleep(1)
+
+            if len(self.shards) > 0:
+                self.wake_flag.wait(min(1, max(self.next_tick - self.clock.monotonic(), 0)))
+            else:
+                self.wake_flag.wait(1)
+            self.wake_flag.clear()
+
+        self.shutdown()
 
     def stop(self):
         '''
-        Stop this task from running.
+        Stop this task from running. It credits up to now and hands its
+        partitions over before the thread ends. Safe to call from any thread.
         '''
         self.stop_flag.set()
+        self.wake_flag.set()
+
+    def request_reload(self):
+        '''
+        Asks the Pulse thread to re-read the settings. Safe to call from any thread.
+        '''
+        self.reload_flag.set()
+        self.wake_flag.set()
+
+    def shutdown(self):
+        '''
+        Credits up to now, hands the leases over and closes the database, once stopped.
+        '''
+        self.scheduler.stop()
+
+        # a graceful stop loses no credit
+        if len(self.shards) > 0:
+            try:
+                self.work(True)
+            except Exception as e:
+                print(e)
+                LOG.debug(str(time.ctime(time.time())) + ': Exception crediting on stop. Error: %s' % e)
+
+        try:
+            for partition in sorted(self.shards):
+                self.release_shard(partition)
+            lease.release_lease(WORKER_LEASE_NAME + self.holder, self.holder)
+        except Exception as e:
+            LOG.debug(str(time.ctime(time.time())) + ': Exception releasing the leases. Error: %s' % e)
+
+        if self.control is not None:
+            self.control.close()
+            self.control = None
+
+        # send slack message to channel
+        slack_server.send_message(contents='Epoch\'s Pulse has stopped!', channel='#work-progress', username='Epoch Bot', icon_emoji=':boom:')
+
+        # close db connection
+        settings.getSettings().close()
+
+    def open_control(self):
+        '''
+        Answers the CONTROL_COMMANDS on CONTROL_SOCKET, or on a socket of its
+        own when another Pulse on this machine answers there.
+        '''
+        path = CONTROL_SOCKET
+        if control.is_listening(path):
+            path = 'pulse.' + str(os.getpid()) + '.sock'
+
+        try:
+            self.control = control.ControlServer(path, self.handle_control)
+            self.control.start()
+            LOG.debug(str(time.ctime(time.time())) + ': Answering commands on ' + path)
+        except Exception as e:
+            print(e)
+            LOG.debug(str(time.ctime(time.time())) + ': Exception opening the control socket. Error: %s' % e)
+            self.control = None
+
+    def handle_control(self, command):
+        '''
+        Answers a command of the control socket, on the control socket's
+        thread. Commands that change Pulse are handed to the Pulse thread.
+
+        Args:
+            command: One of CONTROL_COMMANDS
+
+        Returns:
+            The reply, as a dictionary.
+        '''
+        command = command.lower()
+        LOG.debug(str(time.ctime(time.time())) + ': Control command ' + command)
+
+        if command == 'status':
+            reply = self.status()
+        elif command == 'flush':
+            self.flush_done.clear()
+            self.flush_flag.set()
+            self.wake_flag.set()
+            if not self.flush_done.wait(10):
+                return {'ok': False, 'error': 'Pulse did not flush within 10 seconds'}
+            reply = self.status()
+        elif command == 'pause':
+            self.crediting = False
+            reply = self.status()
+        elif command == 'resume':
+            self.crediting = True
+            reply = self.status()
+        elif command == 'reload':
+            self.request_reload()
+            reply = {}
+        elif command == 'stop':
+            self.stop()
+            reply = {}
+        else:
+            return {'ok': False, 'error': 'Unknown command ' + command + ', expected one of ' + ', '.join(sorted(CONTROL_COMMANDS))}
+
+        reply['ok'] = True
+        return reply
+
+    def status(self):
+        '''
+        Returns:
+            A dictionary of what this Pulse is doing.
+        '''
+        shards = list(self.shards.values())
+        now = self.clock.monotonic()
+
+        return {
+            'holder': self.holder,
+            'workers': self.workers,
+            'partitions': self.partitions,
+            'shards': sorted(shard.partition for shard in shards),
+            'leader': self.is_leader(),
+            'crediting': self.crediting,
+            'uptime': now - self.started,
+            'users': sum(len(shard.users) for shard in shards),
+            'online': sum(shard.online for shard in shards),
+            'pending_notifications': sum(len(shard.timers) for shard in shards),
+            'pending_jobs': self.scheduler.queue.qsize(),
+            'running_jobs': sorted(name for name, job in self.scheduler.jobs.items() if job.running),
+            'last_state_id': self.last_state_id,
+            'next_tick': self.next_tick - now,
+            'ticks': self.tick_stats.metrics(),
+        }
+
+    def reload(self):
+        '''
+        Re-reads the settings, and reschedules the maintenance jobs with them.
+        The partitions and database settings need a restart.
+        '''
+        self.box_settings = settings.reloadSettings()
+
+        if self.box_settings.pulse_partitions != self.partitions:
+            LOG.debug(str(time.ctime(time.time())) + ': The partitions changed to ' + str(self.box_settings.pulse_partitions) + ', restart Pulse to use them')
+
+        # the jobs keep running on the previous scheduler until every one was rescheduled
+        previous = self.scheduler
+        jobs = scheduler.Scheduler(workers=self.box_settings.scheduler_workers, clock=self.clock.time, timer=self.clock.monotonic, log=previous.log)
+        try:
+            self.add_jobs(jobs)
+        except Exception:
+            jobs.stop()
+            raise
+
+        self.scheduler = jobs
+        previous.stop()
+
+        LOG.debug(str(time.ctime(time.time())) + ': Reloaded the settings')
 
     def is_active(self):
         '''
@@ -73,156 +587,437 @@ class Pulse(Thread):
         '''
         return not self.stop_flag.isSet()
 
+    def is_leader(self):
+        '''
+        Returns:
+            True if this Pulse holds the first partition, and runs the maintenance jobs.
+        '''
+        return 0 in self.shards
+
     def onInterval(self):
         '''
         Every interval of the task, we want to do something.
         '''
+        if self.reload_flag.is_set():
+            self.reload_flag.clear()
+            try:
+                self.reload()
+            except Exception as e:
+                print(e)
+                LOG.debug(str(time.ctime(time.time())) + ': Exception reloading the settings. Error: %s' % e)
+
+        # renew the leases, and rebalance the partitions when Pulses start or stop
+        self.check_leases()
+
         try:
-            # check if Pulse is still running
-            self.check_pulse()
+            # start the maintenance jobs that are due
+            self.scheduler.run_pending()
         except Exception as e:
             print(e)
-            LOG.debug(str(time.ctime(time.time())) + ': Exception checking pulse. Error: %s' % e)
+            LOG.debug(str(time.ctime(time.time())) + ': Exception scheduling jobs. Error: %s' % e)
 
-        # try:
-        self.work()
-        # except Exception as e:
-        #     print(e)
-        #     LOG.debug(str(time.ctime(time.time())) + ': Exception working. Error: %s' % e)
+        flush = self.flush_flag.is_set()
 
+        if len(self.shards) > 0:
+            # try:
+            self.work(flush)
+            # except Exception as e:
+            #     print(e)
+            #     LOG.debug(str(time.ctime(time.time())) + ': Exception working. Error: %s' % e)
 
-    def check_pulse(self):
+        if flush:
+            self.flush_flag.clear()
+            self.write_tick_metrics()
+            self.flush_done.set()
+
+    def check_leases(self):
         '''
-        Read the pulse of this task.
+        Every LEASE_RENEW seconds, renews the lease that tells the other
+        Pulses this one is running, and the leases of its shards. The running
+        Pulses are ordered by their id, and each one is assigned the
+        partitions whose number modulo the number of Pulses is its position.
+        A partition assigned elsewhere is released, so its new owner can take
+        it at once. The partitions of a Pulse that died are taken over once
+        its leases expire.
         '''
+        now = self.clock.monotonic()
+        if self.lease_checked is not None and now - self.lease_checked < LEASE_RENEW:
+            return
+        self.lease_checked = now
+
+        try:
+            lease.acquire_lease(WORKER_LEASE_NAME + self.holder, self.holder, LEASE_SECONDS)
 
-        # increment pid counter
-        self.pid_counter = self.pid_counter + 1
+            workers = sorted(set([holder for name, holder in lease.get_leases(WORKER_LEASE_NAME)] + [self.holder]))
+            if workers != self.workers:
+                LOG.debug(str(time.ctime(time.time())) + ': Running Pulses are now ' + ', '.join(workers))
+                self.workers = workers
+            position = workers.index(self.holder)
 
-        if self.pid_counter > 10:
-            self.pid_counter = 0
+            for partition in range(self.partitions):
+                if partition % len(workers) != position:
+                    if partition in self.shards:
+                        self.release_shard(partition)
+                    continue
 
-            # if no pid, stop running
-            if not nexus_utils.get_pid(PID_NAME):
-                print('No pid exists, stopping!')
-                self.stop()
+                held = lease.acquire_lease(shard_lease_name(partition, self.partitions), self.holder, LEASE_SECONDS)
+                if held and partition not in self.shards:
+                    self.take_shard(partition)
+                elif not held and partition in self.shards:
+                    self.drop_shard(partition)
+        except Exception as e:
+            print(e)
+            LOG.debug(str(time.ctime(time.time())) + ': Exception checking the leases. Error: %s' % e)
 
-                # send slack message to channel
-                slack_server.send_message(contents='Epoch\'s Pulse has stopped! It died!?', channel='#work-progress', username='Epoch Bot', icon_emoji=':boom:')
+            # the leases can not be renewed, so stop crediting before they expire
+            for partition in sorted(self.shards):
+                self.drop_shard(partition)
+
+    def take_shard(self, partition):
+        '''
+        Starts crediting a partition, from the states as they are now, as its
+        previous owner may have credited until its lease expired.
+        '''
+        LOG.debug(str(time.ctime(time.time())) + ': Took partition ' + str(partition) + '/' + str(self.partitions) + ' as ' + self.holder)
+
+        if len(self.shards) == 0:
+            self.credit_event = self.clock.monotonic()
+            self.credit_wall = self.clock.time()
+            self.next_tick = self.credit_event + WORK_INTERVAL
+
+        shard = Shard(partition, self.partitions, self.clock)
+
+        # follow state changes from now on
+        shard.since_id = user.get_last_state_change_id()
+        if len(self.shards) == 0:
+            self.last_state_id = shard.since_id
+        shard.load_users()
+        shard.resync_states()
+
+        try:
+            shard.restore_checkpoint()
+        except Exception as e:
+            print(e)
+            LOG.debug(str(time.ctime(time.time())) + ': Exception restoring the checkpoint of partition ' + str(partition) + '. Error: %s' % e)
+
+        self.shards[partition] = shard
+
+    def drop_shard(self, partition):
+        '''
+        Stops crediting a partition, as another Pulse has taken its lease.
+        '''
+        LOG.debug(str(time.ctime(time.time())) + ': Lost partition ' + str(partition) + '/' + str(self.partitions) + ' as ' + self.holder)
+        del self.shards[partition]
+
+    def release_shard(self, partition):
+        '''
+        Stops crediting a partition, and hands its lease over.
+        '''
+        LOG.debug(str(time.ctime(time.time())) + ': Released partition ' + str(partition) + '/' + str(self.partitions) + ' as ' + self.holder)
+        shard = self.shards.pop(partition)
+
+        # whoever takes it over carries on from here
+        try:
+            shard.save_checkpoint()
+        except Exception as e:
+            print(e)
+            LOG.debug(str(time.ctime(time.time())) + ': Exception saving the checkpoint of partition ' + str(partition) + '. Error: %s' % e)
+
+        lease.release_lease(shard.lease_name, self.holder)
+
+    def add_jobs(self, jobs):
+        '''
+        Adds the maintenance jobs to a scheduler. Jobs on the whole database
+        only run on the leader.
+
+        Args:
+            jobs: The scheduler to add the jobs to
+        '''
+        schedules = dict(JOB_SCHEDULES)
+        schedules.update(self.box_settings.scheduler_jobs)
+
+        # computed on start too, as snapshots may be stale
+        jobs.add_job('goal_snapshots', schedules['goal_snapshots'], self.leader_job(lambda: run_with_database(user_session.refresh_goal_snapshots)), heavy=True, run_now=True)
+
+        if self.box_settings.state_retention_days > 0:
+            jobs.add_job('state_purge', schedules['state_purge'], self.leader_job(lambda: run_with_database(purge_state_logs)), heavy=True)
+
+        if self.box_settings.slack_dedup_table:
+            jobs.add_job('request_purge', schedules['request_purge'], self.leader_job(lambda: run_with_database(purge_slack_requests)), heavy=True)
+
+        # the archive needs numpy, which is optional
+        try:
+            from analytics import snapshot
+            jobs.add_job('archive_snapshot', schedules['archive_snapshot'], self.leader_job(lambda: run_with_database(lambda db: snapshot.snapshot_closed_months(self.box_settings.archive_directory, db))), heavy=True)
+        except ImportError as e:
+            LOG.debug(str(time.ctime(time.time())) + ': Not archiving closed months. Error: %s' % e)
 
-                # close db connection
-                settings.getSettings().close()
-                return
+        jobs.add_job('scheduler_stats', schedules['scheduler_stats'], self.log_job_stats)
 
-    def work(self):
+        # catches state changes the change feed may have missed
+        jobs.add_job('state_resync', schedules['state_resync'], self.resync_states)
+
+        jobs.add_job('tick_metrics', schedules['tick_metrics'], self.write_tick_metrics)
+
+        # so a restart carries on with the notifications, on this thread as it reads the shards
+        jobs.add_job('checkpoint', schedules['checkpoint'], self.save_checkpoints)
+
+        # picks up the users created, renamed and removed
+        jobs.add_job('user_refresh', schedules['user_refresh'], self.load_users)
+
+    def load_users(self):
+        '''
+        Loads the changes to the users of every shard this Pulse holds.
+        '''
+        for partition in sorted(self.shards):
+            self.shards[partition].load_users()
+
+    def save_checkpoints(self):
+        '''
+        Saves the checkpoint of every shard this Pulse holds.
+        '''
+        for partition in sorted(self.shards):
+            self.shards[partition].save_checkpoint()
+
+    def leader_job(self, func):
+        '''
+        Returns:
+            A function that runs func, only while this Pulse is the leader.
+        '''
+        def run():
+            if self.is_leader():
+                func()
+        return run
+
+    def write_tick_metrics(self):
+        '''
+        Writes the tick metrics, and those of each shard, to the metrics file,
+        and a summary to the log.
         '''
-        This pulse works, serving the users, incrementing their times.
+        metrics = self.tick_stats.metrics()
+        metrics['time'] = self.clock.time()
+        metrics['holder'] = self.holder
+        metrics['workers'] = self.workers
+        metrics['partitions'] = self.partitions
+        metrics['users'] = sum(len(shard.users) for shard in self.shards.values())
+        metrics['pending_notifications'] = sum(len(shard.timers) for shard in self.shards.values())
+        metrics['shards'] = dict((str(partition), self.shards[partition].metrics()) for partition in self.shards)
+
+        # Pulses on the same machine each write their own file
+        filename = METRICS_FILENAME
+        if self.partitions > 1:
+            filename = 'pulse_metrics.' + str(os.getpid()) + '.json'
+
+        # replaced at once, so readers never see half a file
+        f = open(filename + '.tmp', 'w')
+        f.write(json.dumps(metrics))
+        f.close()
+        os.rename(filename + '.tmp', filename)
+
+        LOG.debug(str(time.ctime(time.time())) + ': Ticks ' + str(self.tick_stats))
+        for partition in sorted(self.shards):
+            LOG.debug(str(time.ctime(time.time())) + ': Partition ' + str(partition) + ' ticks ' + str(self.shards[partition].tick_stats))
+
+    def log_job_stats(self):
+        '''
+        Writes the statistics of every maintenance job to the log.
+        '''
+        for name in sorted(self.scheduler.jobs):
+            LOG.debug(str(time.ctime(time.time())) + ': ' + str(self.scheduler.jobs[name]))
+
+    def work(self, force=False):
+        '''
+        This pulse works, serving the users, incrementing their times. Only
+        the users with a due notification are looked at, so a tick does not
+        grow with the number of users.
+
+        Ticks are timed on the monotonic clock, so changes to the wall clock
+        never change what is credited.
+
+        Args:
+            force: True to tick now, even if the next tick is not due
         '''
 
         # get the current time
-        curr_time = time.time()
+        curr_time = self.clock.monotonic()
 
-        if curr_time - self.credit_event > WORK_INTERVAL:
+        if force or curr_time >= self.next_tick:
+
+            # how late this tick is
+            lag = max(curr_time - self.next_tick, 0.0)
+            if lag > LAG_WARNING:
+                LOG.debug(str(time.ctime(time.time())) + ': Tick ran ' + ('%.3f' % lag) + ' seconds late')
 
             # amount of milliseconds to credit to everyone working
-            credit_amount = int((curr_time - self.credit_event) * 1000)
+            gap = curr_time - self.credit_event
+            credit_amount = int(gap * 1000)
+
+            # the wall clock should have moved as much as the monotonic clock
+            curr_wall = self.clock.time()
+            jump = (curr_wall - self.credit_wall) - gap
+            if abs(jump) > CLOCK_JUMP_WARNING:
+                self.tick_stats.record_clock_jump(jump)
+                LOG.debug(str(time.ctime(time.time())) + ': Wall clock jumped ' + ('%.3f' % jump) + ' seconds, credited ' + ('%.3f' % gap) + ' seconds from the monotonic clock')
+
+            # a stalled Pulse should not credit everyone for the whole stall
+            if credit_amount > MAX_CREDIT_GAP * 1000:
+                self.tick_stats.record_cap(credit_amount - MAX_CREDIT_GAP * 1000)
+                LOG.debug(str(time.ctime(time.time())) + ': Tick gap of ' + ('%.3f' % gap) + ' seconds capped to ' + str(MAX_CREDIT_GAP) + ' seconds')
+                credit_amount = MAX_CREDIT_GAP * 1000
 
             # update timestamp for last time we credited
             self.credit_event = curr_time
+            self.credit_wall = curr_wall
 
-            # load all users from db, if they dont exist in hash yet
-            self.load_users()
-
-            for key in self.users:
-                user_obj = self.users[key]
+            # the next tick keeps its cadence, unless this one was a whole interval late
+            self.next_tick = self.next_tick + WORK_INTERVAL
+            if self.next_tick <= curr_time:
+                self.next_tick = curr_time + WORK_INTERVAL
 
-                # get the state of the user
-                state = user_session.get_state(user_obj.uuid)
+            # apply who started, paused, resumed or stopped since the last tick
+            self.apply_state_changes()
 
-                if state == 'ONLINE':
-                    # update in the db their work time
-                    user_session.update_work_time(user_obj.uuid, credit_amount)
+            # while paused, the time passes without being credited
+            if not self.crediting:
+                credit_amount = 0
 
-                    user_obj.work_time_ms = user_obj.work_time_ms + credit_amount
+            for partition in sorted(self.shards):
+                self.shards[partition].credit(curr_time, credit_amount, self.holder)
 
-                    # every hour notify them of how long they've worked
-                    hours_worked = int(user_obj.work_time_ms / 3600000)
-                    if hours_worked >= 1:
+            self.tick_stats.record(self.clock.monotonic() - curr_time, lag, credit_amount)
 
-                        # when did we last notify them about their time
-                        if user_obj.notify_hour < hours_worked:
-                            user_obj.notify_hour = user_obj.notify_hour + 1
+    def apply_state_changes(self):
+        '''
+        Reads the state changes logged since the last ones that were applied,
+        and hands each one to the shard of its user.
+        '''
+        while True:
+            changes = user.get_state_changes(self.last_state_id, STATE_CHANGE_BATCH)
 
-                            # send slack message to channel
-                            slack_server.send_message(contents='You have been working for ' + str(hours_worked) + ' hours this session.', channel='@' + str(user_obj.username), username='Epoch Bot', icon_emoji=':loudspeaker:')
+            for change_id, uuid, state, prev_state in changes:
+                self.last_state_id = change_id
 
-                    # reset the pause time
-                    user_obj.pause_time_ms = 0
-                elif state == 'PAUSED':
-                    user_obj.pause_time_ms = user_obj.pause_time_ms + credit_amount
+                shard = self.shards.get(user_session.partition_of(uuid, self.partitions))
+                if shard is not None and change_id > shard.since_id:
+                    shard.apply_state_change(uuid, state)
 
-                    # if 15 minutes have passed, send slack notification
-                    if user_obj.pause_time_ms > 15 * 60 * 1000:
-                        user_obj.pause_time_ms = 0
-                        # send slack message to channel
-                        slack_server.send_message(contents='You have been idle/paused for 15 minutes. When you get back please use `/epoch resume`.', channel='@' + str(user_obj.username), username='Epoch Bot', icon_emoji=':loudspeaker:')
-                elif state == 'OFFLINE':
-                    # reset their work time
-                    user_obj.work_time_ms = 0
-                    user_obj.pause_time_ms = 0
-                    user_obj.notify_hour = 0
+            if len(changes) < STATE_CHANGE_BATCH:
+                break
 
-    def load_users(self):
+    def resync_states(self):
         '''
-        Loads all the users to this Pulse.
+        Reads the state of the users of every shard, and applies the ones
+        that differ from what Pulse last saw.
         '''
-        # load all the users
-        users = user.get_all_users()
-        if users is not None and len(users) > 0:
-            for uuid, name in users:
-                # if not already loaded in, create it
-                if uuid not in self.users:
-                    u_obj = user.User(uuid, name)
-                    self.users[uuid] = u_obj
+        for partition in sorted(self.shards):
+            self.shards[partition].resync_states()
+
+def shard_lease_name(partition, partitions):
+    '''
+    Returns:
+        The name of the lease of a partition of the users.
+    '''
+    return LEASE_NAME + ':' + str(partition) + '/' + str(partitions)
 
+def run_with_database(func):
+    '''
+    Runs a job on its own database connection, as the shared one can not be
+    used from the worker threads.
 
-def force_logout_users():
+    Args:
+        func: The function to run, given the connection
+    '''
+    db = settings.newDatabase()
+    try:
+        func(db)
+    finally:
+        db.close()
+
+def purge_state_logs(db):
     '''
-    Forces all the users to logout, sending them a notification.
+    Deletes the state changes older than state_retention_days.
     '''
-    users = user.get_all_users()
+    before = clock.get_clock().now() - datetime.timedelta(days=settings.getSettings().state_retention_days)
+    deleted = user.purge_state_logs(before.strftime('%Y-%m-%d %H:%M:%S'), db)
+
+    LOG.debug(str(time.ctime(time.time())) + ': Purged ' + str(deleted) + ' state changes before ' + str(before))
 
-    if users is not None and len(users) > 0:
-        for uuid, username in users:
+def purge_slack_requests(db):
+    '''
+    Deletes the Slack requests kept longer than Slack retries them.
+    '''
+    deleted = slack_request.purge_requests(settings.getSettings().slack_dedup_seconds, db)
 
-            state = user_session.get_state(uuid)
-            if state != 'OFFLINE':
+    LOG.debug(str(time.ctime(time.time())) + ': Purged ' + str(deleted) + ' Slack requests')
 
-                print('Force logging out ' + str(username) + ' as their state was ' + str(state))
-                LOG.debug(str(time.ctime(time.time())) + ': Force logging out ' + str(username) + ' as their state was ' + str(state))
+def force_logout_users():
+    '''
+    Forces all the users to logout at once, then sends each of them a
+    notification from a background thread, so Pulse starts without waiting
+    on Slack.
 
-                # set the new state
-                user_session.set_state(uuid, 'OFFLINE')
-                user.log_state_change(uuid, 'OFFLINE', state)
+    Returns:
+        The number of users that were logged out.
+    '''
+    users = user_session.force_logout_all()
 
-                # get how long they worked
-                msecs = user_session.get_work_time(uuid)
-                start_time = user_session.get_session_timestamp(uuid)
-                end_time = time.strftime('%Y-%m-%d %H:%M:%S')
+    messages = []
+    for uuid, username, state in users:
+        LOG.debug(str(time.ctime(time.time())) + ': Force logged out ' + str(username) + ' as their state was ' + str(state))
+        messages.append({'text': 'Epoch was restarted and you were logged out. Please use `/epoch start`.', 'channel': '@' + str(username), 'username': 'Epoch Bot', 'icon_emoji': ':loudspeaker:'})
 
-                # create the session log
-                user_session.create_user_session_log(uuid, msecs, start_time, end_time)
+    print('Force logged out ' + str(len(users)) + ' users')
 
-                # reset their work time to 0
-                user_session.set_work_time(uuid, 0)
-                user_session.set_session_timestamp(uuid)
+    if len(messages) > 0:
+        sender = slack_api.BulkSender(slack_server, rate=settings.getSettings().slack_rate_limit)
+        notify = Thread(target=sender.send_all, args=(messages,))
+        notify.daemon = True
+        notify.start()
 
-                # send slack message to channel
-                slack_server.send_message(contents='Epoch was restarted and you were logged out. Please use `/epoch start`.', channel='@' + str(username), username='Epoch Bot', icon_emoji=':loudspeaker:')
+    return len(users)
 
 # if ran from command line
+def send_control(command):
+    '''
+    Sends a command to every Pulse running on this machine, printing their replies.
+
+    Args:
+        command: One of CONTROL_COMMANDS
+
+    Returns:
+        The number of Pulses that answered.
+    '''
+    answered = 0
+
+    for path in sorted(glob.glob(CONTROL_SOCKETS)):
+        try:
+            reply = control.send_command(path, command)
+        except Exception as e:
+            print(path + ': not answering (' + str(e) + ')')
+            continue
+
+        answered = answered + 1
+        print(path + ': ' + json.dumps(reply, indent=2, sort_keys=True))
+
+    if answered == 0:
+        print('No Pulse is running')
+
+    return answered
+
 if __name__ == '__main__':
 
+    if len(sys.argv) > 1 and sys.argv[1].lower() in CONTROL_COMMANDS:
+        # talk to the running Pulses instead of starting one
+        if send_control(sys.argv[1].lower()) == 0:
+            sys.exit(1)
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1].lower() == 'help':
+        print('Usage: python pulse.py [CLEAN | ' + ' | '.join(sorted(CONTROL_COMMANDS)) + ']')
+        for command in sorted(CONTROL_COMMANDS):
+            print('  ' + command + ': ' + CONTROL_COMMANDS[command])
+        sys.exit(0)
+
     print('Starting Pulse... vroom vroom')
     LOG.debug(str(time.ctime(time.time())) + ': Starting Pulse...: vroom vroom')
 
@@ -230,14 +1025,26 @@ if __name__ == '__main__':
         cmd = sys.argv[1]
 
         if cmd == 'CLEAN' or cmd == 'clean':
-            force_logout_users()
+            # the users of a running Pulse are not logged out by its standby
+            holders = lease.get_leases(LEASE_NAME + ':')
+            if len(holders) == 0:
+                force_logout_users()
+            else:
+                print('Not logging out users, Pulse ' + str(holders[0][1]) + ' is running')
 
         # send slack message to channel
     slack_server.send_message(contents='Epoch\'s Pulse has now been started!', channel='#work-progress', username='Epoch Bot', icon_emoji=':rocket:')
 
     # Schedule a repeating task to handle off thread instructions
     pulse = Pulse()
-    pulse.start()
 
+    # SIGTERM and ctrl-c drain gracefully, SIGHUP reloads the settings
+    signal.signal(signal.SIGTERM, lambda signum, frame: pulse.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: pulse.stop())
+    signal.signal(signal.SIGHUP, lambda signum, frame: pulse.request_reload())
 
+    pulse.start()
 
+    # signals are only delivered to the main thread, so it waits in short steps
+    while pulse.is_alive():
+        pulse.join(1)
@@ -5,16 +5,19 @@ from component import repo
 from component import user
 from component import user_session
 from settings import settings
+from util import json_stream
 
 # python modules
 from flask import Response
 
-def parse_request(data_form):
+def parse_request(data_form, commits=None):
 	'''
 	Parses the request using the specified data_form.
 
 	Args:
 		data_form: The data form from the request
+		commits: An optional iterable of changeset values, streamed separately
+			from the data form. Defaults to the values in the data form.
 
 	Returns:
 		A response object based off of how the request was parsed.
@@ -48,11 +51,17 @@ def parse_request(data_form):
 		if 'changesets' in data_form and valid:
 			change_sets = data_form['changesets']
 
-			if 'values' in change_sets:
-				values = change_sets['values']
+			if commits is None and 'values' in change_sets:
+				commits = change_sets['values']
 
-				if values is not None and len(values) > 0:
-					for v in values:
+			# the open session of each committer, None if they are OFFLINE
+			sessions = {}
+
+			if commits is not None:
+				# insert the changesets in bounded batches
+				for batch in json_stream.batches(commits, settings.getSettings().payload_batch_size):
+					rows = []
+					for v in batch:
 
 						# extract the toCommit
 						if 'toCommit' in v:
@@ -67,10 +76,19 @@ def parse_request(data_form):
 								slack_uuid = _get_slack_uuid(committer_email)
 								if slack_uuid is not None:
 
-									user_state = user_session.get_state(slack_uuid)
-									if user_state == 'OFFLINE':
-										# send slack message to channel
-										settings.getSlack().send_message(contents='I see you sent a commit for the ' + str(repo_name) + ' repository. You know you are OFFLINE with Epoch right?', channel=str(slack_uuid), username='Epoch Bot', icon_emoji=':loudspeaker:')
+									# look up each committer's session once per push
+									if slack_uuid not in sessions:
+										session_id = None
+
+										user_state = user_session.get_state(slack_uuid)
+										if user_state == 'OFFLINE':
+											# send slack message to channel
+											settings.getSlack().send_message(contents='I see you sent a commit for the ' + str(repo_name) + ' repository. You know you are OFFLINE with Epoch right?', channel=str(slack_uuid), username='Epoch Bot', icon_emoji=':loudspeaker:')
+										else:
+											# attribute the commits to their open session
+											session_id = user_session.get_session_id(slack_uuid)
+
+										sessions[slack_uuid] = session_id
 
 									commit_id = to_commit['id']
 									message_data = str(to_commit['message'].encode('ascii', 'ignore'))
@@ -78,8 +96,10 @@ def parse_request(data_form):
 									# find the first commit url
 									commit_url = _filter_url(v)
 
-									# create the commit log
-									repo.create_commit_log(repo_id=repo_id, user_id=slack_uuid, commit_text=message_data, commit_url=commit_url)
+									rows.append((repo_id, slack_uuid, message_data, commit_url, sessions[slack_uuid]))
+
+					# create the commit logs
+					repo.create_commit_logs(rows)
 		else:
 			print('Unable to validate this payload, as the form was not valid.')
 					
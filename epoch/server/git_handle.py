@@ -5,16 +5,19 @@ from component import repo
 from component import user
 from component import user_session
 from settings import settings
+from util import json_stream
 
 # python modules
 from flask import Response
 
-def parse_request(data_form):
+def parse_request(data_form, commits=None):
 	'''
 	Parses the request using the specified data_form.
 
 	Args:
 		data_form: The data form from the request
+		commits: An optional iterable of commits, streamed separately from
+			the data form. Defaults to the commits in the data form.
 
 	Returns:
 		A response object based off of how the request was parsed.
@@ -39,6 +42,9 @@ def parse_request(data_form):
 			# make sure github info for this user is set in DB
 			repo.check_git_user(sender_id, sender_name)
 			
+			# the open session of the user, if they are not OFFLINE
+			session_id = None
+
 			# check their state, to notify them that they might be offline
 			slack_uuid = repo.get_slack_uuid(sender_id, sender_name)
 			if slack_uuid is not None:
@@ -46,16 +52,24 @@ def parse_request(data_form):
 				if user_state == 'OFFLINE':
 					# send slack message to channel
 					settings.getSlack().send_message(contents='I see you sent a commit for the ' + str(repo_name) + ' repository. You know you are OFFLINE with Epoch right?', channel=str(slack_uuid), username='Epoch Bot', icon_emoji=':loudspeaker:')
+				else:
+					# attribute the commits to their open session
+					session_id = user_session.get_session_id(slack_uuid)
+
+			if commits is None and 'commits' in data_form:
+				commits = data_form['commits']
 
-			if 'commits' in data_form:
-				commit_data = data_form['commits']
+			if commits is not None:
+				# insert the commits in bounded batches
+				for batch in json_stream.batches(commits, settings.getSettings().payload_batch_size):
+					rows = []
+					for c in batch:
+						message_data = str(c['message'].encode('ascii', 'ignore'))
+						commit_url = str(c['url'])
 
-				# for each commit
-				for c in commit_data:
-					message_data = str(c['message'].encode('ascii', 'ignore'))
-					commit_url = str(c['url'])
+						rows.append((repo_id, slack_uuid, message_data, commit_url, session_id))
 
-					repo.create_commit_log(repo_id=repo_id, user_id=slack_uuid, commit_text=message_data, commit_url=commit_url)
+					repo.create_commit_logs(rows)
 					
 	return Response('Okay'), 200
 
@@ -4,12 +4,12 @@
 from component import user
 from component import user_session
 from component import repo
+from util import clock
 from util import slack_api
 from settings import settings
 
 # python modules
 from flask import Response
-import time
 import datetime
 import json
 
@@ -18,6 +18,13 @@ ICON_URL = settings.getSettings().company_icon
 COMPANY_NAME = settings.getSettings().company_name
 COMPANY_URL = settings.getSettings().company_url
 
+# the most commits shown per repository in the logout digest
+DIGEST_COMMITS_PER_REPO = 5
+# the most repositories shown in the logout digest
+DIGEST_MAX_REPOS = 10
+# the longest digest text, Slack collapses or rejects longer attachments
+DIGEST_MAX_LENGTH = 4000
+
 # configure a Slack server in order to send messages TO Slack
 slack_server = settings.getSlack()
 
@@ -64,84 +71,55 @@ def handle_command(user_obj, command, data):
 		A response object based off of how the request's command was handled.
 	'''
 
-	# get the current state of the user
-	state = user_session.get_state(user_obj.uuid)
-
+	# each command only applies if the user is still in the state it expects, so a retry or a double click applies once
 	if command == 'START':
-		if state == 'OFFLINE':
-
-			# set the new state
-			user_session.set_state(user_obj.uuid, 'ONLINE')
-			user.log_state_change(user_obj.uuid, 'ONLINE', 'OFFLINE')
-
-			# the timestamp needs updated
-			user_session.set_work_time(user_obj.uuid, 0)
-			user_session.set_session_timestamp(user_obj.uuid)
+		if user_session.transition(user_obj.uuid, 'OFFLINE', 'ONLINE') is not None:
 
 			# send slack message to channel
 			slack_server.send_message(contents=str(user_obj.username) + ' is now online!', channel='#work-progress', username='Epoch Bot', icon_emoji=':green_heart:')
 
 			return Response(response=json.dumps(build_login_response(user_obj)), status=200, mimetype='application/json')
 		else:
-			return Response('In order to use [start], you must be in OFFLINE mode. You are in ' + str(state) + ' mode!'), 200
+			return Response('In order to use [start], you must be in OFFLINE mode. You are in ' + str(user_session.get_state(user_obj.uuid)) + ' mode!'), 200
 	elif command == 'STOP':
-		if state == 'ONLINE':
+		# the goal before this session counts towards it
+		goal_hours = user.determine_goal_hours_today(user_obj.uuid)
 
-			# set the new state
-			user_session.set_state(user_obj.uuid, 'OFFLINE')
-			user.log_state_change(user_obj.uuid, 'OFFLINE', 'ONLINE')
+		# set the new state, and log the session
+		session = user_session.transition(user_obj.uuid, 'ONLINE', 'OFFLINE')
+		if session is not None:
 
 			# get how long they worked
-			msecs = user_session.get_work_time(user_obj.uuid)
-			start_time = user_session.get_session_timestamp(user_obj.uuid)
-			end_time = time.strftime('%Y-%m-%d %H:%M:%S')
-
-			# get the user's goal hours
-			goal_hours = user.determine_goal_hours_today(user_obj.uuid)
+			msecs, start_time, session_id = session
 			worked_hours = '%.2f' % (msecs / 3600000.0)
 
-			# create the session log
-			user_session.create_user_session_log(user_obj.uuid, msecs, start_time, end_time)
-
-			# reset their work time to 0
-			user_session.set_work_time(user_obj.uuid, 0)
-			user_session.set_session_timestamp(user_obj.uuid)
-
 			# send slack message to channel
 			slack_server.send_message(contents=str(user_obj.username) + ' is now offline...', channel='#work-progress', username='Epoch Bot', icon_emoji=':broken_heart:')
 
 			# construct a payload that shows the commit logs
-			handle_logout_payload(user_obj, start_time, end_time, worked_hours, goal_hours)
+			handle_logout_payload(user_obj, session_id, worked_hours, goal_hours)
 			
 			return Response(response=json.dumps(build_logout_response(user_obj)), status=200, mimetype='application/json')
 		else:
-			return Response('In order to use [stop], you must be in ONLINE mode. You are in ' + str(state) + ' mode!'), 200
+			return Response('In order to use [stop], you must be in ONLINE mode. You are in ' + str(user_session.get_state(user_obj.uuid)) + ' mode!'), 200
 	elif command == 'RESUME':
-		if state == 'PAUSED':
-
-			# set the new state
-			user_session.set_state(user_obj.uuid, 'ONLINE')
-			user.log_state_change(user_obj.uuid, 'ONLINE', 'PAUSED')
+		if user_session.transition(user_obj.uuid, 'PAUSED', 'ONLINE') is not None:
 
 			# send slack message to channel
 			slack_server.send_message(contents=str(user_obj.username) + ' is back from their break!', channel='#work-progress', username='Epoch Bot', icon_emoji=':green_heart:')
 			
 			return Response(response=json.dumps(build_resume_response(user_obj)), status=200, mimetype='application/json')
 		else:
-			return Response('In order to use [resume], you must be in PAUSED mode. You are in ' + str(state) + ' mode!'), 200
+			return Response('In order to use [resume], you must be in PAUSED mode. You are in ' + str(user_session.get_state(user_obj.uuid)) + ' mode!'), 200
 	elif command == 'PAUSE':
-		if state == 'ONLINE':
-
-			# set the new state
-			user_session.set_state(user_obj.uuid, 'PAUSED')
-			user.log_state_change(user_obj.uuid, 'PAUSED', 'ONLINE')
+		if user_session.transition(user_obj.uuid, 'ONLINE', 'PAUSED') is not None:
 
 			# send slack message to channel
 			slack_server.send_message(contents=str(user_obj.username) + ' went for a break!', channel='#work-progress', username='Epoch Bot', icon_emoji=':yellow_heart:')
 
 			return Response(response=json.dumps(build_pause_response(user_obj)), status=200, mimetype='application/json')
 		else:
-			return Response('In order to use [pause], you must be in ONLINE mode. You are in ' + str(state) + ' mode!'), 200
+			return Response('In order to use [pause], you must be in ONLINE mode. You are in ' + str(user_session.get_state(user_obj.uuid)) + ' mode!'), 200
 	elif command == 'INFO':
 		return Response(response=json.dumps(build_info_response(user_obj)), status=200, mimetype='application/json')
 	elif command == 'STATUS':
@@ -175,15 +153,18 @@ def build_login_response(user_obj):
 	# Determine the text of the attachment
 	contents['text'] = 'You have started a new Epoch session. You are now ONLINE.'
 
+	# the hours worked and the goal of THIS month, from today's snapshot
+	worked_hours, goal_hours = user_session.get_goal_snapshot(user_obj.uuid)
+
 	# build the hours 
 	fields = []
 	f1 = {}
 	f1['title'] = 'Goal Hours (today)'
-	f1['value'] = user.determine_goal_hours_today(user_obj.uuid)
+	f1['value'] = user.determine_goal_hours_today(user_obj.uuid, (worked_hours, goal_hours))
 	f1['short'] = True
 	f2 = {}
 	f2['title'] = 'Total Hours (month)'
-	f2['value'] = user_session.get_total_worked(user_obj.uuid)
+	f2['value'] = '%.2f' % worked_hours
 	f2['short'] = True
 	fields.append(f1)
 	fields.append(f2)
@@ -217,15 +198,18 @@ def build_logout_response(user_obj):
 	# Determine the text of the attachment
 	contents['text'] = 'You are now logged out of Epoch, changing your state to OFFLINE.'
 
+	# the hours worked and the goal of THIS month, from today's snapshot
+	worked_hours, goal_hours = user_session.get_goal_snapshot(user_obj.uuid)
+
 	# build the hours 
 	fields = []
 	f1 = {}
 	f1['title'] = 'Total Hours (month)'
-	f1['value'] = '%.2f' % (user_session.get_total_worked(user_obj.uuid))
+	f1['value'] = '%.2f' % worked_hours
 	f1['short'] = True
 	f2 = {}
 	f2['title'] = 'Goal Hours (month)'
-	f2['value'] = user.get_goal_total(user_obj.uuid)
+	f2['value'] = goal_hours
 	f2['short'] = True
 	fields.append(f1)
 	fields.append(f2)
@@ -336,21 +320,24 @@ def build_info_response(user_obj):
 		f1['short'] = True
 		f2 = {}
 		f2['title'] = 'Total Hours (month)'
-		f2['value'] = user_session.get_total_worked(user_obj.uuid)
+		f2['value'] = '%.2f' % user_session.get_goal_snapshot(user_obj.uuid)[0]
 		f2['short'] = True
 		fields.append(f1)
 		fields.append(f2)
 		contents['fields'] = fields
 	elif state == 'OFFLINE':
+		# the hours worked and the goal of THIS month, from today's snapshot
+		worked_hours, goal_hours = user_session.get_goal_snapshot(user_obj.uuid)
+
 		# build the hours 
 		fields = []
 		f1 = {}
 		f1['title'] = 'Total Hours (month)'
-		f1['value'] = user_session.get_total_worked(user_obj.uuid)
+		f1['value'] = '%.2f' % worked_hours
 		f1['short'] = True
 		f2 = {}
 		f2['title'] = 'Goal Hours (month)'
-		f2['value'] = user.get_goal_total(user_obj.uuid)
+		f2['value'] = goal_hours
 		f2['short'] = True
 		fields.append(f1)
 		fields.append(f2)
@@ -385,8 +372,8 @@ def build_status_response(user_obj):
 		for uuid, name in all_users:
 			state = user_session.get_state(uuid)
 			last_login = user_session.get_session_timestamp(uuid)
-			total_hours = '%.2f' % user_session.get_total_worked(uuid)
-			goal_hours = user.get_goal_total(uuid)
+			worked_hours, goal_hours = user_session.get_goal_snapshot(uuid)
+			total_hours = '%.2f' % worked_hours
 
 			data = (name, state, last_login, total_hours, goal_hours)
 
@@ -440,21 +427,22 @@ def build_status_response(user_obj):
 	else:
 		return Response('Unexpected error occurred locally when parsing STATE request.'), 200
 
-def handle_logout_payload(user_obj, start_date, end_date, worked_hours, goal_hours):
+def handle_logout_payload(user_obj, session_id, worked_hours, goal_hours):
 	'''
 	Builds the logout payload for the specified user.
 
 	Args:
 		user_obj: The object representation for the specified user
-		start_date: The timestamp for when they logged in
-		end_date: The timestamp for when they logged out
+		session_id: The id of the session the user closed
 		worked_hours: The worked hours for the day
 		goal_hours: The goal hours for the day
 
 	Returns:
 		The Python dictionary that can be converted to JSON and sent as a post.
 	'''
-	commits = repo.get_commit_logs(user_obj.uuid, start_date, end_date)
+	digest = None
+	if session_id is not None:
+		digest = repo.get_session_commit_digest(user_obj.uuid, session_id, DIGEST_COMMITS_PER_REPO, DIGEST_MAX_REPOS)
 
 	# construct an empty message
 	message = slack_api.Message()
@@ -466,16 +454,8 @@ def handle_logout_payload(user_obj, start_date, end_date, worked_hours, goal_hou
 	contents['title_link'] = COMPANY_URL
 
 	# build the text
-	if commits is not None and len(commits) > 0:
-
-		text_builder = ''
-
-		for repo_name, commit_text, commit_url in commits:
-			parts = commit_text.splitlines()
-			m = '`<' + str(commit_url) + '|' + str(repo_name) + '>`: ' + str(parts[0]) + '\n'
-			text_builder = text_builder + m
-
-		contents['text'] = text_builder
+	if digest is not None and len(digest[0]) > 0:
+		contents['text'] = build_commit_digest(digest, DIGEST_MAX_LENGTH)
 
 	# build the hours 
 	fields = []
@@ -504,6 +484,52 @@ def handle_logout_payload(user_obj, start_date, end_date, worked_hours, goal_hou
 	# send it off
 	slack_server.send_json(message_data)
 
+def build_commit_digest(digest, max_length):
+	'''
+	Builds the text listing a session's commits, grouped per repository. Each
+	repository shows its newest commits followed by a count of the rest, and
+	the text never grows past max_length.
+
+	Args:
+		digest: The digest in the form of (repos, other_commits, other_repos), 
+			as returned by repo.get_session_commit_digest
+		max_length: The maximum number of characters of the text
+
+	Returns:
+		The text of the digest.
+	'''
+	repos, other_commits, other_repos = digest
+
+	lines = []
+	length = 0
+
+	for repo_name, commit_count, commits in repos:
+		shown = 0
+
+		for commit_summary, commit_url in commits:
+			m = '`<' + str(commit_url) + '|' + str(repo_name) + '>`: ' + str(commit_summary)
+
+			# leave room for the lines counting what was left out
+			if length + len(m) + 1 > max_length - 200:
+				break
+
+			lines.append(m)
+			length = length + len(m) + 1
+			shown = shown + 1
+
+		if shown == 0:
+			other_commits = other_commits + commit_count
+			other_repos = other_repos + 1
+		elif shown < commit_count:
+			m = '_... and ' + str(commit_count - shown) + ' more in ' + str(repo_name) + '_'
+			lines.append(m)
+			length = length + len(m) + 1
+
+	if other_commits > 0:
+		lines.append('_... and ' + str(other_commits) + ' more commits in ' + str(other_repos) + ' other repositories_')
+
+	return '\n'.join(lines)[:max_length]
+
 def _attach_footer(contents):
 	'''
 	Attach the footer to the Python dictionary contents.
@@ -522,6 +548,6 @@ def _attach_footer(contents):
 		contents['footer_icon'] = ICON_URL
 
 		# attach the timestamp
-		contents['ts'] = int(time.time())
+		contents['ts'] = int(clock.get_clock().time())
 
 	return contents
@@ -5,7 +5,10 @@ from server import slack_handle
 from server import git_handle
 from server import bitbucket_handle
 from server import gitlab_handle
+from component import slack_request
 from settings import settings
+from util import dedup
+from util import json_stream
 
 # python modules
 # We need to import request to access the details of the POST request
@@ -35,6 +38,19 @@ GITHUB_WEBHOOK_OUTGOING = settings.getSettings().github_webhook
 # outgoing webhook key specified by GitLab
 GITLAB_WEBHOOK_OUTGOING = settings.getSettings().gitlab_webhook
 
+# the largest webhook body, in bytes, that we accept
+MAX_PAYLOAD_BYTES = settings.getSettings().max_payload_bytes
+
+# the responses to recent Slack requests, answered again when Slack retries them
+SLACK_REQUESTS = dedup.RequestCache(size=settings.getSettings().slack_dedup_size, ttl=settings.getSettings().slack_dedup_seconds)
+
+# how many seconds a retry waits for the response to the request it repeats
+SLACK_RETRY_WAIT = 2.0
+
+# where the commits live in each VCS payload
+GIT_COMMITS_PATH = ('commits',)
+BITBUCKET_COMMITS_PATH = ('changesets', 'values')
+
 @app.route('/services/slack', methods=['POST'])
 def handle_slack_post():
     '''
@@ -52,7 +68,7 @@ def handle_slack_post():
             token = str(data_form['token'])
 
             if token == SLACK_WEBHOOK_OUTGOING:
-                return slack_handle.parse_request(data_form)
+                return _handle_slack_once(data_form)
             else:
                 return Response('You are not authorized.'), 404
         else:
@@ -60,6 +76,60 @@ def handle_slack_post():
     else:
         return Response('Malformed data request.'), 400
 
+def _handle_slack_once(data_form):
+    '''
+    Handles a Slack request once, however many times Slack delivers it. A
+    request Slack retries, because the first response was slow, gets the
+    first response back instead of being handled again.
+
+    Args:
+        data_form: The data form of the request
+
+    Returns:
+        The response to the request.
+    '''
+    # slack sends the same trigger_id with every delivery of a request
+    request_id = data_form.get('trigger_id')
+
+    if request.headers.get('X-Slack-Retry-Num') is not None:
+        LOG.debug(str(time.ctime(time.time())) + ': Slack retry ' + str(request.headers.get('X-Slack-Retry-Num')) + ' of ' + str(request_id) + ', reason: ' + str(request.headers.get('X-Slack-Retry-Reason')))
+
+    if not request_id:
+        return slack_handle.parse_request(data_form)
+
+    response = SLACK_REQUESTS.handle(str(request_id), lambda: _handle_slack_request(str(request_id), data_form), SLACK_RETRY_WAIT)
+    if response is None:
+        return Response('Still working on your last command...'), 200
+
+    status, mimetype, body = response
+    return Response(response=body, status=status, mimetype=mimetype)
+
+def _handle_slack_request(request_id, data_form):
+    '''
+    Handles a Slack request that this server has not seen, unless another
+    server claimed it in the slack_request table.
+
+    Returns:
+        The response in the form of (status, mimetype, body), or None if another server is still handling it.
+    '''
+    if settings.getSettings().slack_dedup_table and not slack_request.claim_request(request_id):
+        LOG.debug(str(time.ctime(time.time())) + ': Slack request ' + request_id + ' was handled by another server')
+        return slack_request.get_response(request_id)
+
+    try:
+        response = app.make_response(slack_handle.parse_request(data_form))
+    except Exception:
+        if settings.getSettings().slack_dedup_table:
+            slack_request.release_request(request_id)
+        raise
+
+    result = (response.status_code, response.mimetype, response.get_data())
+
+    if settings.getSettings().slack_dedup_table:
+        slack_request.save_response(request_id, result[0], result[1], result[2])
+
+    return result
+
 @app.route('/services/git', methods=['POST'])
 def handle_git_post():
     '''
@@ -70,33 +140,38 @@ def handle_git_post():
     # load the header data
     header_data = request.headers
 
-    # whether or not this is a verified request
-    verified_req = False
-
     # the headers should be of type `werkzeug.datastructures.EnvironHeaders`
-    if header_data.has_key('X-Hub-Signature'): 
-        # payload signature
-        payload_sig = str(header_data.get('X-Hub-Signature'))
+    if not header_data.has_key('X-Hub-Signature'):
+        return Response('Not authorized'), 400
+
+    # payload signature
+    payload_sig = str(header_data.get('X-Hub-Signature'))
+
+    # our signature, computed while the body is spooled
+    hmac_obj = hmac.new(str(GITHUB_WEBHOOK_OUTGOING), digestmod=hashlib.sha1)
 
-        # our signature
-        hmac_obj = hmac.new(str(GITHUB_WEBHOOK_OUTGOING), request.data, hashlib.sha1)
+    try:
+        payload = _stream_payload(GIT_COMMITS_PATH, hmac_obj)
+    except json_stream.PayloadTooLarge as e:
+        LOG.debug(str(time.ctime(time.time())) + ': Rejected payload from Github: %s' % e)
+        return Response('Payload too large.'), 413
+
+    try:
         signature = 'sha1=' + hmac_obj.hexdigest()
-        
+
         # because we run python 2.6, this is insecure
         verified_req = payload_sig == signature
 
-    if not verified_req:
-        return Response('Not authorized'), 400
+        if not verified_req:
+            return Response('Not authorized'), 400
 
-    # git sends payload in the data section
-    data = request.data
-    if data is not None:
-        json_data = json.loads(data)
-        return git_handle.parse_request(json_data)
-    else:
+        # git sends payload in the data section
+        return git_handle.parse_request(payload.skeleton(), payload)
+    except ValueError as e:
+        LOG.debug(str(time.ctime(time.time())) + ': Malformed payload from Github: %s' % e)
         return Response('Malformed data request.'), 400
-
-    return Response('Okay.'), 200
+    finally:
+        payload.close()
 
 @app.route('/services/bitbucket', methods=['POST'])
 def handle_bitbucket_post():
@@ -105,18 +180,21 @@ def handle_bitbucket_post():
     '''
     # TODO add access log
 
-    # grab the data
-    data = request.data
-    LOG.debug(str(time.ctime(time.time())) + ': Payload from Bitbucket: %s' % data)
-
-    if data is not None:
-        json_data = json.loads(data)
-        return bitbucket_handle.parse_request(json_data)
-    else:
-        return Response('Malformed data request.'), 400
+    try:
+        payload = _stream_payload(BITBUCKET_COMMITS_PATH)
+    except json_stream.PayloadTooLarge as e:
+        LOG.debug(str(time.ctime(time.time())) + ': Rejected payload from Bitbucket: %s' % e)
+        return Response('Payload too large.'), 413
 
+    LOG.debug(str(time.ctime(time.time())) + ': Payload from Bitbucket of %s bytes' % request.content_length)
 
-    return Response('Okay.'), 200
+    try:
+        return bitbucket_handle.parse_request(payload.skeleton(), payload)
+    except ValueError as e:
+        LOG.debug(str(time.ctime(time.time())) + ': Malformed payload from Bitbucket: %s' % e)
+        return Response('Malformed data request.'), 400
+    finally:
+        payload.close()
 
 @app.route('/services/gitlab', methods=['POST'])
 def handle_gitlab_post():
@@ -143,16 +221,38 @@ def handle_gitlab_post():
     if not verified_req:
         return Response('Not authorized'), 400
 
+    try:
+        payload = _stream_payload(GIT_COMMITS_PATH)
+    except json_stream.PayloadTooLarge as e:
+        LOG.debug(str(time.ctime(time.time())) + ': Rejected payload from GitLab: %s' % e)
+        return Response('Payload too large.'), 413
+
     # gitlab sends payload in the data section
-    data = request.data
-    if data is not None:
-        json_data = json.loads(data)
-        return gitlab_handle.parse_request(json_data)
-    else:
+    try:
+        return gitlab_handle.parse_request(payload.skeleton(), payload)
+    except ValueError as e:
+        LOG.debug(str(time.ctime(time.time())) + ': Malformed payload from GitLab: %s' % e)
         return Response('Malformed data request.'), 400
+    finally:
+        payload.close()
+
+def _stream_payload(path, digest=None):
+    '''
+    Spools the body of the current request to a temporary file, enforcing the
+    maximum payload size, and opens a stream over the commits in it.
 
+    Args:
+        path: The keys leading to the commits array in the payload
+        digest: An optional hash/hmac object to update with the body
 
-    return Response('Okay.'), 200
+    Returns:
+        A json_stream.ArrayStream over the commits of the payload.
+
+    Raises:
+        json_stream.PayloadTooLarge: If the body exceeds MAX_PAYLOAD_BYTES.
+    '''
+    body = json_stream.spool_body(request.stream, MAX_PAYLOAD_BYTES, request.content_length, digest)
+    return json_stream.ArrayStream(body, path)
 
 if __name__ == "__main__":
     app.run(host=settings.getSettings().flask_ip, debug = True, port=settings.getSettings().flask_port)
\ No newline at end of file
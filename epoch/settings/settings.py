@@ -9,7 +9,7 @@ import socket
 import MySQLdb
 
 class Settings(object):
-    def __init__(self, host_ip, db_host, db_user, db_pass, db_name, company_name, company_url, company_icon, flask_ip, flask_port, slack_api_token, slack_api_url, slack_webhook, github_webhook, gitlab_webhook):
+    def __init__(self, host_ip, db_host, db_user, db_pass, db_name, company_name, company_url, company_icon, flask_ip, flask_port, slack_api_token, slack_api_url, slack_webhook, github_webhook, gitlab_webhook, max_payload_bytes=26214400, payload_batch_size=500, slack_rate_limit=4.0, archive_directory='archive', payroll_daily_overtime=8.0, payroll_weekly_overtime=40.0, scheduler_workers=2, scheduler_jobs=None, state_retention_days=0, pulse_partitions=1, slack_dedup_seconds=300, slack_dedup_size=10000, slack_dedup_table=False):
         self.host_ip = host_ip
 
         # MySQL creds
@@ -32,12 +32,38 @@ class Settings(object):
         # slack api post settings
         self.slack_api_token = slack_api_token
         self.slack_api_url = slack_api_url
+        self.slack_rate_limit = float(slack_rate_limit)
+
+        # how long, and how many, responses are kept for the requests Slack retries
+        self.slack_dedup_seconds = int(slack_dedup_seconds)
+        self.slack_dedup_size = int(slack_dedup_size)
+        # True to also share them between servers in the slack_request table
+        self.slack_dedup_table = bool(slack_dedup_table)
 
         # external webhooks
         self.slack_webhook = slack_webhook
         self.github_webhook = github_webhook
         self.gitlab_webhook = gitlab_webhook
 
+        # webhook payload limits
+        self.max_payload_bytes = int(max_payload_bytes)
+        self.payload_batch_size = int(payload_batch_size)
+
+        # historical analytics
+        self.archive_directory = str(archive_directory)
+
+        # payroll overtime thresholds, in hours
+        self.payroll_daily_overtime = float(payroll_daily_overtime)
+        self.payroll_weekly_overtime = float(payroll_weekly_overtime)
+
+        # pulse maintenance jobs
+        self.scheduler_workers = int(scheduler_workers)
+        self.scheduler_jobs = dict(scheduler_jobs or {})
+        self.state_retention_days = int(state_retention_days)
+
+        # how many partitions the users are split into across running Pulses
+        self.pulse_partitions = int(pulse_partitions)
+
     def __str__(self):
         return 'host_ip: ' + str(self.host_ip) + ', db_host: ' + str(self.db_host) + ', db_user: ' + str(self.db_user) + ', db_pass: ' + str(self.db_pass) + ', db_name: ' + str(self.db_name)
 
@@ -56,12 +82,26 @@ json_data=open('./settings/settings.txt').read()
 data = json.loads(json_data)
 s = data
 
+def _get_setting(section, key, default):
+    '''
+    Reads an optional setting, so older settings files keep working.
+
+    Args:
+        section: The section of the settings file
+        key: The key inside that section
+        default: The value to use if the setting is missing
+
+    Returns:
+        The configured value, or the default.
+    '''
+    return s.get(section, {}).get(key, default)
+
 # ip of this machine
 #host_ip = socket.gethostbyname(socket.getfqdn())
 host_ip = socket.getfqdn()
 
 # construct settings object
-settings = Settings(host_ip=host_ip, db_host=s['database_creds']['host'], db_user=s['database_creds']['user'], db_pass=s['database_creds']['pass'], db_name=s['database_creds']['database'], company_name=s['general_settings']['company_name'], company_url=s['general_settings']['company_url'], company_icon=s['general_settings']['company_icon_url'], flask_ip=s['flask_settings']['host_ip'], flask_port=s['flask_settings']['port'], slack_api_token=s['slack_settings']['api_token'], slack_api_url=s['slack_settings']['api_url'], slack_webhook=s['slack_settings']['webhook_outgoing'], github_webhook=s['github_settings']['webhook_outgoing'], gitlab_webhook=s['gitlab_settings']['webhook_outgoing'])
+settings = Settings(host_ip=host_ip, db_host=s['database_creds']['host'], db_user=s['database_creds']['user'], db_pass=s['database_creds']['pass'], db_name=s['database_creds']['database'], company_name=s['general_settings']['company_name'], company_url=s['general_settings']['company_url'], company_icon=s['general_settings']['company_icon_url'], flask_ip=s['flask_settings']['host_ip'], flask_port=s['flask_settings']['port'], slack_api_token=s['slack_settings']['api_token'], slack_api_url=s['slack_settings']['api_url'], slack_webhook=s['slack_settings']['webhook_outgoing'], github_webhook=s['github_settings']['webhook_outgoing'], gitlab_webhook=s['gitlab_settings']['webhook_outgoing'], max_payload_bytes=_get_setting('payload_settings', 'max_bytes', 26214400), payload_batch_size=_get_setting('payload_settings', 'batch_size', 500), slack_rate_limit=_get_setting('slack_settings', 'messages_per_second', 4.0), archive_directory=_get_setting('archive_settings', 'directory', 'archive'), payroll_daily_overtime=_get_setting('payroll_settings', 'daily_overtime_hours', 8.0), payroll_weekly_overtime=_get_setting('payroll_settings', 'weekly_overtime_hours', 40.0), scheduler_workers=_get_setting('scheduler_settings', 'workers', 2), scheduler_jobs=_get_setting('scheduler_settings', 'jobs', {}), state_retention_days=_get_setting('scheduler_settings', 'state_retention_days', 0), pulse_partitions=_get_setting('pulse_settings', 'partitions', 1), slack_dedup_seconds=_get_setting('slack_settings', 'dedup_seconds', 300), slack_dedup_size=_get_setting('slack_settings', 'dedup_size', 10000), slack_dedup_table=_get_setting('slack_settings', 'dedup_table', False))
 
 # configure a Slack server in order to send messages TO Slack
 slack_api_url = settings.slack_api_url
@@ -100,4 +140,38 @@ def getDatabase():
             return getSettings().db_cxn
         except Exception as e:
             print(e)
-            print ('Unable to reopen connection.')
\ No newline at end of file
+            print ('Unable to reopen connection.')
+
+def newDatabase():
+    '''
+    Returns:
+        A new database connection, for work that can not share the connection
+        of getDatabase(), such as other processes or concurrent result sets.
+    '''
+    return MySQLdb.connect(host=getSettings().db_host, user=getSettings().db_user, passwd=getSettings().db_pass, db=getSettings().db_name)
+
+def reloadSettings():
+    '''
+    Re-reads the settings file, updating the settings that can change while
+    running. The database, Slack and flask settings keep their values until
+    restarted.
+
+    Returns:
+        The construct settings object.
+    '''
+    global s
+
+    s = json.loads(open('./settings/settings.txt').read())
+
+    settings.slack_rate_limit = float(_get_setting('slack_settings', 'messages_per_second', 4.0))
+    settings.max_payload_bytes = int(_get_setting('payload_settings', 'max_bytes', 26214400))
+    settings.payload_batch_size = int(_get_setting('payload_settings', 'batch_size', 500))
+    settings.archive_directory = str(_get_setting('archive_settings', 'directory', 'archive'))
+    settings.payroll_daily_overtime = float(_get_setting('payroll_settings', 'daily_overtime_hours', 8.0))
+    settings.payroll_weekly_overtime = float(_get_setting('payroll_settings', 'weekly_overtime_hours', 40.0))
+    settings.scheduler_workers = int(_get_setting('scheduler_settings', 'workers', 2))
+    settings.scheduler_jobs = dict(_get_setting('scheduler_settings', 'jobs', {}) or {})
+    settings.state_retention_days = int(_get_setting('scheduler_settings', 'state_retention_days', 0))
+    settings.pulse_partitions = int(_get_setting('pulse_settings', 'partitions', 1))
+
+    return settings
@@ -6,11 +6,15 @@ from component import user_session
 from component import repo
 from settings import settings
 from util import slack_api
+from analytics import intervals
 
 # python modules
 import sys
 import datetime
 import time
+import csv
+import json
+import optparse
 
 # the icon's url used in the bot that sends the response
 ICON_URL = settings.getSettings().company_icon
@@ -20,6 +24,21 @@ slack_api_url = settings.getSettings().slack_api_url
 slack_headers = {'content-type': 'application/json'}
 slack_server = slack_api.SlackAPI(api_url=slack_api_url, headers=slack_headers)
 
+# the actions a bulk file may contain
+BULK_ACTIONS = ['add', 'modify', 'remove', 'verify']
+
+# how many bulk operations are applied per transaction
+BULK_CHUNK_SIZE = 100
+
+# how many session logs are shown per page
+SESSION_PAGE_SIZE = 25
+
+# the columns of each kind of export
+EXPORT_COLUMNS = {
+	'sessions': ['log_id', 'user_id', 'username', 'team', 'work_time', 'hours', 'start', 'end', 'approved'],
+	'commits': ['commit_id', 'user_id', 'username', 'team', 'repository', 'session_id', 'message', 'url', 'creation'],
+}
+
 def handle_help_command():
 	'''
 	Handles the parsing of the help command.
@@ -37,10 +56,24 @@ def handle_help_command():
 	print('- List the status of all users\n')
 	print('python track.py session')
 	print('- List session log/timestamps for a user.\n')
-	print('python track.py verify')
-	print('- Verify and sign timestamps for a user.\n')
-	print('python track.py report')
-	print('- Generate session reports for a user, and send it to them!\n')
+	print('python track.py verify [--all | --team id] [--signer name] [--start YYYY-MM-DD] [--end YYYY-MM-DD]')
+	print('- Verify and sign timestamps for a user, or everyone at once.\n')
+	print('python track.py report [--all | --team id] [--start YYYY-MM-DD] [--end YYYY-MM-DD] [--send]')
+	print('- Generate session reports for a user, or everyone, and send it to them!\n')
+	print('python track.py bulk <file> [--signer name] [--dry-run] [--allow-overlaps]')
+	print('- Apply a CSV or JSON lines file of add/modify/remove/verify operations.\n')
+	print('python track.py export --start YYYY-MM-DD --end YYYY-MM-DD [--type sessions|commits] [--format csv|jsonl] [--output file]')
+	print('- Stream session or commit logs to a file, filtered by --user, --team and --approved yes|no.\n')
+	print('python track.py archive snapshot [YYYY-MM] | list | report --from YYYY-MM --to YYYY-MM [--by user|team|month|week|day] | benchmark [--rows n] [--start YYYY-MM-DD --end YYYY-MM-DD]')
+	print('- Snapshot closed months into the columnar archive, and report on them without MySQL.\n')
+	print('python track.py payroll --start YYYY-MM-DD --end YYYY-MM-DD [--team id] [--buckets day|week] [--output file]')
+	print('- Compute verified hours, goal differences and overtime of everyone at once, as CSV.\n')
+	print('python track.py reconstruct --start YYYY-MM-DD --end YYYY-MM-DD [--workers n] [--tolerance minutes] [--format csv|jsonl] [--output file]')
+	print('- Rebuild sessions from state changes and list where they disagree with the session logs.\n')
+	print('python track.py audit --start YYYY-MM-DD --end YYYY-MM-DD [--user name] [--team id] [--format csv|jsonl] [--output file]')
+	print('- List session logs that overlap or duplicate each other, and would count hours twice.\n')
+	print('python track.py simulate [--users n] [--month YYYY-MM] [--days n] [--seed n] [--partitions n] [--restarts n]')
+	print('- Replay a month of activity through Pulse on a simulated clock, as a benchmark and regression check.\n')
 
 def handle_list_command():
 	'''
@@ -261,29 +294,68 @@ def handle_session_command():
 	start_date = datetime.datetime(s_year, s_month, s_day, 0, 0, 0).strftime('%Y-%m-%d %H:%M:%S')
 	end_date = datetime.datetime(e_year, e_month, e_day, 0, 0, 0).strftime('%Y-%m-%d %H:%M:%S')
 
-	# get all their session logs
-	session_info = user_session.get_session_logs(user_data[0], start_date, end_date)
+	# page through their session logs, newest first
+	cursor = None
+	shown = 0
 
-	if session_info is not None and len(session_info) > 0:
+	while True:
+		session_info, cursor = user_session.get_session_logs_page(user_data[0], start_date, end_date, cursor, SESSION_PAGE_SIZE)
+
+		if session_info is None or len(session_info) == 0:
+			break
+
+		if shown == 0:
+			print('\nDisplaying session info for ' + str(req_name) + ' between ' + str(start_date) + ' and ' + str(end_date) + ': \n')
+
+		# the number of commits attributed to each session log
+		commit_counts = repo.get_session_commit_counts(user_data[0], [log[0] for log in session_info])
 
-		print('\nDisplaying session info for ' + str(req_name) + ' between ' + str(start_date) + ' and ' + str(end_date) + ': \n')
-		
 		# iterate and print
 		for log_id, user_id, work_time, start, end, approved in session_info:
 			hours = '%.2f' % (work_time / 3600000.0)
+			commits = commit_counts.get(log_id, 0)
 
 			if approved == 'None':
 				approved = False
 
-			print('Log ID #' + str(log_id) + ' shows ' + str(hours) + ' hours of work starting on ' + str(start) + '. [Approved=' + str(approved) + ']')
-	else:
+			print('Log ID #' + str(log_id) + ' shows ' + str(hours) + ' hours of work starting on ' + str(start) + ' with ' + str(commits) + ' commits. [Approved=' + str(approved) + ']')
+
+		shown = shown + len(session_info)
+
+		if cursor is None:
+			break
+
+		more = raw_input('\nShowing ' + str(shown) + ' logs. Press enter for more, or q to quit: ')
+		if more is not None and more.lower() in ['q', 'quit']:
+			break
+
+	if shown == 0:
 		print('No found session information for ' + str(req_name) + ' in the time period of ' + str(start_date) + ' and ' + str(end_date))
 
-def handle_report_command():
+def handle_report_command(args=None):
 	'''
 	Handles the parsing of the report command. This allows the user to print
 	session information about a user and get detailed information about them.
+
+	With --all or --team, reports on every user (of the team) at once.
+
+	Args:
+		args: The command line arguments that follow the command
 	'''
+	if args is None:
+		args = []
+
+	parser = optparse.OptionParser(usage='python track.py report [--all | --team id] [--start YYYY-MM-DD] [--end YYYY-MM-DD] [--send]')
+	parser.add_option('--all', dest='all', action='store_true', default=False, help='report on every user')
+	parser.add_option('--team', dest='team', type='int', help='report on every user of the team')
+	parser.add_option('--start', dest='start', help='the starting date of the report')
+	parser.add_option('--end', dest='end', help='the ending date of the report')
+	parser.add_option('--send', dest='send', action='store_true', default=False, help='send the reports without asking')
+	options, rest = parser.parse_args(args)
+
+	if options.all or options.team is not None:
+		return _handle_team_report(options)
+
 	req_name = raw_input('Name of the user to generate the report for (Ex: stephen)?: ')
 	if req_name is None:
 		print('You must provide the name of the user!')
@@ -369,7 +441,76 @@ def handle_report_command():
 	else:
 		print('No found session information for ' + str(req_name) + ' in the time period of ' + str(start_date) + ' and ' + str(end_date))
 
+def _handle_team_report(options):
+	'''
+	Reports on every user, or every user of a team, with one grouped query and
+	sends the reports to Slack concurrently.
+
+	Args:
+		options: The parsed options of the report command
+	'''
+	date_range = _get_date_range(options.start, options.end, 'report on')
+	if date_range is None:
+		return None
+
+	start_date, end_date = date_range
+
+	# verified and not verified totals for everyone at once
+	totals = user_session.get_session_totals(start_date, end_date, options.team)
+
+	print('\nTeam report between ' + str(start_date) + ' and ' + str(end_date) + ': \n')
+
+	reports = []
+	for uuid, name, team_id, goal_hours, verified_time, verified_count, not_verified_time, not_verified_count in totals:
+		if verified_count + not_verified_count == 0:
+			print('[' + str(name) + '] No found session information.')
+			continue
+
+		verified_hours = '%.2f' % (verified_time / 3600000.0)
+		not_verified_hours = '%.2f' % (not_verified_time / 3600000.0)
+		failed_by_hours = goal_hours - float(verified_hours)
+
+		if failed_by_hours <= 0:
+			goal_text = 'reached their monthly goal of ' + str(goal_hours) + ' hours!'
+		else:
+			goal_text = 'was ' + str(failed_by_hours) + ' hours short of their goal of ' + str(goal_hours) + ' hours!'
+
+		print('[' + str(name) + '] ' + str(verified_hours) + ' hours VERIFIED (' + str(verified_count) + ' transactions), ' + str(not_verified_hours) + ' hours NOT VERIFIED (' + str(not_verified_count) + ' transactions), and ' + goal_text)
+
+		reports.append(build_user_report((uuid, name), start_date, end_date, verified_hours, not_verified_hours, goal_hours))
+
+	if len(reports) == 0:
+		print('\nNo reports to send.')
+		return None
+
+	send_reports = options.send
+	if not send_reports:
+		answer = raw_input('\nWould you like me to send these ' + str(len(reports)) + ' reports to the users [Yes/No]?: ')
+		send_reports = answer is not None and (answer.lower() == 'yes' or answer.lower() == 'y')
+
+	if send_reports:
+		sender = slack_api.BulkSender(slack_server, rate=settings.getSettings().slack_rate_limit)
+		sent = sender.send_all(reports)
+		print('Sent ' + str(sent) + ' of ' + str(len(reports)) + ' reports.')
+
 def send_user_report(user_obj, start_date, end_date, verified_hours, not_verified_hours, goal_hours):
+	'''
+	Builds the user report for the specified user, and sends it to them.
+
+	Args:
+		user_obj: The object representation for the specified user
+		start_date: The starting part of the interval
+		end_date: The ending part of the interval
+		verified_hours: Number of hours that were verified 
+		not_verified_hours: Number of hours that weren't verified
+		goal_hours: The goal hours for the user 
+	'''
+	message_data = build_user_report(user_obj, start_date, end_date, verified_hours, not_verified_hours, goal_hours)
+
+	# send it off
+	slack_server.send_json(message_data)
+
+def build_user_report(user_obj, start_date, end_date, verified_hours, not_verified_hours, goal_hours):
 	'''
 	Builds the user report for the specified user.
 
@@ -436,14 +577,33 @@ def send_user_report(user_obj, start_date, end_date, verified_hours, not_verifie
 	message_data['username'] = 'Epoch Bot'
 	message_data['icon_emoji'] = ':bar_chart:'
 
-	# send it off
-	slack_server.send_json(message_data)
+	return message_data
 
-def handle_verify_command():
+def handle_verify_command(args=None):
 	'''
 	Handles the parsing of the verify command. This allows the user
 	to sign session timestamps.
+
+	With --all or --team, signs every unapproved timestamp of everyone (of the
+	team) in the date range at once.
+
+	Args:
+		args: The command line arguments that follow the command
 	'''
+	if args is None:
+		args = []
+
+	parser = optparse.OptionParser(usage='python track.py verify [--all | --team id] [--signer name] [--start YYYY-MM-DD] [--end YYYY-MM-DD]')
+	parser.add_option('--all', dest='all', action='store_true', default=False, help='verify the timestamps of every user')
+	parser.add_option('--team', dest='team', type='int', help='verify the timestamps of every user of the team')
+	parser.add_option('--signer', dest='signer', help='your Slack username, used to sign the timestamps')
+	parser.add_option('--start', dest='start', help='the starting date to verify for')
+	parser.add_option('--end', dest='end', help='the ending date to verify for')
+	options, rest = parser.parse_args(args)
+
+	if options.all or options.team is not None:
+		return _handle_team_verify(options)
+
 	verify_username = raw_input('What is your Slack username (Ex: stephen)?: ')
 	if verify_username is None:
 		print('You must provide your name to sign session timestamps!')
@@ -520,6 +680,36 @@ def handle_verify_command():
 	else:
 		print('No found session information for ' + str(req_name) + ' in the time period of ' + str(start_date) + ' and ' + str(end_date))
 
+def _handle_team_verify(options):
+	'''
+	Signs every unapproved timestamp of everyone, or of a team, within a date
+	range with one statement.
+
+	Args:
+		options: The parsed options of the verify command
+	'''
+	verify_username = options.signer
+	if verify_username is None:
+		verify_username = raw_input('What is your Slack username (Ex: stephen)?: ')
+
+	verify_data = user.get_user(verify_username)
+	if verify_data is None:
+		print('Unable to find your name ' + str(verify_username) + '.')
+		return None
+
+	date_range = _get_date_range(options.start, options.end, 'verify for')
+	if date_range is None:
+		return None
+
+	start_date, end_date = date_range
+
+	count = user_session.verify_unapproved_session_logs(verify_data[0], start_date, end_date, team=options.team)
+
+	if options.team is not None:
+		print('Signed ' + str(count) + ' timestamps of team #' + str(options.team) + ' between ' + str(start_date) + ' and ' + str(end_date) + '.')
+	else:
+		print('Signed ' + str(count) + ' timestamps between ' + str(start_date) + ' and ' + str(end_date) + '.')
+
 def _handle_verify_session(verify_uuid, not_verified):
 	'''
 	Handles the verifying of the session information. Prompts the user with 
@@ -530,6 +720,9 @@ def _handle_verify_session(verify_uuid, not_verified):
 		not_verified: The list of IDs that are not verified
 	'''
 
+	# the transactions that can still be signed
+	not_verified_ids = set(not_verified)
+
 	print('\nYou can now enter the ID of the transactions you want to sign!')
 	print('You can choose multiple at once. Ex: 1,2,3,4')
 
@@ -541,39 +734,764 @@ def _handle_verify_session(verify_uuid, not_verified):
 			return None
 
 		if type(trans) is str and trans.lower() in ['all']:
-			# make a copy of not verified transactions
-			copy_verified = not_verified[:]
-			for not_ver_req in copy_verified:
-				_verify_session(verify_uuid, not_verified, not_ver_req)
+			requested = set(not_verified_ids)
 		else:
-			parts = trans.split(',')
-			if len(parts) > 0:
-				for p in parts:
-					_verify_session(verify_uuid, not_verified, p)
+			requested = set()
+			for p in trans.split(','):
+				try:
+					requested.add(int(p))
+				except ValueError:
+					print('Unknown transaction #' + str(p).strip() + '!')
+
+		# sign every known transaction in one statement
+		signing = requested & not_verified_ids
+		for unknown in sorted(requested - not_verified_ids):
+			print('Unknown transaction #' + str(unknown) + '!')
+
+		if len(signing) > 0:
+			try:
+				count = user_session.verify_session_logs(list(signing), verify_uuid)
+				not_verified_ids = not_verified_ids - signing
+				print('Signed ' + str(count) + ' transactions: #' + ', #'.join([str(t) for t in sorted(signing)]) + '!')
+			except Exception as e:
+				print(e)
+				print('Unable to verify transactions ' + ', '.join([str(t) for t in sorted(signing)]) + '.')
+
+def handle_bulk_command(args):
+	'''
+	Handles the parsing of the bulk command. This applies a CSV or JSON lines
+	file of session log operations without prompting for each one.
+
+	Each operation has an `action` (add, modify, remove or verify), a 
+	`username`, a `date` (YYYY-MM-DD) and, for add and modify, the `hours`.
+
+	Args:
+		args: The command line arguments that follow the command
+	'''
+	parser = optparse.OptionParser(usage='python track.py bulk <file> [--signer name] [--dry-run] [--allow-overlaps]')
+	parser.add_option('--signer', dest='signer', help='your Slack username, used to sign the session logs')
+	parser.add_option('--dry-run', dest='dry_run', action='store_true', default=False, help='validate the file without applying it')
+	parser.add_option('--allow-overlaps', dest='allow_overlaps', action='store_true', default=False, help='add session logs even on days the user already has one')
+	options, rest = parser.parse_args(args)
+
+	if len(rest) != 1:
+		parser.print_help()
+		return None
+
+	file_name = rest[0]
+
+	verify_username = options.signer
+	if verify_username is None:
+		verify_username = raw_input('What is your Slack username (Ex: stephen)?: ')
+
+	try:
+		rows = _read_bulk_file(file_name)
+	except (IOError, ValueError) as e:
+		print(e)
+		print('Unable to read ' + str(file_name) + '. Are you sure it is a CSV or JSON lines file?')
+		return None
+
+	# validate everything before touching the database
+	operations, errors = _validate_bulk_rows(rows)
+
+	# resolve every username with one query
+	usernames = set([str(verify_username)])
+	for line, action, username, date, work_time in operations:
+		usernames.add(username)
+	uuids = user.get_user_uuids(list(usernames))
+
+	if verify_username not in uuids:
+		errors.append('Unable to find your name ' + str(verify_username) + '.')
+
+	for line, action, username, date, work_time in operations:
+		if username not in uuids:
+			errors.append('Line ' + str(line) + ': unable to find ' + str(username) + '. Are you sure they exist?')
+
+	# added hours would be counted twice on days that already have a session log
+	if len(errors) == 0 and not options.allow_overlaps:
+		errors.extend(_check_bulk_overlaps(operations, uuids))
+
+	if len(errors) > 0:
+		for error in errors:
+			print(error)
+		print('\n' + str(len(errors)) + ' problems found in ' + str(file_name) + '. No changes were applied.')
+		return None
+
+	if options.dry_run:
+		print(str(len(operations)) + ' operations in ' + str(file_name) + ' are valid. No changes were applied.')
+		return None
+
+	verify_uuid = uuids[verify_username]
+
+	# apply the operations in chunked transactions
+	applied = {}
+	affected = {}
+	failed = []
+	for action in BULK_ACTIONS:
+		applied[action] = 0
+		affected[action] = 0
+
+	for index in range(0, len(operations), BULK_CHUNK_SIZE):
+		chunk = operations[index:index + BULK_CHUNK_SIZE]
+		changes = [(action, uuids[username], date, work_time) for line, action, username, date, work_time in chunk]
+
+		try:
+			counts = user_session.apply_session_log_operations(changes, verify_uuid)
+		except Exception as e:
+			print(e)
+			print('Unable to apply lines ' + str(chunk[0][0]) + ' to ' + str(chunk[-1][0]) + '. They were rolled back.')
+			failed.extend(chunk)
+			continue
+
+		for op, count in zip(chunk, counts):
+			applied[op[1]] = applied[op[1]] + 1
+			affected[op[1]] = affected[op[1]] + count
+
+	print('\nBulk summary for ' + str(file_name) + ':\n')
+	for action in BULK_ACTIONS:
+		print(str(action) + ': ' + str(applied[action]) + ' operations applied, affecting ' + str(affected[action]) + ' session logs.')
+
+	if len(failed) > 0:
+		print(str(len(failed)) + ' operations failed and were not applied.')
+	else:
+		print('All ' + str(len(operations)) + ' operations were applied.')
+
+def _read_bulk_file(file_name):
+	'''
+	Reads the operations of a bulk file. Files ending in .csv are read as CSV
+	with a header row, anything else as one JSON object per line.
+
+	Args:
+		file_name: The path to the bulk file
+
+	Returns:
+		A list in the form of (line, row), where row is a dictionary.
+	'''
+	rows = []
+
+	f = open(file_name, 'r')
+	try:
+		if file_name.lower().endswith('.csv'):
+			reader = csv.DictReader(f)
+			for row in reader:
+				rows.append((reader.line_num, row))
+		else:
+			line = 0
+			for text in f:
+				line = line + 1
+				if text.strip() == '':
+					continue
+
+				row = json.loads(text)
+				if type(row) is not dict:
+					raise ValueError('Line ' + str(line) + ' is not a JSON object.')
+				rows.append((line, row))
+	finally:
+		f.close()
+
+	return rows
+
+def _validate_bulk_rows(rows):
+	'''
+	Validates the rows of a bulk file.
+
+	Args:
+		rows: A list in the form of (line, row), as read by _read_bulk_file
+
+	Returns:
+		A tuple in the form of (operations, errors), where operations is a list in
+		the form of (line, action, username, date, work_time) and errors is a
+		list of messages for the rows that are not valid.
+	'''
+	operations = []
+	errors = []
+
+	for line, row in rows:
+		action = str(row.get('action') or '').strip().lower()
+		username = str(row.get('username') or '').strip()
+		date = str(row.get('date') or '').strip()
+		hours = row.get('hours')
+
+		if action not in BULK_ACTIONS:
+			errors.append('Line ' + str(line) + ': unknown action \'' + str(action) + '\', expected one of ' + ', '.join(BULK_ACTIONS) + '.')
+			continue
+
+		if username == '':
+			errors.append('Line ' + str(line) + ': you must provide the name of the user!')
+			continue
+
+		# attempt to format their input
+		try:
+			d_year, d_month, d_day = _format_date(date)
+			date = datetime.date(d_year, d_month, d_day).strftime('%Y-%m-%d')
+		except Exception:
+			errors.append('Line ' + str(line) + ': unable to convert date \'' + str(date) + '\', such as 2016-11-16.')
+			continue
+
+		work_time = None
+		if action in ['add', 'modify']:
+			try:
+				work_time = int(float(hours) * 3600000)
+				if work_time < 0:
+					raise ValueError('negative hours')
+			except Exception:
+				errors.append('Line ' + str(line) + ': unable to convert hours \'' + str(hours) + '\', such as 2.5.')
+				continue
+
+		operations.append((line, action, username, date, work_time))
+
+	return (operations, errors)
+
+def _check_bulk_overlaps(operations, uuids):
+	'''
+	Checks that the session logs a bulk file adds do not overlap existing
+	session logs, or each other.
+
+	Args:
+		operations: The valid operations, from _validate_bulk_rows
+		uuids: A dictionary of username to uuid
+
+	Returns:
+		A list of messages for the operations that overlap.
+	'''
+	adds = [op for op in operations if op[1] == 'add']
+	if len(adds) == 0:
+		return []
+
+	dates = [datetime.datetime.strptime(date, '%Y-%m-%d') for line, action, username, date, work_time in adds]
+	start_date = min(dates).strftime('%Y-%m-%d %H:%M:%S')
+	end_date = (max(dates) + datetime.timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+
+	# the existing session logs of the users, with one query
+	added_uuids = set([uuids[op[2]] for op in adds])
+	existing = {}
+	for log_id, user_id, username, team_id, work_time, start, end, approved in user_session.iter_session_logs(start_date, end_date):
+		if user_id in added_uuids:
+			interval_start, interval_end = intervals.log_interval(start, end)
+			existing.setdefault(user_id, []).append((interval_start, interval_end, 'session log #' + str(log_id)))
+
+	indexes = {}
+	for uuid in existing:
+		indexes[uuid] = intervals.IntervalIndex(existing[uuid])
+
+	errors = []
+	added = {}
+	for (line, action, username, date, work_time), day in zip(adds, dates):
+		uuid = uuids[username]
+		interval_start, interval_end = intervals.log_interval(day, day)
+
+		found = []
+		if uuid in indexes:
+			found = indexes[uuid].overlapping(interval_start, interval_end)
+
+		# lines of the file adding the same day twice
+		found = found + [a for a in added.get(uuid, []) if a[0] < interval_end and a[1] > interval_start]
+		if len(found) > 0:
+			errors.append('Line ' + str(line) + ': ' + str(username) + ' already has hours on ' + str(date) + ' (' + ', '.join([f[2] for f in found]) + '). Use --allow-overlaps to add them anyway.')
+
+		added.setdefault(uuid, []).append((interval_start, interval_end, 'line ' + str(line)))
+
+	return errors
+
+def handle_export_command(args=None):
+	'''
+	Handles the parsing of the export command. This streams session or commit
+	logs to a CSV or JSON lines file, or stdout, in constant memory.
+
+	Args:
+		args: The command line arguments that follow the command
+	'''
+	if args is None:
+		args = []
+
+	parser = optparse.OptionParser(usage='python track.py export --start YYYY-MM-DD --end YYYY-MM-DD [options]')
+	parser.add_option('--type', dest='type', default='sessions', choices=['sessions', 'commits'], help='what to export, sessions or commits [sessions]')
+	parser.add_option('--format', dest='format', default='csv', choices=['csv', 'jsonl'], help='the output format, csv or jsonl [csv]')
+	parser.add_option('--output', dest='output', help='the file to write to [stdout]')
+	parser.add_option('--start', dest='start', help='the starting date to export')
+	parser.add_option('--end', dest='end', help='the ending date to export')
+	parser.add_option('--user', dest='user', help='only export this user')
+	parser.add_option('--team', dest='team', type='int', help='only export this team')
+	parser.add_option('--approved', dest='approved', choices=['yes', 'no'], help='only export approved (yes) or unapproved (no) sessions')
+	options, rest = parser.parse_args(args)
+
+	# prompts would end up in the export, so the dates are required
+	if options.start is None or options.end is None:
+		parser.error('--start and --end are required')
+
+	try:
+		s_year, s_month, s_day = _format_date(options.start)
+		e_year, e_month, e_day = _format_date(options.end)
+	except Exception as e:
+		parser.error('unable to convert dates to representation, such as 2016-11-16')
+
+	# convert to timestamp that SQL knows
+	start_date = datetime.datetime(s_year, s_month, s_day, 0, 0, 0).strftime('%Y-%m-%d %H:%M:%S')
+	end_date = datetime.datetime(e_year, e_month, e_day, 0, 0, 0).strftime('%Y-%m-%d %H:%M:%S')
+
+	uuid = None
+	if options.user is not None:
+		user_data = user.get_user(options.user)
+		if user_data is None:
+			sys.stderr.write('Unable to find ' + str(options.user) + '. Are you sure they exist?\n')
+			return None
+		uuid = user_data[0]
+
+	if options.type == 'sessions':
+		approved = None
+		if options.approved is not None:
+			approved = options.approved == 'yes'
+
+		rows = _export_session_rows(user_session.iter_session_logs(start_date, end_date, uuid, options.team, approved))
+	else:
+		rows = repo.iter_commit_logs(start_date, end_date, uuid, options.team)
+
+	out = sys.stdout
+	if options.output is not None:
+		out = open(options.output, 'w')
+
+	try:
+		count = _write_export(rows, EXPORT_COLUMNS[options.type], options.format, out)
+	finally:
+		if out is not sys.stdout:
+			out.close()
+
+	sys.stderr.write('Exported ' + str(count) + ' ' + str(options.type) + ' between ' + str(start_date) + ' and ' + str(end_date) + '.\n')
+
+def _export_session_rows(session_logs):
+	'''
+	Adds the worked hours to streamed session logs.
+
+	Args:
+		session_logs: A generator of session logs, from user_session.iter_session_logs
+
+	Returns:
+		A generator of session logs in the order of EXPORT_COLUMNS['sessions'].
+	'''
+	for log_id, user_id, username, team_id, work_time, start, end, approved in session_logs:
+		hours = '%.2f' % (work_time / 3600000.0)
+		yield (log_id, user_id, username, team_id, work_time, hours, start, end, approved)
+
+def _write_export(rows, columns, output_format, out):
+	'''
+	Writes rows to the output one at a time.
+
+	Args:
+		rows: An iterable of tuples, in the order of columns
+		columns: The names of the columns
+		output_format: Either 'csv' or 'jsonl'
+		out: The file to write to
+
+	Returns:
+		The number of rows written.
+	'''
+	count = 0
+
+	writer = None
+	if output_format == 'csv':
+		writer = csv.writer(out)
+		writer.writerow(columns)
+
+	for row in rows:
+		# timestamps are written the way SQL shows them
+		values = []
+		for value in row:
+			if isinstance(value, datetime.datetime):
+				value = value.strftime('%Y-%m-%d %H:%M:%S')
+			values.append(value)
+
+		if writer is not None:
+			writer.writerow(values)
+		else:
+			out.write(json.dumps(dict(zip(columns, values))) + '\n')
+
+		count = count + 1
+
+	return count
+
+def handle_archive_command(args=None):
+	'''
+	Handles the parsing of the archive command. Closed months are snapshot
+	into a columnar archive, which historical reports read without MySQL.
+
+	Args:
+		args: The command line arguments that follow the command
+	'''
+	if args is None:
+		args = []
+
+	# numpy is only needed by the archive
+	from analytics import archive
+	from analytics import report
+	from analytics import snapshot
+
+	parser = optparse.OptionParser(usage='python track.py archive snapshot [YYYY-MM] | list | report --from YYYY-MM --to YYYY-MM [--by user|team|month|week|day] | benchmark [options]')
+	parser.add_option('--from', dest='first', help='the first month to report on')
+	parser.add_option('--to', dest='last', help='the last month to report on')
+	parser.add_option('--by', dest='by', default='user', choices=['user', 'team'] + report.PERIODS, help='how to group the report, user, team, month, week or day [user]')
+	parser.add_option('--rows', dest='rows', type='int', default=5000000, help='how many synthetic session logs to benchmark [5000000]')
+	parser.add_option('--start', dest='start', help='the starting date of the SQL benchmark')
+	parser.add_option('--end', dest='end', help='the ending date of the SQL benchmark')
+	options, rest = parser.parse_args(args)
+
+	if len(rest) == 0:
+		parser.error('expected one of snapshot, list, report or benchmark')
+
+	directory = settings.getSettings().archive_directory
+	action = rest[0].lower()
+
+	if action == 'snapshot':
+		try:
+			if len(rest) > 1:
+				year, month = archive.parse_month(rest[1])
+				sessions, states = snapshot.snapshot_month(directory, year, month)
+				print('Archived ' + archive.month_name(year, month) + ' with ' + str(sessions) + ' session logs and ' + str(states) + ' state changes.')
 			else:
-				_verify_session(verify_uuid, not_verified, trans)
+				months = snapshot.snapshot_closed_months(directory)
+				if len(months) > 0:
+					print('Archived ' + ', '.join(months) + '.')
+				else:
+					print('Every closed month is already archived.')
+		except ValueError as e:
+			print(e)
+
+	elif action == 'list':
+		months = archive.list_months(directory)
+		if len(months) == 0:
+			print('No archived months in ' + str(directory) + '.')
+		for name in months:
+			print(str(archive.ArchiveMonth(directory, name)))
+
+	elif action == 'report':
+		if options.first is None or options.last is None:
+			parser.error('--from and --to are required')
+
+		try:
+			first = archive.month_name(*archive.parse_month(options.first))
+			last = archive.month_name(*archive.parse_month(options.last))
+		except Exception as e:
+			parser.error('unable to convert months to representation, such as 2016-11')
+
+		months = [m for m in archive.list_months(directory) if m >= first and m <= last]
+		if len(months) == 0:
+			print('No archived months between ' + first + ' and ' + last + '. Try python track.py archive snapshot')
+			return None
+
+		r = report.ArchiveReport(directory, months)
+		print('\nArchive report by ' + str(options.by) + ' for ' + ', '.join(months) + ': \n')
+
+		if options.by == 'user':
+			for uuid, name, team_id, work_time, approved_time, count in r.user_totals():
+				print('[' + str(name) + '] ' + _archive_totals(work_time, approved_time, count))
+		elif options.by == 'team':
+			for team_id, work_time, approved_time, count in r.team_totals():
+				print('[Team #' + str(team_id) + '] ' + _archive_totals(work_time, approved_time, count))
+		else:
+			for label, work_time, approved_time, count in r.period_totals(options.by):
+				print('[' + str(label) + '] ' + _archive_totals(work_time, approved_time, count))
+
+	elif action == 'benchmark':
+		from analytics import benchmark
 
-def _verify_session(verify_uuid, not_verified_ids, trans_id):
+		timings = benchmark.run(rows=options.rows)
+
+		if options.start is not None and options.end is not None:
+			date_range = _get_date_range(options.start, options.end, 'benchmark')
+			if date_range is None:
+				return None
+			timings = timings + benchmark.run_sql(date_range[0], date_range[1])
+
+		for name, seconds in timings:
+			print(str(name) + ': ' + ('%.3f' % seconds) + ' seconds')
+
+	else:
+		parser.error('unknown archive action ' + str(action))
+
+def _archive_totals(work_time, approved_time, count):
+	'''
+	Returns:
+		The totals of an archive report line as text.
+	'''
+	hours = '%.2f' % (work_time / 3600000.0)
+	approved_hours = '%.2f' % (approved_time / 3600000.0)
+	return hours + ' hours in ' + str(count) + ' transactions, ' + approved_hours + ' hours VERIFIED.'
+
+def handle_payroll_command(args=None):
 	'''
-	Verifies the session by signing with the verify_uuid.
+	Handles the parsing of the payroll command. This computes the payroll of
+	every user in a period at once and writes it as CSV.
 
 	Args:
-		verify_uuid: The UUID of the user verifying
-		not_verified_ids: The list of ids that are not yet verified
-		trans_id: The ID of the transaction the user is verifying
+		args: The command line arguments that follow the command
 	'''
+	if args is None:
+		args = []
+
+	# numpy is only needed by the payroll
+	from analytics import payroll
+
+	parser = optparse.OptionParser(usage='python track.py payroll --start YYYY-MM-DD --end YYYY-MM-DD [options]')
+	parser.add_option('--start', dest='start', help='the first day of the payroll')
+	parser.add_option('--end', dest='end', help='the day after the payroll')
+	parser.add_option('--team', dest='team', type='int', help='only compute the payroll of this team')
+	parser.add_option('--buckets', dest='buckets', choices=['day', 'week'], help='write daily or weekly buckets instead of the summary')
+	parser.add_option('--daily-overtime', dest='daily_overtime', type='float', help='verified hours in a day past which hours are overtime [settings]')
+	parser.add_option('--weekly-overtime', dest='weekly_overtime', type='float', help='verified hours in a week past which hours are overtime [settings]')
+	parser.add_option('--output', dest='output', help='the file to write to [stdout]')
+	options, rest = parser.parse_args(args)
+
+	# prompts would end up in the CSV, so the dates are required
+	if options.start is None or options.end is None:
+		parser.error('--start and --end are required')
+
+	try:
+		s_year, s_month, s_day = _format_date(options.start)
+		e_year, e_month, e_day = _format_date(options.end)
+	except Exception as e:
+		parser.error('unable to convert dates to representation, such as 2016-11-16')
+
+	# convert to timestamp that SQL knows
+	start_date = datetime.datetime(s_year, s_month, s_day, 0, 0, 0).strftime('%Y-%m-%d %H:%M:%S')
+	end_date = datetime.datetime(e_year, e_month, e_day, 0, 0, 0).strftime('%Y-%m-%d %H:%M:%S')
+
+	if end_date <= start_date:
+		parser.error('--end must be after --start')
+
+	result = payroll.compute_payroll(start_date, end_date, options.team, options.daily_overtime, options.weekly_overtime)
+
+	if options.buckets is not None:
+		rows = result.bucket_rows(options.buckets)
+		columns = payroll.BUCKET_COLUMNS
+	else:
+		rows = result.summary_rows()
+		columns = payroll.SUMMARY_COLUMNS
+
+	out = sys.stdout
+	if options.output is not None:
+		out = open(options.output, 'w')
+
 	try:
-		transaction = int(trans_id)
+		count = payroll.write_csv(rows, columns, out)
+	finally:
+		if out is not sys.stdout:
+			out.close()
+
+	sys.stderr.write('Wrote ' + str(count) + ' payroll rows between ' + str(start_date) + ' and ' + str(end_date) + '.\n')
+
+def handle_reconstruct_command(args=None):
+	'''
+	Handles the parsing of the reconstruct command. This rebuilds sessions from
+	log_user_state and writes where they disagree with log_user_session.
+
+	Args:
+		args: The command line arguments that follow the command
+	'''
+	if args is None:
+		args = []
+
+	from analytics import reconstruct
 
-		if transaction in not_verified_ids:
-			user_session.verify_session_log(transaction, verify_uuid)
-			not_verified_ids.remove(transaction)
-			print('Signed transaction #' + str(transaction) + '!')
+	parser = optparse.OptionParser(usage='python track.py reconstruct --start YYYY-MM-DD --end YYYY-MM-DD [options]')
+	parser.add_option('--start', dest='start', help='the starting date to check')
+	parser.add_option('--end', dest='end', help='the ending date to check')
+	parser.add_option('--workers', dest='workers', type='int', default=1, help='how many processes split the users between them [1]')
+	parser.add_option('--tolerance', dest='tolerance', type='float', default=reconstruct.CREDIT_TOLERANCE_MS / 60000.0, help='minutes of credit a session log may differ by [5]')
+	parser.add_option('--format', dest='format', default='csv', choices=['csv', 'jsonl'], help='the output format, csv or jsonl [csv]')
+	parser.add_option('--output', dest='output', help='the file to write to [stdout]')
+	options, rest = parser.parse_args(args)
+
+	# prompts would end up in the output, so the dates are required
+	if options.start is None or options.end is None:
+		parser.error('--start and --end are required')
+
+	try:
+		s_year, s_month, s_day = _format_date(options.start)
+		e_year, e_month, e_day = _format_date(options.end)
+	except Exception as e:
+		parser.error('unable to convert dates to representation, such as 2016-11-16')
+
+	# convert to timestamp that SQL knows
+	start_date = datetime.datetime(s_year, s_month, s_day, 0, 0, 0).strftime('%Y-%m-%d %H:%M:%S')
+	end_date = datetime.datetime(e_year, e_month, e_day, 0, 0, 0).strftime('%Y-%m-%d %H:%M:%S')
+
+	sessions, logs, discrepancies = reconstruct.check_sessions(start_date, end_date, options.workers, int(options.tolerance * 60000))
+
+	out = sys.stdout
+	if options.output is not None:
+		out = open(options.output, 'w')
+
+	try:
+		_write_export(_reconstruct_rows(discrepancies), reconstruct.DISCREPANCY_COLUMNS, options.format, out)
+	finally:
+		if out is not sys.stdout:
+			out.close()
+
+	sys.stderr.write('Rebuilt ' + str(sessions) + ' sessions and checked ' + str(logs) + ' session logs between ' + str(start_date) + ' and ' + str(end_date) + '.\n')
+
+	kinds = {}
+	for row in discrepancies:
+		kinds[row[0]] = kinds.get(row[0], 0) + 1
+	for kind in sorted(kinds):
+		sys.stderr.write(str(kinds[kind]) + ' ' + str(kind) + ': ' + reconstruct.DISCREPANCIES[kind] + '\n')
+
+def _reconstruct_rows(discrepancies):
+	'''
+	Shows the times of discrepancies as dates.
+
+	Args:
+		discrepancies: The discrepancies, from reconstruct.check_sessions
+
+	Returns:
+		A generator of discrepancies in the order of reconstruct.DISCREPANCY_COLUMNS.
+	'''
+	for kind, user_id, log_id, start, end, logged_ms, reconstructed_ms, paused_ms in discrepancies:
+		if start is not None:
+			start = datetime.datetime.fromtimestamp(start)
+		if end is not None:
+			end = datetime.datetime.fromtimestamp(end)
+		yield (kind, user_id, log_id, start, end, logged_ms, reconstructed_ms, paused_ms)
+
+def handle_audit_command(args=None):
+	'''
+	Handles the parsing of the audit command. This lists the session logs that
+	overlap or duplicate each other in a period.
+
+	Args:
+		args: The command line arguments that follow the command
+	'''
+	if args is None:
+		args = []
+
+	parser = optparse.OptionParser(usage='python track.py audit --start YYYY-MM-DD --end YYYY-MM-DD [options]')
+	parser.add_option('--start', dest='start', help='the starting date to audit')
+	parser.add_option('--end', dest='end', help='the ending date to audit')
+	parser.add_option('--user', dest='user', help='only audit this user')
+	parser.add_option('--team', dest='team', type='int', help='only audit this team')
+	parser.add_option('--format', dest='format', default='csv', choices=['csv', 'jsonl'], help='the output format, csv or jsonl [csv]')
+	parser.add_option('--output', dest='output', help='the file to write to [stdout]')
+	options, rest = parser.parse_args(args)
+
+	# prompts would end up in the output, so the dates are required
+	if options.start is None or options.end is None:
+		parser.error('--start and --end are required')
+
+	try:
+		s_year, s_month, s_day = _format_date(options.start)
+		e_year, e_month, e_day = _format_date(options.end)
+	except Exception as e:
+		parser.error('unable to convert dates to representation, such as 2016-11-16')
+
+	# convert to timestamp that SQL knows
+	start_date = datetime.datetime(s_year, s_month, s_day, 0, 0, 0).strftime('%Y-%m-%d %H:%M:%S')
+	end_date = datetime.datetime(e_year, e_month, e_day, 0, 0, 0).strftime('%Y-%m-%d %H:%M:%S')
+
+	uuid = None
+	if options.user is not None:
+		user_data = user.get_user(options.user)
+		if user_data is None:
+			sys.stderr.write('Unable to find ' + str(options.user) + '. Are you sure they exist?\n')
+			return None
+		uuid = user_data[0]
+
+	findings = intervals.find_overlaps(user_session.iter_session_logs(start_date, end_date, uuid, options.team))
+
+	out = sys.stdout
+	if options.output is not None:
+		out = open(options.output, 'w')
+
+	try:
+		_write_export(findings, intervals.FINDING_COLUMNS, options.format, out)
+	finally:
+		if out is not sys.stdout:
+			out.close()
+
+	kinds = {}
+	hours = 0
+	for row in findings:
+		kinds[row[0]] = kinds.get(row[0], 0) + 1
+		hours = hours + row[-1] / 3600000.0
+
+	for kind in sorted(kinds):
+		sys.stderr.write(str(kinds[kind]) + ' ' + str(kind) + ': ' + intervals.FINDINGS[kind] + '\n')
+	sys.stderr.write('Found ' + str(len(findings)) + ' overlapping session logs between ' + str(start_date) + ' and ' + str(end_date) + ', up to ' + ('%.2f' % hours) + ' hours counted twice.\n')
+
+def handle_simulate_command(args=None):
+	'''
+	Handles the parsing of the simulate command. This replays a month of
+	commands for many users through Pulse on a simulated clock, without
+	MySQL or Slack, to benchmark Pulse and check what it credits.
+
+	Args:
+		args: The command line arguments that follow the command
+	'''
+	if args is None:
+		args = []
+
+	parser = optparse.OptionParser(usage='python track.py simulate [--users n] [--month YYYY-MM] [--days n] [--seed n] [--partitions n] [--restarts n]')
+	parser.add_option('--users', dest='users', type='int', default=1000, help='how many users to simulate [1000]')
+	parser.add_option('--month', dest='month', help='the month to simulate [this month]')
+	parser.add_option('--days', dest='days', type='int', help='how many days of the month to simulate [all]')
+	parser.add_option('--seed', dest='seed', type='int', default=0, help='the seed of the simulated activity [0]')
+	parser.add_option('--partitions', dest='partitions', type='int', default=1, help='how many shards Pulse splits the users into [1]')
+	parser.add_option('--restarts', dest='restarts', type='int', default=0, help='how many times Pulse is restarted during the month [0]')
+	options, rest = parser.parse_args(args)
+
+	month = None
+	if options.month is not None:
+		try:
+			parts = options.month.split('-')
+			month = (int(parts[0]), int(parts[1]))
+		except Exception as e:
+			parser.error('unable to convert the month to representation, such as 2016-11')
+
+	from analytics import simulation
+
+	try:
+		results = simulation.run(users=options.users, days=options.days, month=month, seed=options.seed, partitions=options.partitions, restarts=options.restarts)
+	except ValueError as e:
+		sys.stderr.write('The simulation failed: ' + str(e) + '\n')
+		return None
+
+	for name, value in results:
+		if isinstance(value, float):
+			print(str(name) + ': ' + ('%.3f' % value) + ' seconds')
 		else:
-			print('Unknown transaction #' + str(trans_id) + '!')
+			print(str(name) + ': ' + str(value))
+
+def _get_date_range(start_date, end_date, action):
+	'''
+	Converts a starting and ending date to timestamps that SQL knows, prompting
+	for whichever one was not given.
+
+	Args:
+		start_date: The starting date in the form of 'YYYY-MM-DD', or None
+		end_date: The ending date in the form of 'YYYY-MM-DD', or None
+		action: What the dates are used for, shown in the prompts
+
+	Returns:
+		The range in the form of (start_date, end_date), or None if the dates
+		could not be converted.
+	'''
+	if start_date is None:
+		start_date = raw_input('The starting date to ' + str(action) + ' (Ex: YYYY-MM-DD)?: ')
+
+	if end_date is None:
+		end_date = raw_input('The ending date to ' + str(action) + ' (Ex: YYYY-MM-DD)?: ')
+
+	# attempt to format their input
+	try:
+		s_year, s_month, s_day = _format_date(start_date)
+		e_year, e_month, e_day = _format_date(end_date)
 	except Exception as e:
 		print(e)
-		print('Unable to verify transaction ' + str(trans_id) + '.')
+		print('Unable to convert dates to representation... Are you sure they are entered correctly?')
+		return None
+
+	# convert to timestamp that SQL knows
+	start_date = datetime.datetime(s_year, s_month, s_day, 0, 0, 0).strftime('%Y-%m-%d %H:%M:%S')
+	end_date = datetime.datetime(e_year, e_month, e_day, 0, 0, 0).strftime('%Y-%m-%d %H:%M:%S')
+
+	return (start_date, end_date)
 
 def _format_date(input_date):
 	'''
@@ -602,7 +1520,7 @@ if __name__ == '__main__':
 		if cmd == 'help':
 			handle_help_command()
 		elif cmd == 'report':
-			handle_report_command()
+			handle_report_command(sys.argv[2:])
 		elif cmd == 'add':
 			handle_add_command()
 		elif cmd == 'remove':
@@ -614,7 +1532,21 @@ if __name__ == '__main__':
 		elif cmd == 'session':
 			handle_session_command()
 		elif cmd == 'verify':
-			handle_verify_command()
+			handle_verify_command(sys.argv[2:])
+		elif cmd == 'bulk':
+			handle_bulk_command(sys.argv[2:])
+		elif cmd == 'export':
+			handle_export_command(sys.argv[2:])
+		elif cmd == 'archive':
+			handle_archive_command(sys.argv[2:])
+		elif cmd == 'payroll':
+			handle_payroll_command(sys.argv[2:])
+		elif cmd == 'reconstruct':
+			handle_reconstruct_command(sys.argv[2:])
+		elif cmd == 'audit':
+			handle_audit_command(sys.argv[2:])
+		elif cmd == 'simulate':
+			handle_simulate_command(sys.argv[2:])
 		else:
 			handle_help_command()
 	else:
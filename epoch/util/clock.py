@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+# python modules
+import datetime
+import threading
+import time
+
+# the format timestamps are stored in MySQL with
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# the state of the fallback monotonic clock, in the form of [last wall time, offset]
+_fallback_state = [None, 0.0]
+_fallback_lock = threading.Lock()
+
+def _fallback_monotonic():
+    '''
+    Python 2 has no monotonic clock, so the wall clock is used, shifted
+    forward whenever it steps back so the result never decreases. Steps
+    forward can not be told apart from time passing.
+
+    Returns:
+        Seconds from an arbitrary point, that never decrease.
+    '''
+    with _fallback_lock:
+        now = time.time()
+        last, offset = _fallback_state
+
+        if last is not None and now < last:
+            offset = offset + (last - now)
+
+        _fallback_state[0] = now
+        _fallback_state[1] = offset
+        return now + offset
+
+# seconds from an arbitrary point, unaffected by changes to the wall clock
+monotonic = getattr(time, 'monotonic', _fallback_monotonic)
+
+class SystemClock(object):
+    '''
+    The clock of the machine. Everything that needs the current time asks
+    the clock from get_clock(), so a SimulatedClock can stand in for it.
+    '''
+    def time(self):
+        '''
+        Returns:
+            The wall time, in seconds since the epoch.
+        '''
+        return time.time()
+
+    def monotonic(self):
+        '''
+        Returns:
+            Seconds from an arbitrary point, unaffected by changes to the wall clock.
+        '''
+        return monotonic()
+
+    def now(self):
+        '''
+        Returns:
+            The local wall time, as a datetime.
+        '''
+        return datetime.datetime.fromtimestamp(self.time())
+
+    def today(self):
+        '''
+        Returns:
+            The local date.
+        '''
+        return self.now().date()
+
+    def timestamp(self):
+        '''
+        Returns:
+            The local wall time, formatted the way MySQL stores timestamps.
+        '''
+        return self.now().strftime(TIMESTAMP_FORMAT)
+
+class SimulatedClock(SystemClock):
+    '''
+    A clock that only moves when told to, so hours of Pulse can be replayed
+    in moments. Its monotonic time counts the seconds advanced since it was
+    created.
+    '''
+    def __init__(self, start=None):
+        '''
+        Args:
+            start: The wall time it starts at, in seconds since the epoch, now by default
+        '''
+        if start is None:
+            start = time.time()
+        self.wall = float(start)
+        self.elapsed = 0.0
+
+    def time(self):
+        return self.wall
+
+    def monotonic(self):
+        return self.elapsed
+
+    def advance(self, seconds):
+        '''
+        Moves both the wall and monotonic time forward.
+
+        Args:
+            seconds: How many seconds pass
+        '''
+        if seconds < 0:
+            raise ValueError('A clock can not go back ' + str(seconds) + ' seconds, use set_time to step the wall clock')
+        self.wall = self.wall + seconds
+        self.elapsed = self.elapsed + seconds
+
+    def set_time(self, wall):
+        '''
+        Steps the wall clock without any time passing, as when the system clock is changed.
+
+        Args:
+            wall: The new wall time, in seconds since the epoch
+        '''
+        self.wall = float(wall)
+
+# the clock everything reads the time from
+_clock = SystemClock()
+
+def get_clock():
+    '''
+    Returns:
+        The clock in use, the SystemClock unless set_clock() replaced it.
+    '''
+    return _clock
+
+def set_clock(new_clock):
+    '''
+    Replaces the clock in use, Ex: with a SimulatedClock.
+
+    Args:
+        new_clock: The clock to use, None for the SystemClock
+
+    Returns:
+        The clock that was in use.
+    '''
+    global _clock
+    old = _clock
+    _clock = new_clock or SystemClock()
+    return old
+
+class TickStats(object):
+    '''
+    Telemetry of a periodic tick: how long each tick took, how late it ran,
+    how much it credited, and the gaps and clock jumps that were flagged.
+    '''
+    def __init__(self):
+        self.ticks = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.last_credit_ms = 0
+        self.total_credit_ms = 0
+        self.capped_ticks = 0
+        self.capped_ms = 0
+        self.clock_jumps = 0
+        self.last_clock_jump = 0.0
+
+    def record(self, duration, lag, credit_ms):
+        '''
+        Records one tick.
+
+        Args:
+            duration: How long the tick ran, in seconds
+            lag: How late the tick started compared to when it was due, in seconds
+            credit_ms: How much the tick credited, in milliseconds
+        '''
+        self.ticks = self.ticks + 1
+        self.last_duration = duration
+        self.max_duration = max(self.max_duration, duration)
+        self.total_duration = self.total_duration + duration
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.total_lag = self.total_lag + lag
+        self.last_credit_ms = credit_ms
+        self.total_credit_ms = self.total_credit_ms + credit_ms
+
+    def record_cap(self, dropped_ms):
+        '''
+        Records a tick whose gap was too long to credit in full.
+
+        Args:
+            dropped_ms: How many milliseconds were not credited
+        '''
+        self.capped_ticks = self.capped_ticks + 1
+        self.capped_ms = self.capped_ms + dropped_ms
+
+    def record_clock_jump(self, jump):
+        '''
+        Records the wall clock moving differently from the monotonic clock.
+
+        Args:
+            jump: How many seconds the wall clock moved more than the monotonic clock
+        '''
+        self.clock_jumps = self.clock_jumps + 1
+        self.last_clock_jump = jump
+
+    def metrics(self):
+        '''
+        Returns:
+            A dictionary of the telemetry, with averages.
+        '''
+        average_duration = 0.0
+        average_lag = 0.0
+        if self.ticks > 0:
+            average_duration = self.total_duration / self.ticks
+            average_lag = self.total_lag / self.ticks
+
+        return {
+            'ticks': self.ticks,
+            'last_duration': self.last_duration,
+            'average_duration': average_duration,
+            'max_duration': self.max_duration,
+            'last_lag': self.last_lag,
+            'average_lag': average_lag,
+            'max_lag': self.max_lag,
+            'last_credit_ms': self.last_credit_ms,
+            'total_credit_ms': self.total_credit_ms,
+            'capped_ticks': self.capped_ticks,
+            'capped_ms': self.capped_ms,
+            'clock_jumps': self.clock_jumps,
+            'last_clock_jump': self.last_clock_jump,
+        }
+
+    def __str__(self):
+        m = self.metrics()
+        return 'ticks=' + str(m['ticks']) + ', duration=' + ('%.3f' % m['average_duration']) + 's avg/' + ('%.3f' % m['max_duration']) + 's max, lag=' + ('%.3f' % m['average_lag']) + 's avg/' + ('%.3f' % m['max_lag']) + 's max, credited=' + str(m['total_credit_ms']) + 'ms, capped=' + str(m['capped_ticks']) + ' ticks/' + str(m['capped_ms']) + 'ms, clock_jumps=' + str(m['clock_jumps'])
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+# python modules
+import json
+import os
+import socket
+import threading
+
+# the longest command accepted, in bytes
+MAX_COMMAND = 1024
+
+class ControlServer(object):
+    '''
+    Answers commands sent to a local Unix socket, one command per connection:
+    the client sends a line, and gets back a line of JSON. Only the user
+    running the server may connect.
+    '''
+    def __init__(self, path, handler, timeout=10.0):
+        '''
+        Args:
+            path: The path of the socket
+            handler: The function called with each command, returning a dictionary to reply with
+            timeout: How many seconds a client has to send its command
+        '''
+        self.path = path
+        self.handler = handler
+        self.timeout = timeout
+
+        self.sock = None
+        self.thread = None
+        self.closed = threading.Event()
+
+    def start(self):
+        '''
+        Listens on the socket, answering commands on a thread of its own.
+        '''
+        # a socket left behind by a process that was killed is replaced, one in use is not
+        if os.path.exists(self.path):
+            if is_listening(self.path):
+                raise IOError('Another process is listening on ' + str(self.path))
+            os.remove(self.path)
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self.sock.listen(5)
+
+        # accept() is not interrupted by close() on every platform, so it wakes up to check
+        self.sock.settimeout(1.0)
+
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        '''
+        Stops answering commands, and removes the socket.
+        '''
+        self.closed.set()
+
+        if self.thread is not None:
+            self.thread.join(5)
+
+        if self.sock is not None:
+            self.sock.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _serve(self):
+        '''
+        Answers the commands of one client at a time, until closed.
+        '''
+        while not self.closed.is_set():
+            try:
+                conn, address = self.sock.accept()
+            except socket.timeout:
+                continue
+            except socket.error:
+                if self.closed.is_set():
+                    return
+                continue
+
+            try:
+                conn.settimeout(self.timeout)
+                command = _read_line(conn)
+
+                try:
+                    reply = self.handler(command)
+                except Exception as e:
+                    reply = {'ok': False, 'error': str(e)}
+
+                conn.sendall((json.dumps(reply) + '\n').encode('utf-8'))
+            except socket.error:
+                pass
+            finally:
+                conn.close()
+
+def send_command(path, command, timeout=30.0):
+    '''
+    Sends a command to a ControlServer.
+
+    Args:
+        path: The path of the socket
+        command: The command, Ex: 'status'
+        timeout: How many seconds to wait for the reply
+
+    Returns:
+        The reply, as a dictionary.
+    '''
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+
+    try:
+        sock.connect(path)
+        sock.sendall((str(command) + '\n').encode('utf-8'))
+
+        reply = b''
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            reply = reply + data
+    finally:
+        sock.close()
+
+    return json.loads(reply.decode('utf-8'))
+
+def is_listening(path):
+    '''
+    Returns:
+        True if a process accepts connections on the socket.
+    '''
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+def _read_line(conn):
+    '''
+    Returns:
+        The first line sent on the connection, without the newline.
+    '''
+    data = b''
+    while b'\n' not in data and len(data) < MAX_COMMAND:
+        chunk = conn.recv(MAX_COMMAND)
+        if not chunk:
+            break
+        data = data + chunk
+
+    return data.split(b'\n', 1)[0].decode('utf-8', 'replace').strip()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+# local modules
+from util import clock
+
+# python modules
+from collections import OrderedDict
+import threading
+
+# marks a request that is still being handled
+PENDING = object()
+
+class RequestCache(object):
+    '''
+    Remembers the responses to recent requests by their id, so a request
+    delivered again, such as a retry, gets the first response without being
+    handled again. A copy arriving while the first one is still handled waits
+    for its response.
+
+    At most size responses are kept, each for ttl seconds. As they all live
+    as long, the oldest is always the first to expire or be forgotten.
+    '''
+    def __init__(self, size=10000, ttl=300.0, timer=clock.monotonic):
+        '''
+        Args:
+            size: The most responses remembered
+            ttl: How many seconds a response is remembered
+            timer: The function measuring the time, in seconds
+        '''
+        self.size = max(int(size), 1)
+        self.ttl = float(ttl)
+        self.timer = timer
+
+        # request id to [expires, response], oldest first
+        self.entries = OrderedDict()
+        self.condition = threading.Condition()
+
+        self.hits = 0
+        self.misses = 0
+
+    def handle(self, key, func, wait=2.0):
+        '''
+        Handles a request once, however many times it is delivered.
+
+        Args:
+            key: The id of the request
+            func: The function handling the request, without arguments, returning its response or None
+            wait: How many seconds a copy waits for the first one to be handled
+
+        Returns:
+            The response, or None if the first one is still being handled after waiting.
+        '''
+        with self.condition:
+            now = self.timer()
+            self._expire(now)
+
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.hits = self.hits + 1
+
+                deadline = now + wait
+                while entry[1] is PENDING and self.entries.get(key) is entry:
+                    left = deadline - self.timer()
+                    if left <= 0:
+                        return None
+                    self.condition.wait(left)
+
+                if entry[1] is PENDING:
+                    return None
+                return entry[1]
+
+            self.misses = self.misses + 1
+            entry = [now + self.ttl, PENDING]
+            self.entries[key] = entry
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+        response = None
+        try:
+            response = func()
+        finally:
+            with self.condition:
+                if response is not None:
+                    entry[1] = response
+                elif self.entries.get(key) is entry:
+                    # a request that failed, or has no response yet, is handled again when retried
+                    del self.entries[key]
+                self.condition.notify_all()
+
+        return response
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _expire(self, now):
+        '''
+        Forgets the responses that expired, the caller holds the condition.
+        '''
+        while len(self.entries) > 0:
+            key, entry = next(iter(self.entries.items()))
+            if entry[0] > now:
+                return
+            del self.entries[key]
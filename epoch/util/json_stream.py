@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+
+# python modules
+import codecs
+import json
+import tempfile
+
+# number of bytes read from a stream at a time
+CHUNK_SIZE = 64 * 1024
+
+# bodies larger than this are spooled to disk instead of memory
+SPOOL_SIZE = 1024 * 1024
+
+# characters JSON treats as insignificant whitespace
+WHITESPACE = ' \t\r\n'
+
+class PayloadTooLarge(Exception):
+    '''
+    Raised when a request body is larger than the maximum allowed size.
+    '''
+    pass
+
+def spool_body(stream, max_bytes, content_length=None, digest=None):
+    '''
+    Copies a request body into a temporary file, chunk by chunk, so the
+    payload is never held in memory as a whole.
+
+    Args:
+        stream: The file-like object to read the body from
+        max_bytes: The maximum number of bytes the body may contain
+        content_length: The length the client declared for the body, if any
+        digest: An optional hash/hmac object that is updated with the body
+
+    Returns:
+        A temporary file holding the body, positioned at its start.
+
+    Raises:
+        PayloadTooLarge: If the body is larger than max_bytes.
+    '''
+    if content_length is not None and int(content_length) > max_bytes:
+        raise PayloadTooLarge('Declared body of ' + str(content_length) + ' bytes exceeds ' + str(max_bytes) + ' bytes.')
+
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    total = 0
+
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+
+        total = total + len(chunk)
+        if total > max_bytes:
+            spool.close()
+            raise PayloadTooLarge('Body exceeds ' + str(max_bytes) + ' bytes.')
+
+        if digest is not None:
+            digest.update(chunk)
+        spool.write(chunk)
+
+    spool.seek(0)
+    return spool
+
+def batches(iterable, size):
+    '''
+    Groups the items of an iterable into lists of at most size items.
+
+    Args:
+        iterable: The items to group
+        size: The maximum number of items per batch
+
+    Returns:
+        A generator of lists, each holding at most size items.
+    '''
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+
+    if len(batch) > 0:
+        yield batch
+
+class ArrayStream(object):
+    '''
+    Streams the elements of one array inside a JSON document, for example the
+    `commits` of a push payload, one element at a time.
+
+    The rest of the document is available through skeleton(), with the
+    streamed array replaced by an empty list.
+    '''
+    def __init__(self, f, path):
+        '''
+        Args:
+            f: A seekable file holding the JSON document
+            path: The keys leading to the array, Ex: ('changesets', 'values')
+        '''
+        self.f = f
+        self.path = tuple(path)
+        self._skeleton = None
+
+    def skeleton(self):
+        '''
+        Returns:
+            The document without the contents of the streamed array.
+        '''
+        if self._skeleton is None:
+            holder = {}
+            for element in self._walk(holder):
+                pass
+            self._skeleton = holder.get(None)
+
+        return self._skeleton
+
+    def __iter__(self):
+        '''
+        Returns:
+            A generator over the elements of the streamed array.
+        '''
+        return self._walk({})
+
+    def close(self):
+        '''
+        Closes the underlying file.
+        '''
+        self.f.close()
+
+    def _walk(self, holder):
+        '''
+        Parses the document from the start, yielding the streamed elements
+        and storing the skeleton in holder[None].
+        '''
+        self.f.seek(0)
+        reader = _Reader(self.f)
+
+        for element in _walk(reader, self.path, holder, None):
+            yield element
+
+        if reader.peek() != '':
+            raise ValueError('Extra data after the JSON document.')
+
+class _Reader(object):
+    '''
+    A forward-only buffer over a file, that decodes one JSON value at a time.
+    '''
+    def __init__(self, f):
+        self.f = f
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buf = u''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size=CHUNK_SIZE):
+        '''
+        Reads more of the file into the buffer, dropping what was consumed.
+
+        Returns:
+            True if data was read, False at the end of the file.
+        '''
+        if self.eof:
+            return False
+
+        chunk = self.f.read(size)
+        if not chunk:
+            self.eof = True
+            self.buf = self.buf[self.pos:] + self.decoder.decode(b'', True)
+            self.pos = 0
+            return False
+
+        self.buf = self.buf[self.pos:] + self.decoder.decode(chunk)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        '''
+        Skips whitespace.
+
+        Returns:
+            The next significant character, or '' at the end of the file.
+        '''
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos = self.pos + 1
+
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        '''
+        Consumes the next significant character, which must be char.
+        '''
+        if self.peek() != char:
+            raise ValueError('Expected ' + repr(char) + ' in JSON document.')
+        self.pos = self.pos + 1
+
+    def decode(self):
+        '''
+        Decodes the next complete JSON value, reading as much as it needs.
+
+        Returns:
+            The decoded value.
+        '''
+        self.peek()
+        size = CHUNK_SIZE
+
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                # the value is cut at the end of the buffer
+                if not self.fill(size):
+                    raise
+                size = size * 2
+                continue
+
+            # a number or literal may continue past the end of the buffer
+            if end == len(self.buf) and not self.eof:
+                self.fill(size)
+                size = size * 2
+                continue
+
+            self.pos = end
+            return value
+
+def _walk(reader, path, parent, key):
+    '''
+    Walks the JSON value under the reader, yielding the elements of the array
+    found at path, and storing the rest of the value in parent[key].
+    '''
+    if len(path) == 0 and reader.peek() == '[':
+        parent[key] = []
+
+        reader.expect('[')
+        if reader.peek() == ']':
+            reader.expect(']')
+            return
+
+        while True:
+            yield reader.decode()
+
+            if reader.peek() == ']':
+                reader.expect(']')
+                return
+            reader.expect(',')
+
+    if len(path) == 0 or reader.peek() != '{':
+        parent[key] = reader.decode()
+        return
+
+    obj = {}
+    parent[key] = obj
+
+    reader.expect('{')
+    if reader.peek() == '}':
+        reader.expect('}')
+        return
+
+    while True:
+        child = reader.decode()
+        reader.expect(':')
+
+        if child == path[0]:
+            for element in _walk(reader, path[1:], obj, child):
+                yield element
+        else:
+            obj[child] = reader.decode()
+
+        if reader.peek() == '}':
+            reader.expect('}')
+            return
+        reader.expect(',')
@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+
+# python modules
+import datetime
+import heapq
+import threading
+import time
+import traceback
+
+# local modules
+from util import clock
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# shorthands for common specs
+ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+}
+
+# seconds in each unit of an '@every' spec
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# the range of each field of a cron spec
+FIELDS = [('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 6)]
+
+# missed runs are only counted this far back
+MAX_MISSED = 1000
+
+class Schedule(object):
+    '''
+    When a job runs, from a spec that is either a cron line in the form of
+    'minute hour day month weekday', Ex: '30 3 * * *', an alias such as
+    '@daily', or an interval such as '@every 30s', '@every 5m' or '@every 1h'.
+    '''
+    def __init__(self, spec):
+        self.spec = str(spec).strip()
+        self.interval = None
+
+        spec = ALIASES.get(self.spec, self.spec)
+        if spec.startswith('@every '):
+            value = spec[len('@every '):].strip()
+            if len(value) < 2 or value[-1] not in UNITS:
+                raise ValueError('Unknown interval in ' + self.spec + ', expected Ex: @every 5m')
+            self.interval = int(value[:-1]) * UNITS[value[-1]]
+            if self.interval <= 0:
+                raise ValueError('The interval of ' + self.spec + ' must be positive')
+            return
+
+        parts = spec.split()
+        if len(parts) != len(FIELDS):
+            raise ValueError('Unknown schedule ' + self.spec + ', expected 5 fields such as 30 3 * * *')
+
+        self.fields = {}
+        for part, (name, low, high) in zip(parts, FIELDS):
+            # 7 is also sunday
+            if name == 'weekday':
+                high = 7
+            values = _parse_field(part, low, high, self.spec)
+            if name == 'weekday' and 7 in values:
+                values.discard(7)
+                values.add(0)
+            self.fields[name] = values
+
+        # like cron, a restricted day and weekday match when either does
+        self.any_day = parts[2] == '*'
+        self.any_weekday = parts[4] == '*'
+
+    def next_time(self, after):
+        '''
+        Args:
+            after: Seconds since the epoch
+
+        Returns:
+            The first time the job runs strictly after the given time, in seconds since the epoch.
+        '''
+        if self.interval is not None:
+            return after + self.interval
+
+        dt = datetime.datetime.fromtimestamp(int(after) // 60 * 60) + datetime.timedelta(minutes=1)
+
+        # skip whole months, days and hours that do not match
+        for i in range(100000):
+            if dt.month not in self.fields['month']:
+                if dt.month == 12:
+                    dt = datetime.datetime(dt.year + 1, 1, 1)
+                else:
+                    dt = datetime.datetime(dt.year, dt.month + 1, 1)
+            elif not self._day_matches(dt):
+                dt = datetime.datetime(dt.year, dt.month, dt.day) + datetime.timedelta(days=1)
+            elif dt.hour not in self.fields['hour']:
+                dt = datetime.datetime(dt.year, dt.month, dt.day, dt.hour) + datetime.timedelta(hours=1)
+            elif dt.minute not in self.fields['minute']:
+                dt = dt + datetime.timedelta(minutes=1)
+            else:
+                return time.mktime(dt.timetuple())
+
+        raise ValueError('The schedule ' + self.spec + ' never runs')
+
+    def _day_matches(self, dt):
+        '''
+        Returns:
+            True if the day of the datetime matches the day and weekday fields.
+        '''
+        day = dt.day in self.fields['day']
+
+        # isoweekday is 7 on sunday, cron uses 0
+        weekday = (dt.isoweekday() % 7) in self.fields['weekday']
+
+        if self.any_day:
+            return weekday
+        if self.any_weekday:
+            return day
+        return day or weekday
+
+    def __str__(self):
+        return self.spec
+
+class Job(object):
+    '''
+    A job of the scheduler, with the statistics of its runs.
+    '''
+    def __init__(self, name, schedule, func, heavy=False):
+        '''
+        Args:
+            name: The name of the job
+            schedule: The Schedule of the job
+            func: The function to run, without arguments
+            heavy: True to run on the worker threads, False to run on the scheduler's thread
+        '''
+        self.name = str(name)
+        self.schedule = schedule
+        self.func = func
+        self.heavy = heavy
+
+        self.next_run = None
+        self.running = False
+
+        self.runs = 0
+        self.failures = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.last_start = None
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_error = None
+
+    def stats(self):
+        '''
+        Returns:
+            A dictionary of the statistics of this job.
+        '''
+        average = 0.0
+        if self.runs > 0:
+            average = self.total_duration / self.runs
+
+        return {
+            'name': self.name,
+            'schedule': str(self.schedule),
+            'heavy': self.heavy,
+            'running': self.running,
+            'runs': self.runs,
+            'failures': self.failures,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'last_start': self.last_start,
+            'last_duration': self.last_duration,
+            'average_duration': average,
+            'max_duration': self.max_duration,
+            'next_run': self.next_run,
+            'last_error': self.last_error,
+        }
+
+    def __str__(self):
+        return 'job=' + self.name + ', runs=' + str(self.runs) + ', failures=' + str(self.failures) + ', overruns=' + str(self.overruns) + ', skipped=' + str(self.skipped) + ', last_duration=' + ('%.3f' % self.last_duration) + ', max_duration=' + ('%.3f' % self.max_duration)
+
+class Scheduler(object):
+    '''
+    Runs jobs when they are due. The next run of every job is kept in a heap,
+    so checking for due jobs only looks at the earliest one.
+
+    Light jobs run on the thread calling run_pending(). Heavy jobs are handed
+    to a pool of worker threads so they never delay that thread. A job that is
+    still running when it is due again is not started twice: the run is
+    counted as an overrun and skipped.
+    '''
+    def __init__(self, workers=2, clock=time.time, log=None, timer=clock.monotonic):
+        '''
+        Args:
+            workers: How many threads run heavy jobs
+            clock: The function returning the current time, in seconds since the epoch
+            log: An optional function called with a message when a job fails
+            timer: The function measuring how long jobs run, in seconds
+        '''
+        self.clock = clock
+        self.timer = timer
+        self.log = log
+
+        self.jobs = {}
+        self.heap = []
+        self.counter = 0
+        self.lock = threading.Lock()
+
+        self.queue = queue.Queue()
+        self.workers = []
+        for i in range(max(int(workers), 1)):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def add_job(self, name, spec, func, heavy=False, run_now=False):
+        '''
+        Adds a job to the scheduler.
+
+        Args:
+            name: The unique name of the job
+            spec: When the job runs, see Schedule
+            func: The function to run, without arguments
+            heavy: True to run the job on the worker threads
+            run_now: True to run the job on the next run_pending(), then on schedule
+
+        Returns:
+            The Job that was added.
+        '''
+        if name in self.jobs:
+            raise ValueError('A job named ' + str(name) + ' already exists')
+
+        job = Job(name, Schedule(spec), func, heavy)
+
+        now = self.clock()
+        if run_now:
+            job.next_run = now
+        else:
+            job.next_run = job.schedule.next_time(now)
+
+        self.jobs[job.name] = job
+        self._push(job)
+        return job
+
+    def run_pending(self):
+        '''
+        Starts every job that is due.
+
+        Returns:
+            The number of jobs that were started.
+        '''
+        now = self.clock()
+        started = 0
+
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            due, count, job = heapq.heappop(self.heap)
+
+            # runs that were due while the scheduler was behind are skipped, not caught up
+            next_run = job.schedule.next_time(due)
+            missed = 0
+            while next_run <= now and missed < MAX_MISSED:
+                missed = missed + 1
+                next_run = job.schedule.next_time(next_run)
+            if next_run <= now:
+                next_run = job.schedule.next_time(now)
+            job.skipped = job.skipped + missed
+
+            with self.lock:
+                busy = job.running
+                if not busy:
+                    job.running = True
+
+            if busy:
+                job.overruns = job.overruns + 1
+                job.skipped = job.skipped + 1
+            else:
+                started = started + 1
+                if job.heavy:
+                    self.queue.put(job)
+                else:
+                    self._run(job)
+
+            job.next_run = next_run
+            self._push(job)
+
+        return started
+
+    def next_run(self):
+        '''
+        Returns:
+            When the earliest job is due, in seconds since the epoch, or None without jobs.
+        '''
+        if len(self.heap) == 0:
+            return None
+        return self.heap[0][0]
+
+    def stats(self):
+        '''
+        Returns:
+            A list with the statistics of every job, ordered by name.
+        '''
+        return [self.jobs[name].stats() for name in sorted(self.jobs)]
+
+    def stop(self):
+        '''
+        Stops the worker threads once they finish their current job.
+        '''
+        for worker in self.workers:
+            self.queue.put(None)
+
+    def _push(self, job):
+        '''
+        Adds the next run of the job to the heap.
+        '''
+        self.counter = self.counter + 1
+        heapq.heappush(self.heap, (job.next_run, self.counter, job))
+
+    def _work(self):
+        '''
+        Runs heavy jobs until stopped.
+        '''
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            self._run(job)
+
+    def _run(self, job):
+        '''
+        Runs a job, recording how long it took and whether it failed.
+        '''
+        job.last_start = self.clock()
+        start = self.timer()
+
+        try:
+            job.func()
+        except Exception as e:
+            job.failures = job.failures + 1
+            job.last_error = str(e)
+            if self.log is not None:
+                self.log('Job ' + job.name + ' failed. Error: ' + str(e) + '\n' + traceback.format_exc())
+        finally:
+            duration = max(self.timer() - start, 0.0)
+            job.runs = job.runs + 1
+            job.last_duration = duration
+            job.total_duration = job.total_duration + duration
+            job.max_duration = max(job.max_duration, duration)
+
+            with self.lock:
+                job.running = False
+
+def _parse_field(part, low, high, spec):
+    '''
+    Returns:
+        The set of values a field of a cron spec matches.
+    '''
+    values = set()
+
+    for item in part.split(','):
+        step = 1
+        if '/' in item:
+            item, step = item.split('/', 1)
+            step = int(step)
+            if step <= 0:
+                raise ValueError('Unknown step in ' + spec)
+
+        if item == '*':
+            first, last = low, high
+        elif '-' in item:
+            first, last = [int(v) for v in item.split('-', 1)]
+        else:
+            first = int(item)
+            last = first
+            if step > 1:
+                last = high
+
+        if first < low or last > high or first > last:
+            raise ValueError('Value ' + str(item) + ' out of range in ' + spec)
+
+        values.update(range(first, last + 1, step))
+
+    return values
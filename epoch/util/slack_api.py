@@ -3,6 +3,13 @@
 # python modules
 import json
 import subprocess
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
 # pip modules
 import requests
@@ -68,6 +75,111 @@ class SlackAPI(object):
         
         return self.send_json(json_contents)
 
+class BulkSender(object):
+    def __init__(self, slack, workers=4, rate=4.0, retries=3):
+        '''
+        Sends many messages concurrently through a SlackAPI, never faster than
+        the given rate, backing off when Slack answers with 429.
+
+        Args:
+            slack: The SlackAPI to send the messages with
+            workers: The number of threads sending messages
+            rate: The maximum number of messages sent per second
+            retries: How many times a rate limited message is retried
+        '''
+        self.slack = slack
+        self.workers = int(workers)
+        self.interval = 1.0 / float(rate)
+        self.retries = int(retries)
+
+        # the earliest time the next message may be sent
+        self.next_send = 0
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        '''
+        Returns:
+            The string representation for this BulkSender object.
+        '''
+        return 'BulkSender [slack=' + str(self.slack) + ', workers=' + str(self.workers) + ', interval=' + str(self.interval) + ']'
+
+    def send_all(self, messages):
+        '''
+        Sends every message, and waits for all of them to be sent.
+
+        Args:
+            messages: A list of dictionaries to send as JSON
+
+        Returns:
+            The number of messages that were sent successfully.
+        '''
+        pending = queue.Queue()
+        for m in messages:
+            pending.put(m)
+
+        sent = [0]
+        threads = []
+        for i in range(min(self.workers, len(messages))):
+            t = threading.Thread(target=self._work, args=(pending, sent))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        for t in threads:
+            t.join()
+
+        return sent[0]
+
+    def _work(self, pending, sent):
+        '''
+        Sends messages from the pending queue until it is empty.
+        '''
+        while True:
+            try:
+                json_contents = pending.get_nowait()
+            except queue.Empty:
+                return
+
+            if self._send(json_contents):
+                with self.lock:
+                    sent[0] = sent[0] + 1
+
+    def _send(self, json_contents):
+        '''
+        Sends one message, waiting for its turn under the rate limit.
+
+        Returns:
+            True if Slack accepted the message, False otherwise.
+        '''
+        for attempt in range(self.retries + 1):
+            self._wait_turn()
+
+            r = self.slack.send_json(json_contents)
+            if r is False or r is None:
+                return False
+
+            if r.status_code != 429:
+                return r.status_code < 400
+
+            # rate limited, back off for as long as Slack asks
+            delay = float(r.headers.get('Retry-After', 1))
+            with self.lock:
+                self.next_send = max(self.next_send, time.time() + delay)
+
+        return False
+
+    def _wait_turn(self):
+        '''
+        Blocks until this thread may send the next message.
+        '''
+        with self.lock:
+            now = time.time()
+            send_at = max(now, self.next_send)
+            self.next_send = send_at + self.interval
+
+        if send_at > now:
+            time.sleep(send_at - now)
+
 class Message(object):
     def __init__(self):
 
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+# python modules
+import heapq
+
+class TimerHeap(object):
+    '''
+    Deadlines keyed by an id, Ex: a user's uuid, kept in a heap so finding the
+    due ones only looks at the earliest deadlines. Each key has at most one
+    deadline, rescheduling or cancelling replaces the old one.
+    '''
+    def __init__(self):
+        self.heap = []
+        self.deadlines = {}
+        self.counter = 0
+
+    def schedule(self, key, deadline):
+        '''
+        Sets the deadline of a key, replacing its previous deadline.
+
+        Args:
+            key: The id the deadline belongs to
+            deadline: When the key is due, any value comparable to the others
+        '''
+        self.counter = self.counter + 1
+        self.deadlines[key] = (deadline, self.counter)
+        heapq.heappush(self.heap, (deadline, self.counter, key))
+
+        # replaced deadlines stay in the heap until popped, so drop them once they pile up
+        if len(self.heap) > 2 * len(self.deadlines) + 64:
+            self.heap = [(d, c, k) for k, (d, c) in self.deadlines.items()]
+            heapq.heapify(self.heap)
+
+    def cancel(self, key):
+        '''
+        Removes the deadline of a key, if it has one.
+        '''
+        self.deadlines.pop(key, None)
+
+    def deadline(self, key):
+        '''
+        Returns:
+            The deadline of the key, or None if it has none.
+        '''
+        entry = self.deadlines.get(key)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def pop_due(self, now):
+        '''
+        Removes the keys whose deadline is at or before now.
+
+        Args:
+            now: The current time, comparable to the deadlines
+
+        Returns:
+            A list of the due keys, earliest deadline first.
+        '''
+        due = []
+
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            deadline, counter, key = heapq.heappop(self.heap)
+
+            # skip deadlines that were replaced or cancelled
+            if self.deadlines.get(key) == (deadline, counter):
+                del self.deadlines[key]
+                due.append(key)
+
+        return due
+
+    def __len__(self):
+        return len(self.deadlines)